@@ -0,0 +1,278 @@
+"""
+Admission control in front of the upstream Responses API.
+
+At most ADMISSION_MAX_CONCURRENT upstream streams run at once, and they
+start no faster than the global token bucket allows. Requests beyond that
+wait in a bounded queue that is served round-robin per client (chat
+session), so one busy browser cannot starve the others. Each address also
+has its own token bucket: an address that asks faster than its rate gets a
+429 right away. The bucket is not per session, because the browser picks
+its session id.
+While a request is queued the chat endpoint sends its position
+(`event: queue`) instead of failing.
+
+Waiters can be threads (Flask) or coroutines (ASGI).
+
+Configuration (environment variables):
+    ADMISSION                   on | off (default on)
+    ADMISSION_MAX_CONCURRENT    concurrent upstream streams (default 16)
+    ADMISSION_QUEUE_SIZE        queued requests in total (default 100)
+    ADMISSION_QUEUE_PER_CLIENT  queued requests per client (default 3)
+    ADMISSION_QUEUE_TIMEOUT     seconds a request may wait (default 120)
+    ADMISSION_USER_RATE         requests per second per address, 0 = no limit (default 0.2)
+    ADMISSION_USER_BURST        burst per address (default 5)
+    ADMISSION_GLOBAL_RATE       upstream streams started per second, 0 = no limit (default 5)
+    ADMISSION_GLOBAL_BURST      burst of stream starts (default 10)
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from rate_limit import KeyedTokenBuckets, TokenBucket
+
+ADMISSION = os.getenv("ADMISSION", "on").lower()
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "100"))
+ADMISSION_QUEUE_PER_CLIENT = int(os.getenv("ADMISSION_QUEUE_PER_CLIENT", "3"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "120"))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", "0.2"))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", "5"))
+ADMISSION_GLOBAL_RATE = float(os.getenv("ADMISSION_GLOBAL_RATE", "5"))
+ADMISSION_GLOBAL_BURST = float(os.getenv("ADMISSION_GLOBAL_BURST", "10"))
+
+# How often a waiting request re-checks the queue and reports its position
+POLL_INTERVAL = 0.5
+
+WAIT_SAMPLES = 1000
+
+
+class Rejected(Exception):
+    """
+    The request is not admitted.
+
+    Attributes:
+        reason (str): 'rate_limited', 'queue_full' or 'timeout'.
+        retry_after (float): Seconds after which a retry may succeed.
+    """
+
+    def __init__(self, reason, retry_after=1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """A request's place in the admission queue."""
+
+    def __init__(self, client):
+        self.client = client
+        self.enqueued = time.monotonic()
+        self.admitted = False
+        self.released = False
+        self._event = threading.Event()
+        self._async_waiter = None  # (loop, asyncio.Event)
+
+    def _wake(self):
+        self._event.set()
+        if self._async_waiter is not None:
+            loop, event = self._async_waiter
+            loop.call_soon_threadsafe(event.set)
+
+
+class AdmissionController:
+    """
+    Concurrency cap with a fair (round-robin per client) bounded wait queue.
+
+    Args:
+        max_concurrent (int): Upstream streams allowed at once.
+        queue_size (int): Requests allowed to wait in total.
+        queue_per_client (int): Requests one client may have waiting.
+        queue_timeout (float): Seconds before a waiting request is rejected.
+        user_rate, user_burst (float): Token bucket per `check_rate` key (rate 0 = off).
+        global_rate, global_burst (float): Token bucket for starting streams (rate 0 = off).
+    """
+
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, queue_size=ADMISSION_QUEUE_SIZE,
+                 queue_per_client=ADMISSION_QUEUE_PER_CLIENT, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                 user_rate=ADMISSION_USER_RATE, user_burst=ADMISSION_USER_BURST,
+                 global_rate=ADMISSION_GLOBAL_RATE, global_burst=ADMISSION_GLOBAL_BURST):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_per_client = queue_per_client
+        self.queue_timeout = queue_timeout
+        self.user_buckets = KeyedTokenBuckets(user_rate, user_burst) if user_rate > 0 else None
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()  # client -> deque of tickets, in round-robin order
+        self._queued = 0
+        self._active = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._stats = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "timeouts": 0,
+                       "max_queue_depth": 0}
+
+    # --------- entry ---------
+
+    def check_rate(self, client):
+        """
+        Take a token from the bucket of `client` (the caller's address, see `app.rate_key`).
+
+        Raises:
+            Rejected: 'rate_limited' when the client asks too fast.
+        """
+        if self.user_buckets is None:
+            return
+        bucket = self.user_buckets[client]
+        if not bucket.try_acquire():
+            with self._lock:
+                self._stats["rate_limited"] += 1
+            raise Rejected("rate_limited", bucket.wait_time())
+
+    def enqueue(self, client):
+        """
+        Queue a request for an upstream slot; it may be admitted right away.
+
+        Raises:
+            Rejected: 'queue_full' when the queue (or the client's share) is full.
+        """
+        ticket = Ticket(client)
+        with self._lock:
+            queue = self._queues.get(client)
+            if self._queued >= self.queue_size or (queue and len(queue) >= self.queue_per_client):
+                self._stats["queue_full"] += 1
+                raise Rejected("queue_full", self.queue_timeout / 4)
+            if queue is None:
+                queue = self._queues[client] = deque()
+            queue.append(ticket)
+            self._queued += 1
+            self._dispatch()
+            if not ticket.admitted:
+                self._stats["queued"] += 1
+                self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queued)
+        return ticket
+
+    # --------- scheduling (caller holds the lock) ---------
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._queues and self._active < self.max_concurrent:
+            if self.global_bucket is not None and not self.global_bucket.try_acquire():
+                break
+            client, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(client)
+            else:
+                del self._queues[client]
+            self._queued -= 1
+            self._active += 1
+            ticket.admitted = True
+            self._stats["admitted"] += 1
+            self._waits.append(now - ticket.enqueued)
+            ticket._wake()
+
+    def _remove(self, ticket):
+        queue = self._queues.get(ticket.client)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._queued -= 1
+            if not queue:
+                del self._queues[ticket.client]
+
+    def _position(self, ticket):
+        """1-based place in the round-robin order, 0 once admitted."""
+        if ticket.admitted:
+            return 0
+        own = self._queues.get(ticket.client)
+        if not own or ticket not in own:
+            return 0
+        rounds = own.index(ticket)
+        ahead, before = 0, True
+        for client, queue in self._queues.items():
+            if client == ticket.client:
+                before = False
+                continue
+            ahead += min(len(queue), rounds + 1 if before else rounds)
+        return ahead + rounds + 1
+
+    # --------- waiting ---------
+
+    def _poll(self, ticket):
+        """Re-check the queue; returns the position, raises Rejected after the timeout."""
+        with self._lock:
+            self._dispatch()
+            if ticket.admitted:
+                return 0
+            if time.monotonic() - ticket.enqueued > self.queue_timeout:
+                self._remove(ticket)
+                self._stats["timeouts"] += 1
+                raise Rejected("timeout", self.queue_timeout / 4)
+            return self._position(ticket)
+
+    def positions(self, ticket):
+        """
+        Block until `ticket` is admitted, yielding its queue position whenever it changes.
+
+        Raises:
+            Rejected: 'timeout' after ADMISSION_QUEUE_TIMEOUT seconds.
+        """
+        last = None
+        while True:
+            position = self._poll(ticket)
+            if not position:
+                return
+            if position != last:
+                last = position
+                yield position
+            ticket._event.wait(POLL_INTERVAL)
+            ticket._event.clear()
+
+    async def apositions(self, ticket):
+        """Async counterpart of `positions`."""
+        event = asyncio.Event()
+        ticket._async_waiter = (asyncio.get_running_loop(), event)
+        last = None
+        while True:
+            event.clear()
+            position = self._poll(ticket)
+            if not position:
+                return
+            if position != last:
+                last = position
+                yield position
+            try:
+                await asyncio.wait_for(event.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, ticket):
+        """Give the slot of an admitted ticket back (or drop a waiting one)."""
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.admitted:
+                self._active -= 1
+            else:
+                self._remove(ticket)
+            self._dispatch()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                **self._stats,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "wait_avg_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "wait_p95_s": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+                "wait_max_s": round(waits[-1], 3) if waits else 0.0,
+            }
+
+
+def make_controller():
+    """Create the controller selected by `ADMISSION`, or None when it is off."""
+    if ADMISSION in ("off", "0", "false", "none"):
+        return None
+    return AdmissionController()
@@ -1,25 +1,42 @@
-from flask import Flask, render_template, request, Response, jsonify
+from flask import Flask, render_template, request, Response, jsonify, send_file, abort
 from dotenv import load_dotenv
-import os, json, requests, re
-
-# Initialize the Flask application
-app = Flask(__name__)
+import os, json, requests, re, time
 
 # Load environment variables from a .env file
+# (before the local modules below read their configuration)
 load_dotenv()
 
+import admission
+import conversation_store
+import document_index
+import hybrid_search
+import intent_classifier
+import local_index
+import metrics
+import response_cache
+import semantic_cache
+import single_flight
+import sse_relay
+import upstream
+
+# Initialize the Flask application
+app = Flask(__name__)
+
 # Retrieve API keys and configuration from environment variables
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 VECTOR_STORE_ID = os.getenv("VECTOR_STORE_ID")
 
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_URL = f"{OPENAI_BASE_URL}/responses"
+OPENAI_MODEL = "gpt-4.1-mini-2025-04-14"
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
 
-def custom_rag(user_input):
-    assistant_instructions = (
+ASSISTANT_INSTRUCTIONS = (
         """
         Je bent een digitale assistent in de onderwijssector. Je naam is Ella, wat staat voor Education & Learning Assistant. 
 
@@ -56,66 +73,504 @@ def custom_rag(user_input):
         •	Tutoyeer: Bij het beantwoorden van de vragen, wordt de gebruiker aangesproken in de je-vorm.
                 
         """
-    )
+)
 
+
+def build_payload(user_input, file_search=True, previous_response_id=None):
+    """
+    Build the streamed Responses API request body for a conversation.
+
+    Args:
+        user_input: The conversation history as sent by the browser.
+        file_search (bool): Attach the hosted file_search tool. Off when the
+            passages were already retrieved locally and put in `user_input`.
+        previous_response_id (str, optional): Continue a stored response, so
+            `user_input` only holds the new question.
+
+    Returns:
+        dict: JSON payload for `OPENAI_URL`.
+    """
     payload = {
-        "model": "gpt-4.1-mini-2025-04-14",
+        "model": OPENAI_MODEL,
         "input": user_input,
-        "instructions": assistant_instructions,
+        "instructions": ASSISTANT_INSTRUCTIONS,
         "stream": True,
-        "tools": [
+    }
+    if file_search:
+        payload["tools"] = [
             {
                 "type": "file_search",
                 "vector_store_ids": [VECTOR_STORE_ID],
                 "max_num_results": 10
             }
-        ],
-        "include":["file_search_call.results"]
-    }
+        ]
+        payload["include"] = ["file_search_call.results"]
+    if previous_response_id:
+        payload["previous_response_id"] = previous_response_id
+    return payload
+
+
+def last_user_text(user_input):
+    """Return the content of the latest user message (or the plain string input)."""
+    if isinstance(user_input, str):
+        return user_input
+    for message in reversed(user_input or []):
+        if isinstance(message, dict) and message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def with_context(user_input, context):
+    """Append retrieved passages to the latest user message."""
+    if isinstance(user_input, str):
+        return user_input + '\n' + context
+    messages = [dict(m) for m in user_input]
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            message["content"] = (message.get("content") or "") + '\n' + context
+            break
+    return messages
+
+
+# Small-talk check before retrieval, trained at startup (None when disabled)
+intent = intent_classifier.get_classifier()
+
+
+def needs_retrieval(text):
+    """Whether `text` needs the knowledge base; always True with the classifier off."""
+    if intent is None:
+        return True
+    t0 = time.perf_counter()
+    retrieve, _ = intent.needs_retrieval(text)
+    metrics.intent_seconds.observe(time.perf_counter() - t0)
+    metrics.intent_total.inc("retrieve" if retrieve else "skip")
+    return retrieve
+
+
+def prepare_payload(user_input, previous_response_id=None):
+    """
+    Build the payload for a chat request according to `RETRIEVAL_MODE`.
+
+    With 'hosted' the model searches the vector store through file_search.
+    With 'local' (vector search) or 'hybrid' (BM25 + vector, see
+    `hybrid_search`) the passages are retrieved in-process first and sent
+    along with the question, so their filenames are known before streaming.
+    Small talk (see `intent_classifier`) is sent without any retrieval.
+
+    Returns:
+        tuple: (payload dict, set of source filenames already known)
+    """
+    question = last_user_text(user_input)
+    if not needs_retrieval(question):
+        return build_payload(user_input, file_search=False, previous_response_id=previous_response_id), set()
+
+    mode = local_index.RETRIEVAL_MODE
+    if mode not in ("local", "hybrid"):
+        return build_payload(user_input, previous_response_id=previous_response_id), set()
+
+    retriever = hybrid_search.get_retriever() if mode == "hybrid" else local_index.get_index()
+    results = retriever.search(question)
+    context, file_names = local_index.format_context(results)
+    payload = build_payload(with_context(user_input, context), file_search=False,
+                            previous_response_id=previous_response_id)
+    return payload, set(file_names)
+
 
-    headers = {
+# Server-side conversation history per chat session (None when disabled)
+conversations = conversation_store.make_store()
+
+
+def begin_turn(user_input, session_id):
+    """
+    Swap the browser's history for the server-side conversation of `session_id`.
+
+    Without a session id (or with the store disabled) the browser's history
+    is used as before.
+
+    Returns:
+        tuple: (input for `prepare_payload`, previous_response_id or None,
+        `finish(answer, response_id=None)` that records the answer; an
+        answer of None drops the turn, for a request that was never sent)
+    """
+    if conversations is None or not conversation_store.valid_session_id(session_id):
+        return user_input, None, lambda answer, response_id=None: None
+
+    history = user_input if isinstance(user_input, list) else None
+    messages, previous_response_id = conversations.start_turn(session_id, last_user_text(user_input), history)
+
+    def finish(answer, response_id=None):
+        if answer is None:
+            conversations.cancel_turn(session_id)
+        else:
+            conversations.finish_turn(session_id, answer, response_id)
+
+    return messages, previous_response_id, finish
+
+
+def build_headers():
+    return {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json"
     }
 
-    openai_url = "https://api.openai.com/v1/responses"
 
-    sources = set()
+# Returned by `handle_upstream_line` when the upstream sent its [DONE] marker
+STREAM_END = sse_relay.DONE
+
+# Frame that tells the browser the answer text is complete
+SSE_DONE = "event: done\ndata: {}\n\n"
+
+
+def sse_delta(delta):
+    return sse_relay.delta_frame(delta)
+
+
+def coalesced(deltas, batcher=None):
+    """
+    `sse_delta` frames for `deltas`, merged per `sse_relay.DeltaBatcher` window.
+
+    A None in `deltas` (a tick, see `sse_relay.with_ticks`) sends the pending text.
+    """
+    batcher = batcher or sse_relay.DeltaBatcher()
+    for delta in deltas:
+        frame = batcher.flush() if delta is None else batcher.add(delta)
+        if frame:
+            yield frame
+    frame = batcher.flush()
+    if frame:
+        yield frame
+
+
+def sse_response(frames, trace, accept_encoding=""):
+    """Streaming SSE response, compressed when enabled and accepted by the browser."""
+    response = Response(metrics.traced(frames, trace), mimetype="text/event-stream")
+    coding = sse_relay.negotiate_encoding(accept_encoding)
+    if coding:
+        response.response = sse_relay.compress_frames(response.response, coding)
+        response.headers["Content-Encoding"] = coding
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def sse_sources(sources):
+    return f"sources: {json.dumps(sorted(sources))}\n\n"
+
+
+def sse_queue(position):
+    """Frame with the request's place in the admission queue."""
+    return f"event: queue\ndata: {json.dumps({'position': position})}\n\n"
+
+
+def sse_error(reason, retry_after=None):
+    """Frame that ends a stream that cannot be answered (busy, upstream failure)."""
+    return f"event: error\ndata: {json.dumps({'error': reason, 'retry_after': retry_after})}\n\n"
+
+
+# Near-duplicate question cache, only for answers of the current model/instructions/store
+semantic = semantic_cache.make_cache(response_cache.cache_key(
+    build_payload(None, file_search=local_index.RETRIEVAL_MODE == "hosted"), VECTOR_STORE_ID))
+
+
+def lookup_cached_answer(payload, user_input):
+    """
+    Look a request up in the exact-match and the semantic answer cache.
+
+    Args:
+        payload (dict): Payload as built by `build_payload`.
+        user_input: The conversation history as sent by the browser.
+
+    Returns:
+        tuple: The cached answer (or None) and, on a miss, a callable
+        `remember(deltas, sources)` that stores the fresh answer in the
+        enabled caches.
+    """
+    cache = response_cache.cache
+    key = None
+    if cache is not None:
+        key = response_cache.cache_key(payload, VECTOR_STORE_ID)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, None
+
+    # A chained request holds only the follow-up question, which is not a standalone one
+    question = None
+    if semantic is not None and not payload.get("previous_response_id"):
+        question = semantic_cache.latest_user_turn(user_input)
+    vector = None
+    if question is not None:
+        try:
+            vector = semantic.embed(question)
+        except requests.RequestException as e:
+            print("semantic cache: embedding failed:", e)
+        else:
+            cached = semantic.lookup(vector)
+            if cached is not None:
+                return cached, None
+
+    def remember(deltas, sources):
+        if cache is not None:
+            cache.set(key, deltas, sources)
+        if vector is not None:
+            semantic.add(question, vector, deltas, sources)
+
+    return None, remember
+
+
+def replay_cached(cached):
+    """Replay a cached answer with the same frames as a live stream."""
+    yield from coalesced(cached["deltas"])
+    yield SSE_DONE
+    yield sse_sources(cached["sources"])
+
+
+def handle_upstream_line(raw, sources, meta=None):
+    """
+    Interpret a single line of the upstream Responses SSE stream.
+
+    Filenames from a finished file_search call are added to `sources`, and
+    the id of the completed response is stored in `meta["response_id"]`
+    (and the moment the file_search call was done in `meta["file_search_at"]`).
+
+    Args:
+        raw (bytes | str): The line; only the events the relay uses are decoded
+            (see `sse_relay.parse_data_line`).
+
+    Returns:
+        The text delta carried by the line, `STREAM_END` when the upstream
+        signals the end of the stream, or None for any other line.
+    """
+    chunk = sse_relay.parse_data_line(raw)
+    if chunk is None or chunk is STREAM_END:
+        return chunk
+
+    # 1) Stream the assistant text as you already do
+    if chunk.get("type") == "response.output_text.delta":
+        return chunk["delta"]
+
+    # 2) collect filenames from the file_search call result frame
+    if chunk.get("type") == "response.output_item.done":
+        item = chunk.get("item", {})
+        if item.get("type") == "file_search_call":
+            if meta is not None:
+                meta["file_search_at"] = time.perf_counter()
+            results = item.get("results") or []
+            for r in results:
+                fn = r.get("filename")
+                if fn:
+                    sources.add(fn)
+
+    if chunk.get("type") == "response.completed" and meta is not None:
+        meta["response_id"] = chunk.get("response", {}).get("id")
+    return None
+
+
+# Identical requests that are streaming right now (None when disabled)
+flights = single_flight.make_single_flight()
+
+
+def join_flight(payload):
+    """
+    Lead or follow the in-flight request for `payload`.
+
+    Returns:
+        tuple: (key, `single_flight.Flight`, True when the caller leads). With
+        coalescing disabled every caller leads a private flight.
+    """
+    key = response_cache.cache_key(payload, VECTOR_STORE_ID)
+    if flights is None:
+        return key, single_flight.Flight(), True
+    flight, leader = flights.join(key)
+    return key, flight, leader
+
+
+def land_flight(key, flight):
+    if flights is not None:
+        flights.land(key, flight)
+
+
+def follow_flight(flight, finish, trace):
+    """Relay the answer of an identical request that is already streaming."""
+    deltas = []
+    trace.outcome = "coalesced"
+
+    batcher = sse_relay.DeltaBatcher()
+
+    def received():
+        for delta in flight.follow(batcher.timeout):
+            if delta is not None:
+                deltas.append(delta)
+            yield delta
+
+    try:
+        yield from coalesced(received(), batcher)
+    except single_flight.FlightError:
+        # Nothing relayed (e.g. the leader was refused a slot): drop the turn
+        finish("".join(deltas) if deltas else None)
+        trace.outcome = "error"
+        yield sse_error("upstream")
+        return
+    except BaseException:
+        finish("".join(deltas) if deltas else None)
+        raise
+    # Same payload, so the leader's stored response continues this conversation too
+    finish("".join(deltas), flight.response_id)
+    trace.sources = len(flight.sources)
+    yield SSE_DONE
+    yield sse_sources(flight.sources)
+
+
+# Concurrency cap, fair queue and rate limits for upstream streams (None when disabled)
+admission_control = admission.make_controller()
+
+
+def client_key(session_id, remote_addr):
+    """Whose turn a request is in the fair queue: the chat session, else the address."""
+    if conversation_store.valid_session_id(session_id):
+        return f"session:{session_id}"
+    return f"addr:{remote_addr}"
+
+
+def rate_key(remote_addr):
+    """
+    Whose token bucket a request takes from: the address. Not the session,
+    which the browser chooses, so a fresh id per request would get a full bucket.
+    """
+    return f"addr:{remote_addr}"
+
+
+def custom_rag(user_input, session_id=None, client=None, accept_encoding=""):
+    trace = metrics.RequestTrace(local_index.RETRIEVAL_MODE)
+    user_input, previous_response_id, finish = begin_turn(user_input, session_id)
+    payload, sources = prepare_payload(user_input, previous_response_id)
+    headers = build_headers()
+
+    cached, remember = lookup_cached_answer(payload, user_input)
+    trace.mark("retrieval")
+    if cached is not None:
+        finish("".join(cached["deltas"]))
+        trace.outcome = "cache_hit"
+        trace.sources = len(cached["sources"])
+        return sse_response(replay_cached(cached), trace, accept_encoding)
+
+    deltas = []
 
     def event_stream():
-        resp = requests.post(openai_url, headers=headers, json=payload, stream=True)
-        resp.raise_for_status()
-
-        for raw in resp.iter_lines(decode_unicode=True):
-            if not raw or not raw.startswith("data: "):
-                continue
-            data = raw[6:].strip()
-            if data == "[DONE]":
-                break
-
-            chunk = json.loads(data)
-
-            # 1) Stream the assistant text as you already do
-            if chunk.get("type") == "response.output_text.delta":
-                delta = chunk["delta"]
-                yield f"data: {json.dumps({'content': delta})}\n\n"
-
-            # 2) collect filenames from the file_search call result frame
-            if chunk.get("type") == "response.output_item.done":
-                item = chunk.get("item", {})
-                if item.get("type") == "file_search_call":
-                    results = item.get("results") or []
-                    for r in results:
-                        fn = r.get("filename")
-                        if fn:
-                            sources.add(fn)
+        # Joined inside the generator: a response that is never iterated
+        # must not leave a flight behind that nobody finishes
+        key, flight, leader = join_flight(payload)
+        if not leader:
+            yield from follow_flight(flight, finish, trace)
+            return
+
+        meta = {}
+        detached = False
+        ticket = None
+        # Off by default here: merging needs a reader thread per stream (see sse_relay)
+        batcher = sse_relay.DeltaBatcher(sse_relay.SSE_FLASK_COALESCE_MS)
+        try:
+            if admission_control is not None:
+                # Wait for an upstream slot, telling the browser its place in the queue
+                trace.start_phase()
+                ticket = admission_control.enqueue(client)
+                for position in admission_control.positions(ticket):
+                    yield sse_queue(position)
+                trace.phase("queue")
+
+            trace.start_phase()
+            with upstream.post(OPENAI_URL, headers=headers, json=payload, stream=True) as resp:
+                trace.phase("connect")
+                resp.raise_for_status()
+
+                # Read up to the end of the body (also past [DONE]) so the
+                # keep-alive connection goes back to the pool. Lines stay bytes:
+                # most are skipped without being decoded. With coalescing
+                # (SSE_FLASK_COALESCE_MS) the lines are read on a helper thread,
+                # so pending text is sent when its window ends even while the
+                # upstream pauses
+                lines = resp.iter_lines()
+                if batcher.window:
+                    lines = sse_relay.with_ticks(lines, batcher.timeout)
+                for raw in lines:
+                    if raw is None:
+                        frame = batcher.flush()
+                        if frame is not None and not detached:
+                            try:
+                                yield frame
+                            except GeneratorExit:
+                                if not flight.followers:
+                                    raise
+                                detached = True
+                        continue
+                    delta = handle_upstream_line(raw, sources, meta)
+                    if delta is not None and delta is not STREAM_END:
+                        deltas.append(delta)
+                        flight.publish(delta)
+                        if detached:
+                            continue
+                        frame = batcher.add(delta)
+                        if frame is None:
+                            continue
+                        try:
+                            yield frame
+                        except GeneratorExit:
+                            # The browser went away; keep streaming for the followers
+                            if not flight.followers:
+                                raise
+                            detached = True
+        except admission.Rejected as e:
+            finish(None)
+            flight.fail(e)
+            land_flight(key, flight)
+            trace.outcome = "busy"
+            yield sse_error("busy", round(e.retry_after, 1))
+            return
+        except requests.RequestException as e:
+            # Upstream failure (HTTP error status, connection lost): end the
+            # stream with an error frame, as the ASGI app does, instead of
+            # cutting off a response that has already started
+            finish("".join(deltas) if deltas else None)
+            flight.fail(e)
+            land_flight(key, flight)
+            trace.outcome = "error"
+            print(f"upstream error: {e}")
+            if detached:
+                return
+            frame = batcher.flush()
+            if frame:
+                yield frame
+            yield sse_error("upstream")
+            return
+        except BaseException as e:
+            # Keep the part the user saw, it cannot be chained to upstream;
+            # without any text there is no answer to keep
+            finish("".join(deltas) if deltas else None)
+            flight.fail(e)
+            land_flight(key, flight)
+            raise
+        finally:
+            if ticket is not None:
+                admission_control.release(ticket)
+        finish("".join(deltas), meta.get("response_id"))
+        if "file_search_at" in meta:
+            trace.mark("file_search", meta["file_search_at"])
+        trace.sources = len(sources)
+
+        # Only complete answers are cached; an aborted stream never gets here
+        remember(deltas, sources)
+        flight.finish(sources, meta.get("response_id"))
+        land_flight(key, flight)
+        if detached:
+            return
 
         # Final frames
-        yield "event: done\ndata: {}\n\n"
+        frame = batcher.flush()
+        if frame:
+            yield frame
+        yield SSE_DONE
         print(sources)
-        yield f"sources: {json.dumps(sorted(sources))}\n\n"
+        yield sse_sources(sources)
 
-    return Response(event_stream(), mimetype="text/event-stream")
+    return sse_response(event_stream(), trace, accept_encoding)
 
 
 @app.route('/api/openai/response', methods=['POST'])
@@ -124,7 +579,9 @@ def call_custom_rag():
     HTTP endpoint to process user input via the custom RAG pipeline.
 
     Expects a JSON payload with a 'text' field containing the conversation
-    history. Passes this to `custom_rag` and returns the model output as JSON.
+    history and optionally a 'session_id', which makes the server use its own
+    copy of the conversation (see `conversation_store`). Passes this to
+    `custom_rag` and returns the model output as JSON.
 
     Returns:
         A JSON response containing either:
@@ -132,12 +589,105 @@ def call_custom_rag():
           - 'error': Error details if the request to OpenAI failed.
     """
     user_input = request.json.get('text')
-    return custom_rag(user_input)
+    session_id = request.json.get('session_id')
+    client = client_key(session_id, request.remote_addr)
+    if admission_control is not None:
+        try:
+            admission_control.check_rate(rate_key(request.remote_addr))
+        except admission.Rejected as e:
+            response = jsonify({"error": "Te veel vragen achter elkaar, probeer het zo opnieuw."})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(max(1, round(e.retry_after)))
+            return response
+    return custom_rag(user_input, session_id, client, request.headers.get("Accept-Encoding", ""))
+
+
+# Filename -> file of the documents cited in answers, built at startup
+documents = document_index.DocumentIndex()
+
+
+@app.route('/docs/<path:filename>')
+def download_document(filename):
+    """
+    Serve a cited document by the filename in the `sources:` frame.
+
+    Supports Range requests, ETag/Last-Modified revalidation (304) and
+    Cache-Control; the file body goes out through the server's
+    `wsgi.file_wrapper` (sendfile under e.g. gunicorn) when it has one.
+    """
+    document = documents.lookup(filename)
+    if document is None:
+        abort(404)
+    return send_file(
+        document.path,
+        mimetype=document.mimetype,
+        download_name=document.name,
+        conditional=True,
+        etag=document.etag,
+        last_modified=document.mtime,
+        max_age=document_index.DOCS_MAX_AGE,
+    )
+
+
+@app.route('/api/conversation/reset', methods=['POST'])
+def reset_conversation():
+    """Forget the server-side history of the session in the JSON body ('session_id')."""
+    session_id = (request.get_json(silent=True) or {}).get('session_id')
+    if conversations is not None and conversation_store.valid_session_id(session_id):
+        conversations.reset(session_id)
+    return jsonify({"ok": True})
+
+
+@app.route('/api/stats')
+def stats():
+    """
+    Runtime counters as JSON.
+
+    - 'upstream': connection pool keep-alive hits, misses, reconnects, retries.
+    - 'response_cache': answer cache hits, misses and evictions.
+    - 'semantic_cache': near-duplicate hits, misses and stored questions.
+    - 'conversations': sessions, turns, chained requests, history tokens sent and dropped.
+    - 'single_flight': requests that opened an upstream stream (leaders) or
+      joined an identical one (followers).
+    - 'admission': active streams, queue depth, rejections and queue wait times.
+    - 'latency': p50/p95 of time to first token, file_search, upstream
+      connect and total duration (the full histograms are at /metrics).
+    """
+    cache = response_cache.cache
+    return jsonify({
+        "upstream": upstream.stats.snapshot(),
+        "response_cache": cache.stats.snapshot() if cache is not None else None,
+        "semantic_cache": semantic.stats() if semantic is not None else None,
+        "conversations": conversations.stats() if conversations is not None else None,
+        "single_flight": flights.stats() if flights is not None else None,
+        "admission": admission_control.stats() if admission_control is not None else None,
+        "latency": metrics.summary(),
+    })
+
+
+# Gauges and counters of the components above, read when /metrics is scraped
+metrics.registry.callback(
+    "rag_upstream_connections_total", "Upstream requests by connection pool event.", "counter",
+    lambda: {(("event", k),): v for k, v in upstream.stats.snapshot().items()})
+metrics.registry.callback(
+    "rag_admission_active", "Upstream streams running.", "gauge",
+    lambda: admission_control.stats()["active"] if admission_control is not None else None)
+metrics.registry.callback(
+    "rag_admission_queue_depth", "Requests waiting for an upstream slot.", "gauge",
+    lambda: admission_control.stats()["queue_depth"] if admission_control is not None else None)
+metrics.registry.callback(
+    "rag_single_flight_in_flight", "Distinct upstream streams open.", "gauge",
+    lambda: flights.stats()["in_flight"] if flights is not None else None)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Latency histograms and counters in the Prometheus text format."""
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
-    # run the document server:
-    # cd "C:/Users/20203666/Documents/RIF/RIF alle documenten"
-    # python -m http.server 7000
+    # Cited documents are served from DOCS_DIRS at /docs/<filename>
     # Run the Flask development server on port 8000, accessible from any host
+    # (for many concurrent chats use the ASGI entry point: `uvicorn asgi_app:asgi`)
     app.run(host="0.0.0.0", port=8000, debug=False)
@@ -0,0 +1,319 @@
+"""
+ASGI entry point for serving many concurrent chat streams from one process.
+
+The Flask app keeps serving the page and the static files (wrapped with
+`WsgiToAsgi`), only `POST /api/openai/response` is handled natively: the
+upstream Responses stream is relayed on the non-blocking httpx client from
+`upstream`, so an open chat costs a coroutine instead of a worker thread.
+
+Run with:
+    uvicorn asgi_app:asgi --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import json
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+import admission
+import local_index
+import metrics
+import sse_relay
+import upstream
+from single_flight import FlightError
+
+from app import (
+    app as flask_app,
+    admission_control,
+    OPENAI_URL,
+    STREAM_END,
+    SSE_DONE,
+    begin_turn,
+    client_key,
+    rate_key,
+    prepare_payload,
+    build_headers,
+    handle_upstream_line,
+    join_flight,
+    land_flight,
+    lookup_cached_answer,
+    replay_cached,
+    sse_error,
+    sse_queue,
+    sse_sources,
+)
+
+SSE_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+]
+
+wsgi = WsgiToAsgi(flask_app)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+async def watch_disconnect(receive, disconnected):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            disconnected.set()
+            return
+
+
+async def send_json(send, status, obj, headers=()):
+    body = json.dumps(obj).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_frame(send, frame, more_body=True, trace=None):
+    if trace is not None:
+        trace.frame(frame, delta=frame.startswith("data: "))
+    await send({"type": "http.response.body", "body": frame.encode(), "more_body": more_body})
+
+
+async def follow_flight(receive, send, flight, finish, trace):
+    """Async counterpart of `app.follow_flight`."""
+    deltas = []
+    recorded = False
+    trace.outcome = "coalesced"
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+    await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+    batcher = sse_relay.DeltaBatcher()
+    try:
+        async for delta in sse_relay.awith_ticks(flight.afollow(), batcher.timeout):
+            if disconnected.is_set():
+                return
+            if delta is None:
+                frame = batcher.flush()
+                if frame:
+                    await send_frame(send, frame, trace=trace)
+                continue
+            deltas.append(delta)
+            frame = batcher.add(delta)
+            if frame:
+                await send_frame(send, frame, trace=trace)
+        frame = batcher.flush()
+        if frame:
+            await send_frame(send, frame, trace=trace)
+        finish("".join(deltas), flight.response_id)
+        recorded = True
+        trace.sources = len(flight.sources)
+        await send_frame(send, SSE_DONE, trace=trace)
+        await send_frame(send, sse_sources(flight.sources), more_body=False, trace=trace)
+    except FlightError:
+        # Nothing relayed (e.g. the leader was refused a slot): drop the turn
+        finish("".join(deltas) if deltas else None)
+        recorded = True
+        trace.outcome = "error"
+        if not disconnected.is_set():
+            await send_frame(send, sse_error("upstream"), more_body=False, trace=trace)
+    finally:
+        watcher.cancel()
+        if not recorded:
+            finish("".join(deltas) if deltas else None)
+        trace.finish("aborted" if disconnected.is_set() else None)
+
+
+async def rag_response(scope, receive, send):
+    """
+    Async counterpart of `app.call_custom_rag`.
+
+    Streams the same `data:` / `event: done` / `sources:` frames as the
+    Flask endpoint, and stops relaying as soon as the browser goes away.
+    """
+    headers = dict(scope.get("headers") or [])
+    coding = sse_relay.negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+    if coding:
+        send = sse_relay.compressing_send(send, coding)
+    body = await read_body(receive)
+    if body is None:
+        return
+    try:
+        request = json.loads(body or b"{}")
+    except ValueError:
+        await send_json(send, 400, {"error": "invalid JSON body"})
+        return
+    remote_addr = (scope.get("client") or ("?",))[0]
+    client = client_key(request.get("session_id"), remote_addr)
+    if admission_control is not None:
+        try:
+            admission_control.check_rate(rate_key(remote_addr))
+        except admission.Rejected as e:
+            retry_after = str(max(1, round(e.retry_after))).encode()
+            await send_json(send, 429, {"error": "Te veel vragen achter elkaar, probeer het zo opnieuw."},
+                            [(b"retry-after", retry_after)])
+            return
+    trace = metrics.RequestTrace(local_index.RETRIEVAL_MODE)
+    user_input, previous_response_id, finish = begin_turn(request.get("text"), request.get("session_id"))
+
+    # Retrieval and cache lookups may embed the question over HTTP,
+    # keep them off the event loop
+    payload, sources = await asyncio.to_thread(prepare_payload, user_input, previous_response_id)
+    cached, remember = await asyncio.to_thread(lookup_cached_answer, payload, user_input)
+    trace.mark("retrieval")
+    if cached is not None:
+        finish("".join(cached["deltas"]))
+        frames = list(replay_cached(cached))
+        for frame in frames:
+            trace.frame(frame, delta=frame.startswith("data: "))
+        trace.sources = len(cached["sources"])
+        await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+        await send_frame(send, "".join(frames), more_body=False)
+        trace.finish("cache_hit")
+        return
+
+    key, flight, leader = join_flight(payload)
+    if not leader:
+        await follow_flight(receive, send, flight, finish, trace)
+        return
+
+    deltas = []
+    meta = {}
+    started = recorded = False
+    ticket = None
+    batcher = sse_relay.DeltaBatcher()
+
+    disconnected = asyncio.Event()
+    watcher = asyncio.create_task(watch_disconnect(receive, disconnected))
+    try:
+        if admission_control is not None:
+            # Wait for an upstream slot, telling the browser its place in the queue
+            trace.start_phase()
+            ticket = admission_control.enqueue(client)
+            async for position in admission_control.apositions(ticket):
+                if disconnected.is_set() and not flight.followers:
+                    return
+                if not started:
+                    await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+                    started = True
+                await send_frame(send, sse_queue(position), trace=trace)
+            trace.phase("queue")
+
+        trace.start_phase()
+        async with upstream.async_stream_post(OPENAI_URL, headers=build_headers(), json=payload) as resp:
+            trace.phase("connect")
+            if resp.status_code >= 400:
+                await resp.aread()
+                flight.fail(f"HTTP {resp.status_code}")
+                trace.outcome = "error"
+                if started:
+                    await send_frame(send, sse_error("upstream"), more_body=False, trace=trace)
+                else:
+                    await send_json(send, 502, {"error": f"OpenAI returned HTTP {resp.status_code}"})
+                return
+
+            if not started:
+                await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+                started = True
+
+            # Read up to the end of the body (also past [DONE]) so the
+            # keep-alive connection goes back to the pool
+            lines = resp.aiter_lines()
+            if batcher.window:
+                lines = sse_relay.awith_ticks(lines, batcher.timeout)
+            async for raw in lines:
+                if disconnected.is_set() and not flight.followers:
+                    return
+                if raw is None:
+                    # Coalescing window over while the upstream pauses
+                    frame = batcher.flush()
+                    if frame and not disconnected.is_set():
+                        await send_frame(send, frame, trace=trace)
+                    continue
+                delta = handle_upstream_line(raw, sources, meta)
+                if delta is not None and delta is not STREAM_END:
+                    deltas.append(delta)
+                    flight.publish(delta)
+                    frame = batcher.add(delta)
+                    if frame and not disconnected.is_set():
+                        await send_frame(send, frame, trace=trace)
+
+        finish("".join(deltas), meta.get("response_id"))
+        recorded = True
+        if "file_search_at" in meta:
+            trace.mark("file_search", meta["file_search_at"])
+        trace.sources = len(sources)
+        await asyncio.to_thread(remember, deltas, sources)
+        flight.finish(sources, meta.get("response_id"))
+        if disconnected.is_set():
+            return
+
+        # Final frames
+        frame = batcher.flush()
+        if frame:
+            await send_frame(send, frame, trace=trace)
+        await send_frame(send, SSE_DONE, trace=trace)
+        await send_frame(send, sse_sources(sources), more_body=False, trace=trace)
+    except admission.Rejected as e:
+        finish(None)
+        recorded = True
+        flight.fail(e)
+        trace.outcome = "busy"
+        if not started:
+            await send({"type": "http.response.start", "status": 200, "headers": SSE_HEADERS})
+        await send_frame(send, sse_error("busy", round(e.retry_after, 1)), more_body=False, trace=trace)
+    except httpx.HTTPError as e:
+        trace.outcome = "error"
+        if not started:
+            await send_json(send, 502, {"error": str(e)})
+        elif not disconnected.is_set():
+            await send_frame(send, sse_error("upstream"), more_body=False, trace=trace)
+    finally:
+        watcher.cancel()
+        if disconnected.is_set():
+            trace.outcome = "aborted"
+        elif not recorded and trace.outcome == "ok":
+            trace.outcome = "error"
+        trace.finish()
+        if ticket is not None:
+            admission_control.release(ticket)
+        if not recorded:
+            # Interrupted: keep the part that was relayed, without chaining to it;
+            # a request that failed before any text has no answer to keep
+            finish("".join(deltas) if deltas else None)
+        flight.fail("upstream stream ended early")  # no-op after flight.finish
+        land_flight(key, flight)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await upstream.aclose_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def asgi(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif (scope["type"] == "http"
+          and scope["path"] == "/api/openai/response"
+          and scope["method"] == "POST"):
+        await rag_response(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(asgi, host="0.0.0.0", port=8000)
@@ -0,0 +1,444 @@
+"""
+Batch generation of answers (e.g. a lesson plan per technology) outside the chat.
+
+A run is a list of prompts kept in a SQLite job store together with the
+status, output, sources, latency and token usage of every job. Jobs are
+sent with the same payload as the chat (`app.prepare_payload`: same
+instructions, retrieval and file_search) but without streaming, by a
+bounded pool of workers. A run that is interrupted continues where it
+left off when started again: finished jobs are kept, unfinished and
+failed ones are retried.
+
+With --mode batch the jobs go through the provider's Batch API instead
+(half the price, results within 24 hours). The batch id is stored with
+the run, so a restarted run keeps polling the same batch.
+
+Usage:
+    python batch_jobs.py run --tech [--template "...{technologie}..."] [--workers 4] [--mode stream|batch]
+    python batch_jobs.py run --prompts prompts.txt [--run-id NAME]
+    python batch_jobs.py report --run-id NAME
+    python batch_jobs.py export --run-id NAME --out-dir lesplannen
+
+Configuration (environment variables):
+    BATCH_STORE          SQLite job store (default batch_jobs.sqlite3)
+    BATCH_WORKERS        concurrent upstream requests (default 4)
+    BATCH_ATTEMPTS       attempts per job before it stays failed (default 3)
+    BATCH_POLL_INTERVAL  seconds between Batch API status checks (default 30)
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BATCH_STORE = os.getenv("BATCH_STORE", "batch_jobs.sqlite3")
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_ATTEMPTS = int(os.getenv("BATCH_ATTEMPTS", "3"))
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+
+# The prompt bron_test.ipynb tried by hand, per technology of the Vilans kennisbank
+TECH_TEMPLATE = "Creëer een lesplan van 50 minuten voor niveau 4 mbo studenten over {technologie}"
+
+BATCH_DONE_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def tech_prompts(template=TECH_TEMPLATE):
+    """One prompt per technology page in `tech_urls`, named after the last part of its URL."""
+    from vilans_webscrapper_downloads import tech_urls
+
+    names = [url.rstrip("/").rsplit("/", 1)[-1].replace("-", " ") for url in tech_urls]
+    return [template.format(technologie=name) for name in names]
+
+
+def default_run_id(prompts, mode):
+    """Same prompts and mode -> same run, so re-running a command resumes it."""
+    digest = hashlib.sha1("\n".join([mode, *prompts]).encode("utf-8")).hexdigest()
+    return f"run-{digest[:10]}"
+
+
+class JobStore:
+    """SQLite store of runs and their jobs (pending -> running -> done | failed)."""
+
+    def __init__(self, path=BATCH_STORE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id TEXT PRIMARY KEY, mode TEXT, created REAL, batch_id TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " run_id TEXT, idx INTEGER, prompt TEXT, status TEXT, output TEXT, sources TEXT,"
+            " response_id TEXT, latency_s REAL, input_tokens INTEGER, output_tokens INTEGER,"
+            " attempts INTEGER DEFAULT 0, error TEXT, updated REAL, PRIMARY KEY (run_id, idx))"
+        )
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def create_run(self, run_id, prompts, mode):
+        """
+        Register a run, or resume the existing run with this id.
+
+        Jobs left 'running' by a crashed process become 'pending' again.
+
+        Raises:
+            ValueError: The run exists with other prompts or another mode.
+        """
+        run = self.get_run(run_id)
+        if run is not None:
+            existing = [row[0] for row in self._execute(
+                "SELECT prompt FROM jobs WHERE run_id = ? ORDER BY idx", (run_id,))]
+            if (prompts and existing != list(prompts)) or run["mode"] != mode:
+                raise ValueError(f"run {run_id} exists with other prompts or mode; choose another --run-id")
+            if run["batch_id"] is None:
+                self._execute("UPDATE jobs SET status = 'pending' WHERE run_id = ? AND status = 'running'", (run_id,))
+            return False
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.execute("INSERT INTO runs (run_id, mode, created) VALUES (?, ?, ?)",
+                                   (run_id, mode, time.time()))
+                self._conn.executemany(
+                    "INSERT INTO jobs (run_id, idx, prompt, status, updated) VALUES (?, ?, ?, 'pending', ?)",
+                    [(run_id, i, prompt, time.time()) for i, prompt in enumerate(prompts)],
+                )
+        return True
+
+    def get_run(self, run_id):
+        rows = self._execute("SELECT mode, created, batch_id FROM runs WHERE run_id = ?", (run_id,))
+        if not rows:
+            return None
+        return dict(zip(("mode", "created", "batch_id"), rows[0]))
+
+    def set_batch(self, run_id, batch_id):
+        self._execute("UPDATE runs SET batch_id = ? WHERE run_id = ?", (batch_id, run_id))
+
+    def todo(self, run_id, max_attempts=BATCH_ATTEMPTS):
+        """(idx, prompt) of the jobs that still have to run."""
+        return self._execute(
+            "SELECT idx, prompt FROM jobs WHERE run_id = ? AND status IN ('pending', 'failed')"
+            " AND attempts < ? ORDER BY idx", (run_id, max_attempts))
+
+    def start(self, run_id, idx, sources=None):
+        """Mark a job running; `sources` are the local retrieval sources of its payload, if any."""
+        self._execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, sources = ?, updated = ?"
+                      " WHERE run_id = ? AND idx = ?", (json.dumps(sorted(sources or ())), time.time(), run_id, idx))
+
+    def complete(self, run_id, idx, result):
+        self._execute(
+            "UPDATE jobs SET status = 'done', output = ?, sources = ?, response_id = ?, latency_s = ?,"
+            " input_tokens = ?, output_tokens = ?, error = NULL, updated = ? WHERE run_id = ? AND idx = ?",
+            (result["output"], json.dumps(result["sources"]), result["response_id"], result["latency_s"],
+             result["input_tokens"], result["output_tokens"], time.time(), run_id, idx),
+        )
+
+    def fail(self, run_id, idx, error):
+        self._execute("UPDATE jobs SET status = 'failed', error = ?, updated = ? WHERE run_id = ? AND idx = ?",
+                      (str(error)[:2000], time.time(), run_id, idx))
+
+    def jobs(self, run_id):
+        keys = ("idx", "prompt", "status", "output", "sources", "response_id", "latency_s", "input_tokens",
+                "output_tokens", "attempts", "error")
+        rows = self._execute(f"SELECT {', '.join(keys)} FROM jobs WHERE run_id = ? ORDER BY idx", (run_id,))
+        jobs = [dict(zip(keys, row)) for row in rows]
+        for job in jobs:
+            job["sources"] = json.loads(job["sources"]) if job["sources"] else []
+        return jobs
+
+
+# --------- one job ---------
+
+def job_payload(prompt):
+    """The chat payload for `prompt` (retrieval, instructions, tools), not streamed."""
+    import app
+
+    payload, sources = app.prepare_payload(prompt)
+    payload["stream"] = False
+    return payload, sources
+
+
+def parse_response(body, known_sources=()):
+    """
+    Text, sources and usage of a (non-streamed) Responses API response object.
+
+    Returns:
+        dict: output, sources, response_id, input_tokens, output_tokens
+    """
+    texts, sources = [], set(known_sources)
+    for item in body.get("output") or []:
+        if item.get("type") == "file_search_call":
+            sources.update(r["filename"] for r in item.get("results") or [] if r.get("filename"))
+        elif item.get("type") == "message":
+            for part in item.get("content") or []:
+                if part.get("type") == "output_text":
+                    texts.append(part.get("text") or "")
+                    sources.update(a["filename"] for a in part.get("annotations") or [] if a.get("filename"))
+    usage = body.get("usage") or {}
+    return {
+        "output": "".join(texts),
+        "sources": sorted(sources),
+        "response_id": body.get("id"),
+        "input_tokens": usage.get("input_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+    }
+
+
+def run_job(store, run_id, idx, prompt):
+    import app
+    import upstream
+
+    store.start(run_id, idx)
+    try:
+        payload, sources = job_payload(prompt)
+        t0 = time.perf_counter()
+        resp = upstream.post(app.OPENAI_URL, headers=app.build_headers(), json=payload)
+        resp.raise_for_status()
+        result = parse_response(resp.json(), sources)
+        result["latency_s"] = round(time.perf_counter() - t0, 3)
+    except Exception as e:
+        # Any failure (upstream, retrieval, a bad response) fails this job only, not the run
+        store.fail(run_id, idx, f"{type(e).__name__}: {e}")
+        return False
+    store.complete(run_id, idx, result)
+    return True
+
+
+# --------- modes ---------
+
+def run_pool(store, run_id, workers=BATCH_WORKERS, max_attempts=BATCH_ATTEMPTS):
+    """Run the open jobs with `workers` concurrent requests, retrying failed jobs up to `max_attempts`."""
+    for attempt in range(max_attempts):
+        todo = store.todo(run_id, max_attempts)
+        if not todo:
+            return
+        print(f"{run_id}: {len(todo)} job(s) to run" + (f" (retry {attempt})" if attempt else ""))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(run_job, store, run_id, idx, prompt): idx for idx, prompt in todo}
+            for n, future in enumerate(as_completed(futures), 1):
+                status = "ok" if future.result() else "failed"
+                print(f"  [{n}/{len(todo)}] job {futures[future]} {status}")
+
+
+def _auth_headers():
+    return {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+
+
+def submit_batch(store, run_id, max_attempts=BATCH_ATTEMPTS):
+    """Upload the open jobs as a Batch API input file and start the batch; returns its id (None if nothing to do)."""
+    import app
+    import upstream
+
+    todo = store.todo(run_id, max_attempts)
+    if not todo:
+        return None
+    lines, local_sources = [], {}
+    for idx, prompt in todo:
+        payload, local_sources[idx] = job_payload(prompt)
+        lines.append(json.dumps({"custom_id": str(idx), "method": "POST", "url": "/v1/responses", "body": payload}))
+    upload = upstream.post(f"{app.OPENAI_BASE_URL}/files", headers=_auth_headers(), data={"purpose": "batch"},
+                           files={"file": (f"{run_id}.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")})
+    upload.raise_for_status()
+    resp = upstream.post(f"{app.OPENAI_BASE_URL}/batches", headers=app.build_headers(), json={
+        "input_file_id": upload.json()["id"],
+        "endpoint": "/v1/responses",
+        "completion_window": "24h",
+        "metadata": {"run_id": run_id},
+    })
+    resp.raise_for_status()
+    batch_id = resp.json()["id"]
+    store.set_batch(run_id, batch_id)
+    for idx, _ in todo:
+        store.start(run_id, idx, local_sources[idx])
+    print(f"{run_id}: submitted {len(todo)} job(s) as batch {batch_id}")
+    return batch_id
+
+
+def collect_batch(store, run_id, batch_id, poll_interval=BATCH_POLL_INTERVAL):
+    """Wait for a batch to end and store its results; jobs without a result are marked failed."""
+    import app
+    import upstream
+
+    session = upstream.get_session()
+    while True:
+        resp = session.get(f"{app.OPENAI_BASE_URL}/batches/{batch_id}", headers=_auth_headers(), timeout=30)
+        resp.raise_for_status()
+        batch = resp.json()
+        counts = batch.get("request_counts") or {}
+        print(f"  batch {batch_id}: {batch['status']} ({counts.get('completed', 0)}/{counts.get('total', '?')} done)")
+        if batch["status"] in BATCH_DONE_STATUSES:
+            break
+        time.sleep(poll_interval)
+
+    known_sources = {job["idx"]: job["sources"] for job in store.jobs(run_id)}
+    seen = set()
+    for file_key in ("output_file_id", "error_file_id"):
+        if not batch.get(file_key):
+            continue
+        content = session.get(f"{app.OPENAI_BASE_URL}/files/{batch[file_key]}/content", headers=_auth_headers(),
+                              timeout=120)
+        content.raise_for_status()
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            idx = int(record["custom_id"])
+            seen.add(idx)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                result = parse_response(response.get("body") or {}, known_sources.get(idx, ()))
+                result["latency_s"] = None  # the batch is timed as a whole
+                store.complete(run_id, idx, result)
+            else:
+                store.fail(run_id, idx, record.get("error") or response.get("body") or "batch request failed")
+    for job in store.jobs(run_id):
+        if job["status"] == "running" and job["idx"] not in seen:
+            store.fail(run_id, job["idx"], f"no result in batch {batch_id} ({batch['status']})")
+    # Failed jobs go into a new batch when the run is started again
+    store.set_batch(run_id, None)
+
+
+def run_batch_api(store, run_id, poll_interval=BATCH_POLL_INTERVAL, max_attempts=BATCH_ATTEMPTS):
+    batch_id = store.get_run(run_id)["batch_id"]
+    if batch_id is not None:
+        print(f"{run_id}: resuming batch {batch_id}")
+    else:
+        batch_id = submit_batch(store, run_id, max_attempts)
+    if batch_id is not None:
+        collect_batch(store, run_id, batch_id, poll_interval)
+
+
+def run(prompts, run_id=None, mode=None, store=None, workers=BATCH_WORKERS, max_attempts=BATCH_ATTEMPTS,
+        poll_interval=BATCH_POLL_INTERVAL):
+    """
+    Run (or resume) a batch of prompts and return its summary.
+
+    Args:
+        prompts (list[str]): The prompts; may be empty to resume `run_id` as stored.
+        run_id (str, optional): Name of the run (default: derived from prompts and mode).
+        mode (str, optional): 'stream' (worker pool) or 'batch' (provider Batch API);
+            default: the mode of the stored run, else 'stream'.
+        store (JobStore, optional): Job store (default: BATCH_STORE).
+    """
+    store = store or JobStore()
+    stored = store.get_run(run_id) if run_id else None
+    mode = mode or (stored["mode"] if stored else "stream")
+    run_id = run_id or default_run_id(prompts, mode)
+    if not prompts and store.get_run(run_id) is None:
+        raise ValueError(f"no prompts and no stored run {run_id}")
+    if store.create_run(run_id, prompts, mode):
+        print(f"{run_id}: new run with {len(prompts)} job(s)")
+    t0 = time.perf_counter()
+    if mode == "batch":
+        run_batch_api(store, run_id, poll_interval, max_attempts)
+    else:
+        run_pool(store, run_id, workers, max_attempts)
+    report = summarize(store.jobs(run_id))
+    report["run_id"] = run_id
+    report["wall_s"] = round(time.perf_counter() - t0, 2)
+    return report
+
+
+# --------- reporting ---------
+
+def _percentile(ordered, p):
+    return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 3) if ordered else None
+
+
+def summarize(jobs):
+    latencies = sorted(j["latency_s"] for j in jobs if j["status"] == "done" and j["latency_s"] is not None)
+    statuses = {}
+    for job in jobs:
+        statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+    return {
+        "jobs": len(jobs),
+        "status": statuses,
+        "latency_p50_s": _percentile(latencies, 50),
+        "latency_p95_s": _percentile(latencies, 95),
+        "latency_max_s": latencies[-1] if latencies else None,
+        "input_tokens": sum(j["input_tokens"] or 0 for j in jobs),
+        "output_tokens": sum(j["output_tokens"] or 0 for j in jobs),
+    }
+
+
+def print_report(store, run_id):
+    jobs = store.jobs(run_id)
+    for job in jobs:
+        latency = f"{job['latency_s']:.1f}s" if job["latency_s"] is not None else "-"
+        print(f"{job['idx']:4} {job['status']:8} {latency:>7} in {job['input_tokens'] or 0:6} "
+              f"out {job['output_tokens'] or 0:6} bronnen {len(job['sources']):2}  {job['prompt'][:70]}"
+              + (f"\n       error: {job['error'][:200]}" if job["status"] == "failed" and job["error"] else ""))
+    print(json.dumps(summarize(jobs)))
+
+
+def export(store, run_id, out_dir):
+    """Write every finished job to `out_dir` as <idx>.md with its prompt and sources."""
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    for job in store.jobs(run_id):
+        if job["status"] != "done":
+            continue
+        sources = "\n".join(f"- {name}" for name in job["sources"])
+        with open(os.path.join(out_dir, f"{job['idx']:03d}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# {job['prompt']}\n\n{job['output']}\n\n## Bronnen\n\n{sources or '-'}\n")
+        count += 1
+    print(f"Exported {count} job(s) to {out_dir}")
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Generate answers for a list of prompts in a resumable batch.")
+    parser.add_argument("--store", default=BATCH_STORE, help="SQLite job store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="start or resume a run")
+    source = run_parser.add_mutually_exclusive_group()
+    source.add_argument("--prompts", help="text file with one prompt per line")
+    source.add_argument("--tech", action="store_true", help="one prompt per technology in tech_urls")
+    run_parser.add_argument("--template", default=TECH_TEMPLATE, help="prompt for --tech, with {technologie}")
+    run_parser.add_argument("--run-id", default=None, help="name of the run (default: derived from the prompts)")
+    run_parser.add_argument("--mode", choices=("stream", "batch"), default=None,
+                            help="worker pool against the Responses API, or the Batch API "
+                                 "(default stream, or the mode of the resumed run)")
+    run_parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    run_parser.add_argument("--attempts", type=int, default=BATCH_ATTEMPTS)
+    run_parser.add_argument("--poll-interval", type=float, default=BATCH_POLL_INTERVAL)
+
+    report_parser = commands.add_parser("report", help="per-job latency, tokens and sources of a run")
+    report_parser.add_argument("--run-id", required=True)
+
+    export_parser = commands.add_parser("export", help="write the outputs of a run as markdown files")
+    export_parser.add_argument("--run-id", required=True)
+    export_parser.add_argument("--out-dir", required=True)
+    args = parser.parse_args()
+
+    store = JobStore(args.store)
+    if args.command == "run":
+        if args.tech:
+            prompts = tech_prompts(args.template)
+        elif args.prompts:
+            with open(args.prompts, encoding="utf-8") as f:
+                prompts = [line.strip() for line in f if line.strip()]
+        elif args.run_id:
+            prompts = []  # resume as stored
+        else:
+            parser.error("run needs --prompts, --tech or the --run-id of an existing run")
+        report = run(prompts, args.run_id, args.mode, store, args.workers, args.attempts, args.poll_interval)
+        print_report(store, report["run_id"])
+        print(f"Done in {report['wall_s']}s")
+    elif args.command == "report":
+        print_report(store, args.run_id)
+    else:
+        export(store, args.run_id, args.out_dir)
+
+
+if __name__ == "__main__":
+    main()
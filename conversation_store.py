@@ -0,0 +1,203 @@
+"""
+Server-side conversation history per chat session.
+
+The browser used to send its last few messages with every question, so the
+history sent upstream grew with the answers and was cut at a fixed message
+count. With a session id the server keeps both user and assistant turns
+itself and sends only the newest turns that fit in a token budget.
+
+With CONVERSATION_CHAINING=on the history is not re-sent at all: the next
+request references the stored upstream response through
+`previous_response_id`. Whenever the chain is broken (cached answer, aborted
+stream, unknown id) the next request falls back to the trimmed history.
+
+Sessions live in process memory. A process that does not know a session
+(restart, several workers) seeds it from the history the browser sent.
+
+Configuration (environment variables):
+    CONVERSATION_STORE         on | off (default on)
+    CONVERSATION_TOKEN_BUDGET  history tokens sent per request (default 3000)
+    CONVERSATION_TTL           seconds an idle session is kept (default 3600)
+    CONVERSATION_MAX_SESSIONS  sessions kept in memory (default 1000)
+    CONVERSATION_CHAINING      on | off, use previous_response_id (default off)
+"""
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "on").lower()
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "3000"))
+CONVERSATION_TTL = float(os.getenv("CONVERSATION_TTL", "3600"))
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+CONVERSATION_CHAINING = os.getenv("CONVERSATION_CHAINING", "off").lower() in ("on", "1", "true")
+
+MAX_SESSION_ID_LENGTH = 100
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # not installed, or no cached encoding offline
+    _encoding = None
+
+
+def count_tokens(text):
+    """
+    Number of tokens in `text`.
+
+    Exact with tiktoken installed; otherwise an estimate from words and
+    punctuation (a Dutch word is on average about 1.4 tokens).
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    words = punct = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece[0].isalnum() or piece[0] == "_":
+            words += math.ceil(len(piece) / 6)
+        else:
+            punct += 1
+    return math.ceil(words * 1.4) + punct
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and 0 < len(session_id) <= MAX_SESSION_ID_LENGTH
+
+
+class Conversation:
+    """The turns of one session and the id of its last stored upstream response."""
+
+    def __init__(self):
+        self.turns = []  # [{"role", "content", "tokens"}]
+        self.response_id = None
+        self.updated = time.monotonic()
+
+    def append(self, role, content):
+        self.turns.append({"role": role, "content": content, "tokens": count_tokens(content)})
+        self.updated = time.monotonic()
+
+
+class ConversationStore:
+    """
+    In-memory LRU of conversations, trimmed to a token budget on the way out.
+
+    Args:
+        budget (int): Max tokens of history sent upstream; the newest user
+            turn is always sent, even when it alone exceeds the budget.
+        ttl (float): Seconds after which an idle session is forgotten.
+        max_sessions (int): Least recently used sessions beyond this are dropped.
+        chaining (bool): Reference the previous response instead of re-sending history.
+    """
+
+    def __init__(self, budget=CONVERSATION_TOKEN_BUDGET, ttl=CONVERSATION_TTL,
+                 max_sessions=CONVERSATION_MAX_SESSIONS, chaining=CONVERSATION_CHAINING):
+        self.budget = budget
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.chaining = chaining
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"turns": 0, "chained": 0, "tokens_sent": 0, "tokens_dropped": 0}
+
+    def _session(self, session_id, now):
+        """Return the live conversation of `session_id`, or None. Caller holds the lock."""
+        conversation = self._sessions.get(session_id)
+        if conversation is not None and now - conversation.updated > self.ttl:
+            del self._sessions[session_id]
+            conversation = None
+        if conversation is not None:
+            self._sessions.move_to_end(session_id)
+        return conversation
+
+    def start_turn(self, session_id, question, client_history=None):
+        """
+        Record a new user question and build the input for the upstream request.
+
+        Args:
+            session_id (str): Chat session id sent by the browser.
+            question (str): The new user message.
+            client_history (list, optional): {role, content} messages the
+                browser sent, used to seed a session this process does not know.
+
+        Returns:
+            tuple: (list of {role, content} messages, previous_response_id or None)
+        """
+        now = time.monotonic()
+        with self._lock:
+            conversation = self._session(session_id, now)
+            if conversation is None:
+                conversation = self._sessions[session_id] = Conversation()
+                for message in (client_history or [])[:-1]:
+                    if isinstance(message, dict) and message.get("role") in ("user", "assistant"):
+                        conversation.append(message["role"], str(message.get("content") or ""))
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            conversation.append("user", question)
+            self._stats["turns"] += 1
+
+            if self.chaining and conversation.response_id:
+                self._stats["chained"] += 1
+                self._stats["tokens_sent"] += conversation.turns[-1]["tokens"]
+                return [{"role": "user", "content": question}], conversation.response_id
+
+            selected, used = [], 0
+            for i, turn in enumerate(reversed(conversation.turns)):
+                if i and used + turn["tokens"] > self.budget:
+                    self._stats["tokens_dropped"] += sum(t["tokens"] for t in conversation.turns[:-i])
+                    break
+                selected.append({"role": turn["role"], "content": turn["content"]})
+                used += turn["tokens"]
+            while selected[-1]["role"] == "assistant":
+                # An answer without its question only costs tokens
+                used -= conversation.turns[-len(selected)]["tokens"]
+                self._stats["tokens_dropped"] += conversation.turns[-len(selected)]["tokens"]
+                selected.pop()
+            self._stats["tokens_sent"] += used
+            return selected[::-1], None
+
+    def finish_turn(self, session_id, answer, response_id=None):
+        """
+        Record the assistant answer of the current turn.
+
+        `response_id` is the id of the stored upstream response; None (a
+        cached or interrupted answer) breaks the chain, so the next turn
+        sends the trimmed history again.
+        """
+        with self._lock:
+            conversation = self._session(session_id, time.monotonic())
+            if conversation is None:
+                return
+            conversation.append("assistant", answer)
+            conversation.response_id = response_id
+
+    def cancel_turn(self, session_id):
+        """
+        Forget the question of a turn that was never answered (e.g. refused
+        by admission control), so the next turn follows the last real answer.
+        """
+        with self._lock:
+            conversation = self._session(session_id, time.monotonic())
+            if conversation is not None and conversation.turns and conversation.turns[-1]["role"] == "user":
+                conversation.turns.pop()
+                self._stats["turns"] -= 1
+
+    def reset(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "sessions": len(self._sessions)}
+
+
+def make_store():
+    """Create the store selected by `CONVERSATION_STORE`, or None when it is off."""
+    if CONVERSATION_STORE in ("off", "0", "false", "none"):
+        return None
+    return ConversationStore()
@@ -0,0 +1,93 @@
+"""
+Persistent crawl state for incremental re-crawls of the Vilans downloads.
+
+For every URL the store keeps the validators the server sent (ETag,
+Last-Modified), the size and SHA-256 of the content and where it was saved.
+The downloader uses it to send conditional GETs, skip 304s and store
+identical content once, hardlinked (or copied) under every name.
+"""
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+
+def link_or_copy(src, dest):
+    """Make `dest` refer to the content of `src`: hardlink when possible, else copy."""
+    if os.path.exists(dest):
+        if os.path.samefile(src, dest):
+            return
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class CrawlState:
+    """
+    SQLite-backed url -> (etag, last_modified, size, sha256, path) store.
+
+    `started` marks the beginning of this crawl: a URL checked after it is
+    not requested again in the same run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,"
+            " size INTEGER, sha256 TEXT, path TEXT, checked_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS urls_sha256 ON urls (sha256)")
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, size, sha256, path, checked_at FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("etag", "last_modified", "size", "sha256", "path", "checked_at")
+        return dict(zip(keys, row))
+
+    def record(self, url, etag, last_modified, size, sha256, path):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls (url, etag, last_modified, size, sha256, path, checked_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, size, sha256, path, time.time()),
+            )
+
+    def touch(self, url):
+        with self._lock:
+            self._conn.execute("UPDATE urls SET checked_at = ? WHERE url = ?", (time.time(), url))
+
+    def path_for_hash(self, sha256, exclude=None):
+        """An existing file with this content, other than `exclude`, or None."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM urls WHERE sha256 = ?", (sha256,)).fetchall()
+        for (path,) in rows:
+            if path != exclude and path and os.path.exists(path):
+                return path
+        return None
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry and entry["path"] and os.path.exists(entry["path"]):
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.stats[name] += n
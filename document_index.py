@@ -0,0 +1,123 @@
+"""
+Source documents behind the citation chips, by filename.
+
+The `sources:` frame of a chat answer lists filenames; the browser
+downloads them from the /docs/<filename> route in app.py. This module
+maps those names to files in DOCS_DIRS through an index built once (and
+rebuilt when an unknown name is asked for, at most every
+DOCS_RESCAN_INTERVAL seconds), so a request needs no directory walk. A
+lookup costs one `os.stat`: when a file was replaced in place (the
+downloader does this with os.replace) its size, modification time and
+ETag are refreshed, so clients never revalidate stale content.
+
+Configuration (environment variables):
+    DOCS_DIRS              folders with the documents, separated by os.pathsep
+                           (default: the "RIF alle documenten" folder)
+    DOCS_MAX_AGE           Cache-Control max-age of a document in seconds (default 86400)
+    DOCS_RESCAN_INTERVAL   minimum seconds between rescans for unknown names (default 60)
+"""
+import mimetypes
+import os
+import threading
+import time
+
+DOCS_DIRS = [d for d in os.getenv(
+    "DOCS_DIRS", r"C:\Users\20203666\Documents\RIF\RIF alle documenten").split(os.pathsep) if d]
+DOCS_MAX_AGE = int(os.getenv("DOCS_MAX_AGE", "86400"))
+DOCS_RESCAN_INTERVAL = float(os.getenv("DOCS_RESCAN_INTERVAL", "60"))
+
+
+class Document:
+    """A servable file and the metadata of its response headers."""
+
+    __slots__ = ("name", "path", "size", "mtime", "mtime_ns", "etag", "mimetype")
+
+    def __init__(self, name, path, stat):
+        self.name = name
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+class DocumentIndex:
+    """
+    filename -> Document for every file under `dirs`.
+
+    Names are matched exactly, then case-insensitively. When a name occurs
+    in several folders the first folder (then the shortest path) wins.
+    """
+
+    def __init__(self, dirs=DOCS_DIRS, rescan_interval=DOCS_RESCAN_INTERVAL):
+        self.dirs = dirs
+        self.rescan_interval = rescan_interval
+        self._by_name = {}
+        self._by_folded = {}
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self):
+        by_name, folder_of = {}, {}
+        for rank, directory in enumerate(self.dirs):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.startswith("."):
+                        continue
+                    path = os.path.join(root, name)
+                    current = by_name.get(name)
+                    if current is not None and (folder_of[name] < rank or len(current.path) <= len(path)):
+                        continue
+                    try:
+                        by_name[name] = Document(name, path, os.stat(path))
+                    except OSError:
+                        continue
+                    folder_of[name] = rank
+        by_folded = {}
+        for name, document in by_name.items():
+            by_folded.setdefault(name.casefold(), document)
+        with self._lock:
+            self._by_name, self._by_folded = by_name, by_folded
+            self._scanned = time.monotonic()
+        print(f"document index: {len(by_name)} files in {len(self.dirs)} folder(s)")
+
+    def _find(self, filename):
+        with self._lock:
+            return self._by_name.get(filename) or self._by_folded.get(filename.casefold())
+
+    def _current(self, document):
+        """`document` with the metadata of the file as it is now, or None when it is gone."""
+        try:
+            stat = os.stat(document.path)
+        except OSError:
+            return None
+        if stat.st_size == document.size and stat.st_mtime_ns == document.mtime_ns:
+            return document
+        fresh = Document(document.name, document.path, stat)
+        with self._lock:
+            if self._by_name.get(document.name) is document:
+                self._by_name[document.name] = fresh
+            if self._by_folded.get(document.name.casefold()) is document:
+                self._by_folded[document.name.casefold()] = fresh
+        return fresh
+
+    def lookup(self, filename):
+        """The Document for `filename` (a bare file name), or None."""
+        filename = os.path.basename(filename.replace("\\", "/"))
+        if not filename:
+            return None
+        document = self._find(filename)
+        if document is not None:
+            document = self._current(document)
+        if document is None and time.monotonic() - self._scanned >= self.rescan_interval:
+            self.scan()
+            document = self._find(filename)
+            if document is not None:
+                document = self._current(document)
+        return document
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_name)
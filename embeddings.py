@@ -0,0 +1,119 @@
+"""
+Text embedders shared by the semantic cache and local retrieval.
+
+An embedder is any callable that takes a list of strings and returns a
+float32 array of shape (len(texts), dim) with L2-normalized rows, so cosine
+similarity is a plain dot product.
+
+    openai         OpenAI embeddings endpoint (EMBEDDING_MODEL)
+    hashing        deterministic char n-gram hashing, fully offline
+    module:attr    any importable embedder callable or class
+"""
+import importlib
+import os
+import re
+import zlib
+
+import numpy as np
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def l2_normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class OpenAIEmbedder:
+    def __init__(self, model=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE):
+        self.model = model
+        self.batch_size = batch_size
+
+    def __call__(self, texts):
+        # Imported here so offline embedders do not need the HTTP stack
+        import upstream
+
+        url = f"{os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')}/embeddings"
+        headers = {
+            "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
+            "Content-Type": "application/json",
+        }
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            resp = upstream.post(url, headers=headers, json={"model": self.model, "input": batch})
+            resp.raise_for_status()
+            data = sorted(resp.json()["data"], key=lambda d: d["index"])
+            vectors.extend(d["embedding"] for d in data)
+        return l2_normalize(vectors)
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: words and character n-grams hashed into a fixed-size vector.
+
+    Deterministic across processes (crc32, not `hash`), so it can be used for
+    tests and for an index that must be rebuilt without network access.
+    """
+
+    def __init__(self, dim=512, ngram_range=(3, 5)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def features(self, text):
+        words = _WORD_RE.findall(text.casefold())
+        feats = list(words)
+        lo, hi = self.ngram_range
+        for word in words:
+            padded = f" {word} "
+            for n in range(lo, hi + 1):
+                feats.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return feats
+
+    def __call__(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat in self.features(text):
+                h = zlib.crc32(feat.encode("utf-8"))
+                out[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return l2_normalize(out)
+
+
+def embedder_id(spec):
+    """
+    Name of the embedding space behind `spec`, for stores that must not mix spaces.
+
+    For 'openai' this includes EMBEDDING_MODEL, since another model gives
+    other (possibly same-sized) vectors.
+    """
+    if spec == "openai":
+        return f"openai:{EMBEDDING_MODEL}"
+    return spec
+
+
+def make_embedder(spec):
+    """
+    Resolve an embedder from its configuration name.
+
+    Args:
+        spec (str): 'openai', 'hashing' or 'module:attr'. A class found at
+            'module:attr' is instantiated without arguments, any other
+            callable is used as is.
+
+    Returns:
+        callable: texts -> float32 array of normalized row vectors.
+    """
+    if spec == "openai":
+        return OpenAIEmbedder()
+    if spec == "hashing":
+        return HashingEmbedder()
+    module_name, _, attr = spec.partition(":")
+    if not attr:
+        raise ValueError(f"Unknown embedder {spec!r}, expected 'openai', 'hashing' or 'module:attr'")
+    obj = getattr(importlib.import_module(module_name), attr)
+    return obj() if isinstance(obj, type) else obj
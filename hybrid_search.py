@@ -0,0 +1,301 @@
+"""
+Hybrid BM25 + vector retrieval over the local kennisbank index.
+
+Exact Dutch domain terms ("heupairbag", "medicijndispenser", "ECD") are
+matched by a BM25 inverted index, paraphrases by the embedding search of
+`local_index`. Both rankings are fused with reciprocal rank fusion, and
+chunks whose file name (`tslug--slug.pdf` from the downloads scraper)
+contains the query terms get an extra boost.
+
+The inverted index lives in `<LOCAL_INDEX_DIR>/bm25/` and uses the same row
+numbers as the vector index. It is built incrementally: every `add` writes a
+new segment (CSR postings as int32/uint16 arrays), which `compact` merges.
+
+Configuration (environment variables):
+    HYBRID_DEPTH           candidates taken from each ranking (default 50)
+    HYBRID_RRF_K           reciprocal rank fusion constant (default 60)
+    HYBRID_FILENAME_BOOST  fused score added when all query terms are in the file name (default 0.02)
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+import local_index
+from local_index import top_k_rows
+
+HYBRID_DEPTH = int(os.getenv("HYBRID_DEPTH", "50"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_FILENAME_BOOST = float(os.getenv("HYBRID_FILENAME_BOOST", "0.02"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DUTCH_STOPWORDS = frozenset("""
+aan al alles als altijd andere ben bij daar dan dat de der deze die dit doch doen door dus een
+eens en er ge geen geweest haar had heb hebben heeft hem het hier hij hoe hun iemand iets ik in
+is ja je kan kon kunnen maar me meer men met mij mijn moet na naar niet niets nog nu of om omdat
+onder ons ook op over reeds te tegen toch toen tot u uit uw van veel voor want waren was wat
+werd wezen wie wil worden wordt zal ze zelf zich zij zijn zo zonder zou
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def stem(token):
+    """Very light Dutch stemming: strip plural and diminutive endings."""
+    for suffix in ("tjes", "jes", "en", "s"):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 4:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """Casefold, strip accents, split on non-alphanumerics, drop stopwords, stem."""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [stem(t) for t in _TOKEN_RE.findall(text) if t not in DUTCH_STOPWORDS]
+
+
+def filename_terms(filename):
+    """Terms of a `tslug--slug.ext` file name, e.g. 'heupairbag--folder-heupairbag.pdf'."""
+    base = os.path.splitext(os.path.basename(filename))[0]
+    return set(tokenize(base.replace("-", " ").replace("_", " ")))
+
+
+class BM25Index:
+    """
+    Segmented inverted index with BM25 scoring.
+
+    Args:
+        directory (str): Directory holding vocab.json and segment_*.npz files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.vocab = {}
+        if os.path.exists(self._path("vocab.json")):
+            with open(self._path("vocab.json"), encoding="utf-8") as f:
+                self.vocab = json.load(f)
+        self._load_segments()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_segments(self):
+        self.segments = []
+        for path in sorted(glob.glob(self._path("segment_*.npz"))):
+            with np.load(path) as seg:
+                self.segments.append({name: seg[name] for name in seg.files})
+        self.doc_len = (np.concatenate([s["doc_len"] for s in self.segments])
+                        if self.segments else np.zeros(0, dtype=np.int32))
+        self.n_docs = len(self.doc_len)
+        self.avgdl = float(self.doc_len.mean()) if self.n_docs else 0.0
+
+    def add(self, first_row, texts):
+        """
+        Index `texts` as rows `first_row, first_row + 1, ...` in a new segment.
+
+        Rows must be appended in order, matching the rows of the vector index.
+        """
+        if not texts:
+            return
+        with self._lock:
+            if first_row != self.n_docs:
+                raise ValueError(f"BM25 index has {self.n_docs} rows, cannot add at row {first_row}")
+            postings = {}
+            doc_len = np.zeros(len(texts), dtype=np.int32)
+            for i, text in enumerate(texts):
+                tokens = tokenize(text)
+                doc_len[i] = len(tokens)
+                counts = {}
+                for t in tokens:
+                    tid = self.vocab.setdefault(t, len(self.vocab))
+                    counts[tid] = counts.get(tid, 0) + 1
+                for tid, tf in counts.items():
+                    postings.setdefault(tid, []).append((first_row + i, tf))
+
+            terms = np.array(sorted(postings), dtype=np.int32)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            docs, tfs = [], []
+            for j, tid in enumerate(terms):
+                plist = postings[int(tid)]
+                offsets[j + 1] = offsets[j] + len(plist)
+                docs.extend(d for d, _ in plist)
+                tfs.extend(min(tf, 65535) for _, tf in plist)
+
+            name = f"segment_{len(glob.glob(self._path('segment_*.npz'))):06d}.npz"
+            np.savez_compressed(
+                self._path(name), terms=terms, offsets=offsets, doc_len=doc_len,
+                docs=np.array(docs, dtype=np.int32), tfs=np.array(tfs, dtype=np.uint16),
+            )
+            self._save_vocab()
+            self._load_segments()
+
+    def _save_vocab(self):
+        tmp = self._path("vocab.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        os.replace(tmp, self._path("vocab.json"))
+
+    def compact(self):
+        """Merge all segments into one."""
+        with self._lock:
+            if len(self.segments) < 2:
+                return
+            postings = {}
+            for seg in self.segments:
+                for j, tid in enumerate(seg["terms"]):
+                    lo, hi = seg["offsets"][j], seg["offsets"][j + 1]
+                    postings.setdefault(int(tid), []).append((seg["docs"][lo:hi], seg["tfs"][lo:hi]))
+            terms = np.array(sorted(postings), dtype=np.int32)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            docs, tfs = [], []
+            for j, tid in enumerate(terms):
+                parts = postings[int(tid)]
+                offsets[j + 1] = offsets[j] + sum(len(d) for d, _ in parts)
+                docs.extend(d for d, _ in parts)
+                tfs.extend(t for _, t in parts)
+            old = sorted(glob.glob(self._path("segment_*.npz")))
+            tmp = self._path("compact.npz.tmp")
+            with open(tmp, "wb") as f:
+                np.savez_compressed(
+                    f, terms=terms, offsets=offsets, doc_len=self.doc_len,
+                    docs=np.concatenate(docs).astype(np.int32), tfs=np.concatenate(tfs).astype(np.uint16),
+                )
+            for path in old:
+                os.remove(path)
+            os.replace(tmp, self._path("segment_000000.npz"))
+            self._load_segments()
+
+    def scores(self, query):
+        """BM25 score of every row for `query` (float32 array of length n_docs)."""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            tid = self.vocab.get(term)
+            if tid is None:
+                continue
+            doc_parts, tf_parts = [], []
+            for seg in self.segments:
+                j = np.searchsorted(seg["terms"], tid)
+                if j < len(seg["terms"]) and seg["terms"][j] == tid:
+                    lo, hi = seg["offsets"][j], seg["offsets"][j + 1]
+                    doc_parts.append(seg["docs"][lo:hi])
+                    tf_parts.append(seg["tfs"][lo:hi])
+            if not doc_parts:
+                continue
+            docs = np.concatenate(doc_parts)
+            tf = np.concatenate(tf_parts).astype(np.float32)
+            df = len(docs)
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[docs] / self.avgdl)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k):
+        """Top-k (row, score) pairs with a positive BM25 score."""
+        scores = self.scores(query)
+        if not self.n_docs:
+            return []
+        rows = top_k_rows(scores[None, :], k)[0]
+        return [(int(r), float(scores[r])) for r in rows if scores[r] > 0]
+
+
+class HybridRetriever:
+    """
+    Fuse vector and BM25 rankings with reciprocal rank fusion.
+
+    Args:
+        index (local_index.LocalIndex): Vector index (chunks and embeddings).
+        bm25 (BM25Index): Inverted index over the same rows.
+    """
+
+    def __init__(self, index, bm25, depth=HYBRID_DEPTH, rrf_k=HYBRID_RRF_K, filename_boost=HYBRID_FILENAME_BOOST):
+        self.index = index
+        self.bm25 = bm25
+        self.depth = depth
+        self.rrf_k = rrf_k
+        self.filename_boost = filename_boost
+        self._filename_terms = {}
+
+    def _terms_of(self, source):
+        terms = self._filename_terms.get(source)
+        if terms is None:
+            terms = self._filename_terms[source] = filename_terms(source)
+        return terms
+
+    def search(self, query, k=local_index.LOCAL_INDEX_TOP_K):
+        fused = {}
+        for rank, hit in enumerate(self.index.search(query, self.depth)):
+            fused[hit["row"]] = fused.get(hit["row"], 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        bm25_hits = [(row, score) for row, score in self.bm25.search(query, self.depth + len(self.index.deleted))
+                     if row not in self.index.deleted][:self.depth]
+        for rank, (row, _) in enumerate(bm25_hits):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        query_terms = set(tokenize(query))
+        if query_terms and self.filename_boost:
+            for row in fused:
+                matched = query_terms & self._terms_of(self.index.chunks[row]["source"])
+                fused[row] += self.filename_boost * len(matched) / len(query_terms)
+
+        best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [{**self.index.chunks[row], "row": row, "score": score} for row, score in best]
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def bm25_dir(index_dir):
+    return os.path.join(index_dir, "bm25")
+
+
+def get_retriever():
+    """Open the hybrid retriever over `LOCAL_INDEX_DIR` once per process."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                index = local_index.get_index()
+                _retriever = HybridRetriever(index, BM25Index(bm25_dir(index.directory)))
+    return _retriever
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the BM25 side of the hybrid retriever.")
+    parser.add_argument("query", nargs="*", help="question(s) to search for")
+    parser.add_argument("--dir", default=local_index.LOCAL_INDEX_DIR)
+    parser.add_argument("--embedder", default=local_index.LOCAL_INDEX_EMBEDDER)
+    parser.add_argument("-k", type=int, default=local_index.LOCAL_INDEX_TOP_K)
+    parser.add_argument("--sync", action="store_true", help="index chunks of the vector index not yet in BM25")
+    parser.add_argument("--compact", action="store_true", help="merge BM25 segments")
+    args = parser.parse_args()
+
+    from embeddings import make_embedder
+
+    index = local_index.LocalIndex(args.dir, make_embedder(args.embedder), args.embedder)
+    bm25 = BM25Index(bm25_dir(args.dir))
+    if args.sync:
+        start = bm25.n_docs
+        bm25.add(start, [c["text"] for c in index.chunks[start:]])
+        print(f"BM25 rows: {start} -> {bm25.n_docs}")
+    if args.compact:
+        bm25.compact()
+    retriever = HybridRetriever(index, bm25)
+    for query in args.query:
+        print(f"\n# {query}")
+        for r in retriever.search(query, args.k):
+            print(f"{r['score']:.4f}  {r['source']}  {r['text'][:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
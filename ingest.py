@@ -0,0 +1,308 @@
+"""
+Ingest the scraped kennisbank documents into a searchable store.
+
+PDF -> text -> overlapping chunks -> embeddings, streamed file by file:
+text extraction runs in a process pool while the main process chunks,
+embeds in batches and writes to the target. A content-hash manifest makes
+later runs process only new or changed files, and drops the chunks of
+files that disappeared.
+
+Targets:
+    local   `local_index` vector index plus the BM25 index of `hybrid_search`
+    hosted  upload the files to the OpenAI vector store VECTOR_STORE_ID (the
+            hosted store extracts and embeds itself). OPENAI_BASE_URL can
+            point this at a stand-in server.
+
+Usage:
+    python ingest.py [DIR ...] [--target local|hosted] [--workers N]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Output folders of vilans_webscrapper_downloads.py (OUT_DIR) and
+# vilans_webscrapper_pages.py (the folder passed to scrape_and_save)
+DEFAULT_DIRS = [
+    r"C:\Users\20203666\Documents\RIF\vilans webscrapped downloads",
+    r"C:\Users\20203666\Documents\RIF\vilans webscrapped pages",
+]
+
+SUPPORTED_EXTS = {".pdf", ".txt", ".md"}
+CHUNK_WORDS = 300
+CHUNK_OVERLAP = 50
+
+
+# --------- extraction (runs in worker processes) ---------
+
+def extract_text(path):
+    """
+    Extract the text of one document.
+
+    Returns:
+        tuple: (path, number of pages, text)
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        pages = [page.extract_text() or "" for page in reader.pages]
+        return path, len(pages), "\n".join(pages)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return path, 1, f.read()
+
+
+def chunk_text(text, size=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """Split text into chunks of `size` words, consecutive chunks sharing `overlap` words."""
+    words = text.split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    return [" ".join(words[i:i + size]) for i in range(0, max(1, len(words) - overlap), step)]
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# --------- manifest ---------
+
+class Manifest:
+    """
+    {path: {"sha256", "size", "mtime", ...target fields}} stored as JSON.
+
+    Size and mtime are checked first, so unchanged files are not re-hashed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def changed(self, path):
+        """Return (is_changed, sha256 or None). Updates mtime of touched-but-identical files."""
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+            return False, entry["sha256"]
+        digest = file_sha256(path)
+        if entry and entry["sha256"] == digest:
+            entry["mtime"] = st.st_mtime
+            return False, digest
+        return True, digest
+
+    def record(self, path, digest, **fields):
+        st = os.stat(path)
+        self.entries[path] = {"sha256": digest, "size": st.st_size, "mtime": st.st_mtime, **fields}
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
+# --------- targets ---------
+
+class LocalTarget:
+    """Chunks and embeds into `local_index` and the BM25 index."""
+
+    needs_text = True
+
+    def __init__(self, index_dir, embedder_spec, batch_size):
+        import hybrid_search
+        import local_index
+        from embeddings import make_embedder
+
+        self.index = local_index.LocalIndex(index_dir, make_embedder(embedder_spec), embedder_spec)
+        self.bm25 = hybrid_search.BM25Index(hybrid_search.bm25_dir(index_dir))
+        if self.bm25.n_docs < len(self.index):
+            # BM25 was added after the vector index was built; catch up first
+            start = self.bm25.n_docs
+            self.bm25.add(start, [c["text"] for c in self.index.chunks[start:]])
+        self.batch_size = batch_size
+        self.manifest_path = os.path.join(index_dir, "manifest.json")
+
+    def remove(self, entry):
+        self.index.delete_rows(range(*entry["rows"]))
+
+    def add(self, path, chunks):
+        """Embed and store the chunks of one file; returns manifest fields."""
+        source = os.path.basename(path)
+        first = len(self.index)
+        for start in range(0, len(chunks), self.batch_size):
+            batch = [{"source": source, "text": text} for text in chunks[start:start + self.batch_size]]
+            row = len(self.index)
+            self.index.add(batch)
+            self.bm25.add(row, [c["text"] for c in batch])
+        return {"rows": [first, len(self.index)]}
+
+    def finish(self):
+        # Every file added its own BM25 segment; merge them for fast queries
+        self.bm25.compact()
+
+
+class HostedTarget:
+    """Uploads whole files to the OpenAI vector store."""
+
+    needs_text = False
+
+    def __init__(self, vector_store_id, manifest_path):
+        import upstream
+
+        self.upstream = upstream
+        self.base_url = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+        self.vector_store_id = vector_store_id
+        self.headers = {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+        self.manifest_path = manifest_path
+
+    def remove(self, entry):
+        """Detach the file from the vector store and delete the uploaded file itself."""
+        file_id = entry.get("file_id")
+        if file_id:
+            session = self.upstream.get_session()
+            for url in (f"{self.base_url}/vector_stores/{self.vector_store_id}/files/{file_id}",
+                        f"{self.base_url}/files/{file_id}"):
+                resp = session.delete(url, headers=self.headers)
+                if resp.status_code not in (200, 404):
+                    resp.raise_for_status()
+
+    def add(self, path, chunks=None):
+        with open(path, "rb") as f:
+            resp = self.upstream.post(
+                f"{self.base_url}/files",
+                headers=self.headers,
+                data={"purpose": "assistants"},
+                files={"file": (os.path.basename(path), f)},
+            )
+        resp.raise_for_status()
+        file_id = resp.json()["id"]
+        resp = self.upstream.post(
+            f"{self.base_url}/vector_stores/{self.vector_store_id}/files",
+            headers=self.headers,
+            json={"file_id": file_id},
+        )
+        resp.raise_for_status()
+        return {"file_id": file_id}
+
+    def finish(self):
+        pass
+
+
+# --------- pipeline ---------
+
+def iter_files(dirs):
+    for d in dirs:
+        for root, _, names in os.walk(d):
+            for name in sorted(names):
+                if os.path.splitext(name)[1].lower() in SUPPORTED_EXTS:
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+def ingest(dirs, target, workers=None, chunk_words=CHUNK_WORDS, overlap=CHUNK_OVERLAP):
+    """
+    Bring `target` up to date with the documents in `dirs`.
+
+    Returns:
+        dict: Counts and throughput of the run.
+    """
+    manifest = Manifest(target.manifest_path)
+    t0 = time.perf_counter()
+    stats = {"files": 0, "skipped": 0, "removed": 0, "failed": 0, "pages": 0, "chunks": 0}
+
+    seen, todo = set(), {}
+    for path in iter_files(dirs):
+        seen.add(path)
+        changed, digest = manifest.changed(path)
+        if changed:
+            todo[path] = digest
+        else:
+            stats["skipped"] += 1
+
+    for path in [p for p in manifest.entries if p not in seen]:
+        target.remove(manifest.entries.pop(path))
+        stats["removed"] += 1
+
+    def store(path, pages, chunks):
+        old = manifest.entries.get(path)
+        if old:
+            target.remove(old)
+        fields = target.add(path, chunks)
+        manifest.record(path, todo[path], **fields)
+        manifest.save()
+        stats["files"] += 1
+        stats["pages"] += pages
+        stats["chunks"] += len(chunks or [])
+        print(f"✔ {os.path.basename(path)}: {pages} page(s), {len(chunks or [])} chunk(s)")
+
+    if target.needs_text:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(extract_text, path): path for path in todo}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    _, pages, text = future.result()
+                    store(path, pages, chunk_text(text, chunk_words, overlap))
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"failed: {path} -> {e}")
+    else:
+        for path in todo:
+            try:
+                store(path, 0, None)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"failed: {path} -> {e}")
+
+    target.finish()
+    manifest.save()
+    elapsed = time.perf_counter() - t0
+    stats["seconds"] = round(elapsed, 2)
+    stats["pages_per_s"] = round(stats["pages"] / elapsed, 1) if elapsed else 0.0
+    stats["chunks_per_s"] = round(stats["chunks"] / elapsed, 1) if elapsed else 0.0
+    return stats
+
+
+def main():
+    load_dotenv()
+    import embeddings
+    import local_index
+
+    parser = argparse.ArgumentParser(description="Ingest scraped documents into the local index or the hosted vector store.")
+    parser.add_argument("dirs", nargs="*", default=DEFAULT_DIRS, help="document folders (default: scraper output folders)")
+    parser.add_argument("--target", choices=("local", "hosted"), default="local")
+    parser.add_argument("--index-dir", default=local_index.LOCAL_INDEX_DIR)
+    parser.add_argument("--embedder", default=local_index.LOCAL_INDEX_EMBEDDER)
+    parser.add_argument("--batch-size", type=int, default=embeddings.EMBEDDING_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="text extraction processes (default: CPU count)")
+    parser.add_argument("--chunk-words", type=int, default=CHUNK_WORDS)
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument("--manifest", default="ingest_manifest_hosted.json", help="manifest file of the hosted target")
+    args = parser.parse_args()
+
+    if args.target == "local":
+        target = LocalTarget(args.index_dir, args.embedder, args.batch_size)
+    else:
+        target = HostedTarget(os.getenv("VECTOR_STORE_ID"), args.manifest)
+
+    stats = ingest(args.dirs, target, args.workers, args.chunk_words, args.overlap)
+    print(
+        f"Done: {stats['files']} ingested, {stats['skipped']} unchanged, {stats['removed']} removed, "
+        f"{stats['failed']} failed — {stats['pages']} pages, {stats['chunks']} chunks in {stats['seconds']}s "
+        f"({stats['pages_per_s']} pages/s, {stats['chunks_per_s']} chunks/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
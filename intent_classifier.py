@@ -0,0 +1,220 @@
+"""
+Local check whether a chat message needs retrieval.
+
+bron_test.ipynb prototyped this as `vector_store_search_check`, an extra
+LLM call answering "ja"/"nee". Here a logistic regression over hashed
+words and character n-grams (`embeddings.HashingEmbedder`) makes the same
+call on the CPU in well under a millisecond. It is trained at first use
+from the labelled examples below, plus those in INTENT_TRAINING_FILE.
+
+Greetings, thanks and other small talk get no file_search tool (and no
+local retrieval), so they are answered sooner and cheaper. The check errs
+towards retrieval: a message is only answered without sources when the
+model is at least INTENT_SKIP_THRESHOLD sure it is small talk, longer
+messages always retrieve, and so does any message with a word of the
+kennisbank vocabulary (`DOMAIN_WORDS`), such as a bare technology name.
+
+Usage:
+    python intent_classifier.py "hoi Ella, hoe gaat het?" "wat is domotica?"
+
+Configuration (environment variables):
+    INTENT_CLASSIFIER      on | off (default on)
+    INTENT_SKIP_THRESHOLD  small-talk probability needed to skip retrieval (default 0.8)
+    INTENT_MAX_WORDS       messages with more words always retrieve (default 12)
+    INTENT_TRAINING_FILE   JSON-lines file with extra {"text", "retrieve": true|false} examples
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+
+from embeddings import HashingEmbedder
+
+INTENT_CLASSIFIER = os.getenv("INTENT_CLASSIFIER", "on").lower()
+INTENT_SKIP_THRESHOLD = float(os.getenv("INTENT_SKIP_THRESHOLD", "0.8"))
+INTENT_MAX_WORDS = int(os.getenv("INTENT_MAX_WORDS", "12"))
+INTENT_TRAINING_FILE = os.getenv("INTENT_TRAINING_FILE", "")
+
+FEATURE_DIM = 4096
+
+# The technologies of `tech_urls` in vilans_webscrapper_downloads.py (not
+# imported: that module needs the scraper's dependencies)
+TECHNOLOGIES = [
+    "asset tracking hulpmiddelen", "automatisch douchesysteem", "bedsensor", "beeldschermzorg",
+    "dagstructuurrobot", "ecd elektronisch clientendossier", "elektrisch aantrekhulpmiddel voor steunkous",
+    "elektronisch toegangsbeheer", "exoskelet", "externe leefcirkel", "heupairbag", "innovatieve hoeslakens",
+    "interactieve belevingen", "leefpatroonmonitoring", "medicijndispenser met check op afstand",
+    "plannen zorg met ai", "robotdieren", "slim incontinentiemateriaal", "smart glass",
+    "spraakgestuurd rapporteren", "stressherkenningssok", "wondzorg op afstand",
+]
+
+# A message with a word that starts with one of these always retrieves:
+# a bare term is a question about it, however short
+DOMAIN_WORDS = (
+    "asset", "douchesysteem", "bedsensor", "beeldschermzorg", "beeldzorg", "beeldbel", "dagstructuur", "ecd",
+    "clientendossier", "cliëntendossier", "aantrekhulp", "steunkous", "toegangsbeheer", "exoskelet", "leefcirkel",
+    "heupairbag", "hoeslaken", "beleving", "leefpatroon", "medicijndispenser", "medicatie", "robotdier", "zorgrobot",
+    "incontinentie", "smart glass", "smartglass", "spraakgestuurd", "stressherkenning", "wondzorg", "domotica",
+    "zorgtechnologie", "e-health", "ehealth", "telemonitoring", "valpreventie", "valrisico", "tillift",
+    "decubitus", "dementie", "mantelzorg", "leefstijl", "sensor", "leeruitkomst", "lesplan", "blended wave",
+)
+_DOMAIN_RE = re.compile(r"\b(?:" + "|".join(re.escape(w) for w in DOMAIN_WORDS) + ")", re.IGNORECASE)
+
+# Small talk / social messages: answered without retrieval
+SMALL_TALK = [
+    "hoi", "hallo", "hey", "hi", "hoi Ella", "hallo Ella", "hey Ella", "goedemorgen", "goedemiddag",
+    "goedenavond", "goeiemorgen Ella", "hoi, hoe gaat het?", "hoi Ella, hoe gaat het?", "hoe gaat het met je?",
+    "hoe is het?", "alles goed?", "hoe gaat het vandaag?", "hallo, alles goed met je?", "wie ben jij?",
+    "wat is je naam?", "hoe heet je?", "ben jij een robot?", "ben je een mens?", "wat kun jij allemaal?",
+    "wat kan je?", "wie heeft jou gemaakt?", "dank je", "dank je wel", "dankjewel", "bedankt", "bedankt!",
+    "bedankt Ella", "top, bedankt", "super, dank je wel", "heel erg bedankt", "thanks", "thank you",
+    "fijn, bedankt voor je hulp", "dat was alles, bedankt", "oke", "oké", "ok", "prima", "top", "super",
+    "mooi", "leuk", "cool", "helemaal goed", "geweldig", "fijn", "doei", "dag", "tot ziens", "tot later",
+    "fijne dag nog", "fijne avond", "goedenacht", "doeg Ella", "tot de volgende keer", "haha", "lol",
+    "je bent grappig", "je bent slim", "je bent lief", "goed zo", "wat leuk", "wat fijn", "sorry",
+    "excuus", "geeft niet", "geen probleem", "hello", "good morning", "how are you?", "what's your name?",
+    "bye", "ik ben er weer", "daar ben ik weer", "hoi, ik ben een docent", "ik heet Sanne",
+    "leuk je te ontmoeten", "aangenaam", "goed, en met jou?", "met mij gaat het goed", "nee hoor, dat was het",
+    "nee dank je", "dat is alles", "ik heb geen vragen meer", "wat een mooi weer vandaag",
+    "heb je een fijne dag gehad?", "ben je er nog?", "test", "testen", "dit is een test", "123",
+]
+
+# Questions and tasks about the subject matter: retrieve
+NEEDS_RETRIEVAL = [
+    "wat is domotica?", "wat is zorgtechnologie?", "wat is valpreventie?", "wat is decubitus?",
+    "wat is beeldzorg?", "hoe werkt een medicijndispenser?", "wat zijn leefstijlmonitoring systemen?",
+    "welke technologie helpt bij dementie?", "wat is een tillift?", "wat is e-health?",
+    "hoi Ella, kun je een lesplan maken over domotica?", "hallo, kun je me helpen met een les over valpreventie?",
+    "hoi, wat weet je over medicatieveiligheid?", "goedemorgen, ik zoek informatie over decubitus",
+    "hey Ella, maak een module over zorgtechnologie", "hallo Ella, wat is slimme zorg?",
+    "maak een lesplan van 50 minuten over beeldzorg", "maak een lesplan voor niveau 3 over domotica",
+    "ontwerp een module over e-health voor mbo niveau 4", "creëer een lesplan over valpreventie",
+    "maak een opdracht voor studenten over medicatieveiligheid", "geef een toets over zorgtechnologie",
+    "maak een quiz over domotica", "bedenk een casus over een client met dementie",
+    "geef tips voor een les over beeldbellen", "welke werkvormen passen bij een les over hygiëne?",
+    "kun je de les aanpassen voor niveau 2?", "kun je het lesplan korter maken?",
+    "bedankt voor het lesplan, kan je hem nog wat aanpassen?", "kun je er een opdracht bij maken?",
+    "maak het wat uitgebreider", "kun je meer bronnen geven?", "welke bronnen heb je gebruikt?",
+    "ja graag", "ja, doe maar", "graag een voorbeeld", "geef een voorbeeld", "leg dat eens uit",
+    "kun je dat uitleggen?", "wat bedoel je daarmee?", "en voor niveau 4?", "en hoe zit dat in de wijkzorg?",
+    "waarom is dat belangrijk?", "hoe pas ik dat toe in de praktijk?", "wat zijn de voordelen?",
+    "wat zijn de nadelen van domotica?", "hoe voorkom je decubitus?", "hoe meet je valrisico?",
+    "welke sensoren worden gebruikt in de zorg?", "wat zegt de richtlijn over medicatie?",
+    "hoe begeleid ik een student op stage?", "wat is de blended wave?", "leg de blended wave uit",
+    "wat is challenge based learning?", "hoe differentieer ik in mijn les?", "welke digitale tools kan ik gebruiken?",
+    "wat is een leeruitkomst?", "formuleer leeruitkomsten voor deze module", "schrijf een reflectieopdracht",
+    "wat is het verschil tussen een sensor en een alarm?", "welke apps zijn er voor mantelzorgers?",
+    "hoe werkt telemonitoring?", "wat kost een medicijndispenser?", "wie betaalt zorgtechnologie?",
+    "wat is de rol van de verpleegkundige bij zorgtechnologie?", "hoe implementeer je technologie in een team?",
+    "wat is ethiek rondom camerabewaking?", "mag een client weigeren om technologie te gebruiken?",
+    "wat is privacy in de zorg?", "wat is de AVG?", "help me met een les over robotica in de zorg",
+    "ik wil een les over slimme pleisters", "ik zoek materiaal over leefstijl", "heb je iets over eenzaamheid?",
+    "what is home automation?", "make a lesson plan about fall prevention",
+    "hoe leer ik studenten omgaan met een tillift?", "wat zijn goede evaluatiemethoden?",
+    "geef succescriteria voor deze opdracht", "maak een rubric", "wat is formatief toetsen?",
+    "zet het in een tabel", "vat het samen", "maak er een powerpoint-indeling van",
+    "welke vragen kan ik stellen bij de nabespreking?", "hoe lang duurt deze les?",
+]
+
+
+def load_examples(path=INTENT_TRAINING_FILE):
+    """
+    The labelled examples: (texts, labels) with label 1 = needs retrieval.
+
+    Extra examples are read from `path` (JSON lines with "text" and "retrieve").
+    """
+    # Bare technology names, so unlisted terms that look like them lean towards retrieval too
+    needs_retrieval = NEEDS_RETRIEVAL + TECHNOLOGIES
+    texts = SMALL_TALK + needs_retrieval
+    labels = [0] * len(SMALL_TALK) + [1] * len(needs_retrieval)
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    example = json.loads(line)
+                    texts.append(example["text"])
+                    labels.append(1 if example["retrieve"] else 0)
+    return texts, labels
+
+
+class IntentClassifier:
+    """
+    Logistic regression over hashed word and character n-gram features.
+
+    Args:
+        dim (int): Feature vector size.
+        l2 (float): Weight decay.
+    """
+
+    def __init__(self, dim=FEATURE_DIM, l2=1e-3):
+        self.featurize = HashingEmbedder(dim=dim, ngram_range=(2, 4))
+        self.l2 = l2
+        self.weights = np.zeros(dim, dtype=np.float32)
+        self.bias = 0.0
+
+    def fit(self, texts, labels, epochs=400, learning_rate=8.0):
+        """Full-batch gradient descent; a few hundred examples train in a fraction of a second."""
+        X = self.featurize(texts)
+        y = np.asarray(labels, dtype=np.float32)
+        # Weigh both classes equally, whatever the ratio of examples
+        weight = np.where(y == 1, 0.5 / max(y.sum(), 1), 0.5 / max(len(y) - y.sum(), 1)).astype(np.float32)
+        w = np.zeros(X.shape[1], dtype=np.float32)
+        b = 0.0
+        for _ in range(epochs):
+            p = 1.0 / (1.0 + np.exp(-(X @ w + b)))
+            error = (p - y) * weight
+            w -= learning_rate * (X.T @ error + self.l2 * w)
+            b -= learning_rate * float(error.sum())
+        self.weights, self.bias = w, b
+        return self
+
+    def retrieval_probability(self, text):
+        """Probability that `text` is a question or task that needs the knowledge base."""
+        x = self.featurize([text])[0]
+        return float(1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias))))
+
+    def needs_retrieval(self, text, threshold=INTENT_SKIP_THRESHOLD, max_words=INTENT_MAX_WORDS):
+        """
+        Whether to search the knowledge base for `text`.
+
+        Returns:
+            tuple: (bool, probability of needing retrieval)
+        """
+        text = (text or "").strip()
+        if not text or len(text.split()) > max_words or _DOMAIN_RE.search(text):
+            return True, 1.0
+        p = self.retrieval_probability(text)
+        return 1.0 - p < threshold, p
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier():
+    """The classifier, trained once per process; None when INTENT_CLASSIFIER is off."""
+    global _classifier
+    if INTENT_CLASSIFIER in ("off", "0", "false", "none"):
+        return None
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = IntentClassifier().fit(*load_examples())
+    return _classifier
+
+
+def main():
+    classifier = get_classifier() or IntentClassifier().fit(*load_examples())
+    for text in sys.argv[1:]:
+        t0 = time.perf_counter()
+        retrieve, p = classifier.needs_retrieval(text)
+        elapsed = (time.perf_counter() - t0) * 1e6
+        print(f"{'retrieve' if retrieve else 'skip':8}  p={p:.2f}  {elapsed:6.0f} us  {text}")
+
+
+if __name__ == "__main__":
+    main()
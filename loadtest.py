@@ -0,0 +1,321 @@
+"""
+Load test of the chat endpoint against the local OpenAI stand-in.
+
+Starts `mock_openai` (unless --mock-url is given) and the app in the chosen
+server mode with OPENAI_BASE_URL pointing at the stand-in, then runs N
+concurrent SSE clients against POST /api/openai/response until M requests
+are done. Reports throughput, time to first byte / first text delta
+percentiles, the server's memory per open stream and the error rate, and
+saves everything as JSON for comparison across versions.
+
+Server modes:
+    flask   `flask --app app run` (threaded development server)
+    asgi    `uvicorn asgi_app:asgi`
+    none    an already running server at --url (memory only with --server-pid)
+
+The spawned server gets RESPONSE_CACHE=off and ADMISSION=off unless they
+are set, so every request streams from the stand-in and the measured
+throughput is the serving path's, not the admission limits' (concurrency
+cap, queue and rates). Set ADMISSION=on to measure with them. The settings
+that differ from the defaults are saved with the result.
+
+Usage:
+    python loadtest.py [--serve flask|asgi|none] [--concurrency 50] [--requests 200]
+                       [--out-dir loadtest_results] [mock options, see mock_openai.py]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+import mock_openai
+
+PERCENTILES = (50, 90, 95, 99)
+MEMORY_SAMPLE_INTERVAL = 0.1
+
+SERVER_DEFAULTS = {"OPENAI_API_KEY": "loadtest", "RESPONSE_CACHE": "off", "ADMISSION": "off"}
+
+# Settings of the app that change what a load test measures, saved with the result
+SERVER_SETTINGS = ("RESPONSE_CACHE", "SEMANTIC_CACHE", "RETRIEVAL_MODE", "SINGLE_FLIGHT", "CONVERSATION_STORE",
+                   "CONVERSATION_CHAINING", "ADMISSION", "ADMISSION_MAX_CONCURRENT", "ADMISSION_GLOBAL_RATE",
+                   "ADMISSION_USER_RATE", "UPSTREAM_POOL_SIZE", "UPSTREAM_RETRIES")
+
+QUESTIONS = (
+    "Wat is domotica en hoe zet je het in bij clienten met dementie?",
+    "Maak een lesplan van 50 minuten over valpreventie voor niveau 3.",
+    "Welke bronnen gaan over medicatieveiligheid in de wijkverpleging?",
+    "Hoe begeleid je studenten bij het gebruik van beeldzorg?",
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values):
+    """Nearest-rank percentiles (seconds, rounded) plus mean and max; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    out = {f"p{p}": round(ordered[min(len(ordered) - 1, max(0, -(-p * len(ordered) // 100) - 1))], 4)
+           for p in PERCENTILES}
+    out["mean"] = round(sum(ordered) / len(ordered), 4)
+    out["max"] = round(ordered[-1], 4)
+    return out
+
+
+def rss_bytes(pid):
+    """Resident memory of a process, from /proc (Linux) or psutil when installed; None if unknown."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# --------- server under test ---------
+
+def start_server(mode, port, mock_url):
+    """Start the app in `mode` on `port`, talking to the stand-in at `mock_url`."""
+    env = dict(os.environ, OPENAI_BASE_URL=mock_url)
+    for name, value in SERVER_DEFAULTS.items():
+        env.setdefault(name, value)
+    if mode == "flask":
+        cmd = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port), "--with-threads"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "asgi_app:asgi", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def wait_until_up(url, proc=None, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError(f"server exited: {proc.stderr.read().decode(errors='replace')[-2000:]}")
+        try:
+            if httpx.get(f"{url}/api/stats", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"server at {url} did not come up within {timeout}s")
+
+
+# --------- clients ---------
+
+async def one_request(client, url, question, session_id, timeout):
+    """
+    Stream one answer and time it.
+
+    Returns:
+        dict: status, ttfb_s (first body byte), ttft_s (first text delta),
+        total_s, deltas, bytes and error (None when the answer was complete).
+    """
+    result = {"status": None, "ttfb_s": None, "ttft_s": None, "total_s": None, "deltas": 0, "bytes": 0,
+              "error": None}
+    body = {"text": [{"role": "user", "content": question}], "session_id": session_id}
+    t0 = time.perf_counter()
+    done = False
+    try:
+        async with client.stream("POST", f"{url}/api/openai/response", json=body, timeout=timeout) as resp:
+            result["status"] = resp.status_code
+            buffer = ""
+            async for text in resp.aiter_text():
+                now = time.perf_counter()
+                if result["ttfb_s"] is None:
+                    result["ttfb_s"] = now - t0
+                result["bytes"] += len(text.encode())
+                buffer += text
+                *frames, buffer = buffer.split("\n\n")
+                for frame in frames:
+                    if frame.startswith("data: "):
+                        result["deltas"] += 1
+                        if result["ttft_s"] is None:
+                            result["ttft_s"] = now - t0
+                    elif frame.startswith("event: done"):
+                        done = True
+                    elif frame.startswith("event: error"):
+                        result["error"] = frame.split("data: ", 1)[-1]
+            if resp.status_code != 200:
+                result["error"] = f"HTTP {resp.status_code}"
+            elif not done and result["error"] is None:
+                result["error"] = "stream ended without a done frame"
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["total_s"] = time.perf_counter() - t0
+    return result
+
+
+async def sample_memory(pid, samples, stop):
+    while not stop.is_set():
+        rss = rss_bytes(pid)
+        if rss is not None:
+            samples.append(rss)
+        try:
+            await asyncio.wait_for(stop.wait(), MEMORY_SAMPLE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(url, concurrency, total, distinct, timeout, server_pid=None):
+    """Run `total` requests with `concurrency` clients; returns (per-request results, memory, wall seconds)."""
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        # Warm-up: imports, pools and first connections do not count
+        await one_request(client, url, "Warm-up vraag", "loadtest-warmup", timeout)
+        baseline = rss_bytes(server_pid) if server_pid else None
+
+        samples, stop = [], asyncio.Event()
+        sampler = asyncio.create_task(sample_memory(server_pid, samples, stop)) if baseline else None
+        counter = iter(range(total))
+        results = []
+
+        async def worker():
+            for i in counter:
+                # Distinct questions per request unless --distinct makes them repeat
+                n = i % distinct
+                question = f"{QUESTIONS[n % len(QUESTIONS)]} (#{n})"
+                results.append(await one_request(client, url, question, f"loadtest-{i}", timeout))
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - t0
+        stop.set()
+        if sampler is not None:
+            await sampler
+
+    memory = None
+    if baseline:
+        peak = max(samples, default=baseline)
+        memory = {
+            "baseline_mb": round(baseline / 2 ** 20, 1),
+            "peak_mb": round(peak / 2 ** 20, 1),
+            "per_stream_kb": round(max(0, peak - baseline) / min(concurrency, total) / 1024, 1),
+        }
+    return results, memory, wall
+
+
+def summarize(results, wall):
+    ok = [r for r in results if r["error"] is None]
+    errors = {}
+    for r in results:
+        if r["error"] is not None:
+            kind = r["error"] if r["error"].startswith(("HTTP", "stream")) else r["error"].split(":")[0]
+            errors[kind] = errors.get(kind, 0) + 1
+    deltas = sum(r["deltas"] for r in ok)
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else 0.0,
+        "deltas_per_s": round(deltas / wall, 1) if wall else 0.0,
+        "ttfb_s": percentiles([r["ttfb_s"] for r in ok if r["ttfb_s"] is not None]),
+        "ttft_s": percentiles([r["ttft_s"] for r in ok if r["ttft_s"] is not None]),
+        "total_s": percentiles([r["total_s"] for r in ok]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the chat endpoint against a local OpenAI stand-in.")
+    parser.add_argument("--serve", choices=("flask", "asgi", "none"), default="flask", help="server mode (default flask)")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="server under test with --serve none")
+    parser.add_argument("--server-pid", type=int, default=None, help="process to measure memory of with --serve none")
+    parser.add_argument("--mock-url", default=None, help="use a running mock_openai.py instead of starting one")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent SSE clients (default 50)")
+    parser.add_argument("--requests", type=int, default=200, help="requests in total (default 200)")
+    parser.add_argument("--distinct", type=int, default=None,
+                        help="distinct questions; fewer than --requests exercises caching and coalescing")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds per request (default 120)")
+    parser.add_argument("--out-dir", default="loadtest_results", help="folder for the JSON result (default loadtest_results)")
+    parser.add_argument("--label", default="", help="free text stored with the result, e.g. the change under test")
+    mock_openai.add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    mock_url = args.mock_url
+    if mock_url is None:
+        _, mock_url = mock_openai.start_in_thread(options=mock_openai.options_from_args(args))
+
+    proc, url, pid = None, args.url.rstrip("/"), args.server_pid
+    if args.serve != "none":
+        port = free_port()
+        proc = start_server(args.serve, port, mock_url)
+        url, pid = f"http://127.0.0.1:{port}", proc.pid
+    try:
+        wait_until_up(url, proc)
+        print(f"Load test: {args.requests} requests, {args.concurrency} concurrent, server {args.serve} at {url}")
+        results, memory, wall = asyncio.run(run_load(
+            url, args.concurrency, args.requests, args.distinct or args.requests, args.timeout, pid))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    summary = summarize(results, wall)
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "label": args.label,
+        "config": {
+            "serve": args.serve, "concurrency": args.concurrency, "requests": args.requests,
+            "distinct": args.distinct or args.requests, "tokens": args.tokens, "token_rate": args.token_rate,
+            "first_token_delay": args.first_token_delay, "jitter": args.jitter, "error_rate": args.error_rate,
+        },
+        "server_settings": {name: os.environ.get(name, SERVER_DEFAULTS.get(name) if proc else None)
+                            for name in SERVER_SETTINGS
+                            if name in os.environ or (proc and name in SERVER_DEFAULTS)},
+        "summary": summary,
+        "memory": memory,
+    }
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.out_dir, f"{stamp}_{args.serve}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    ttfb, ttft = summary["ttfb_s"] or {}, summary["ttft_s"] or {}
+    print(
+        f"Done: {summary['ok']}/{summary['requests']} ok in {summary['wall_s']}s — "
+        f"{summary['throughput_rps']} req/s, {summary['deltas_per_s']} deltas/s, "
+        f"error rate {summary['error_rate']:.1%} {summary['errors'] or ''}"
+    )
+    print(f"  TTFB  p50 {ttfb.get('p50')}s  p95 {ttfb.get('p95')}s  p99 {ttfb.get('p99')}s")
+    print(f"  TTFT  p50 {ttft.get('p50')}s  p95 {ttft.get('p95')}s  p99 {ttft.get('p99')}s")
+    if memory:
+        print(f"  memory {memory['baseline_mb']} -> {memory['peak_mb']} MB, {memory['per_stream_kb']} kB per stream")
+    print(f"Saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Local vector index for the kennisbank corpus.
+
+Alternative to the hosted file_search tool: chunks are embedded once and
+searched in-process, so retrieval costs no extra round trip and works
+offline with an offline embedder.
+
+Layout of an index directory:
+    meta.json        embedder spec, dimension and number of rows
+    chunks.jsonl     one {"source", "text"} object per row, append-only
+    embeddings.f32   float32 matrix (rows x dim), memory-mapped
+    ivf.npz          optional inverted-file index (see `LocalIndex.build_ivf`)
+    deleted.json     rows of removed or replaced chunks, never returned by searches
+
+Configuration (environment variables):
+    RETRIEVAL_MODE        hosted | local | hybrid (default hosted, see hybrid_search)
+    LOCAL_INDEX_DIR       index directory (default local_index)
+    LOCAL_INDEX_EMBEDDER  embedder spec, see `embeddings.make_embedder` (default openai)
+    LOCAL_INDEX_TOP_K     passages injected per question (default 10)
+    LOCAL_INDEX_NPROBE    IVF lists searched per query (default 8)
+"""
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+from embeddings import embedder_id, make_embedder
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hosted").lower()
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "local_index")
+LOCAL_INDEX_EMBEDDER = os.getenv("LOCAL_INDEX_EMBEDDER", "openai")
+LOCAL_INDEX_TOP_K = int(os.getenv("LOCAL_INDEX_TOP_K", "10"))
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+
+
+def top_k_rows(scores, k):
+    """Indices of the k highest scores per row of a 2D array, best first."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, part, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(part, order, axis=1)
+
+
+class LocalIndex:
+    """
+    Append-only chunk store with brute-force or IVF top-k search.
+
+    Args:
+        directory (str): Index directory, created if missing.
+        embedder (callable): texts -> normalized float32 rows. Must be the
+            same embedder the index was built with.
+        embedder_spec (str): Embedder spec; recorded in meta.json for new
+            indexes and checked against it for existing ones.
+
+    Raises:
+        ValueError: The index was built with another embedder.
+    """
+
+    def __init__(self, directory, embedder, embedder_spec=""):
+        self.directory = directory
+        self.embedder = embedder
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.meta = {"embedder": embedder_id(embedder_spec), "dim": None, "count": 0}
+        if os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                self.meta = json.load(f)
+        built_with = self.meta.get("embedder")
+        if embedder_spec and built_with and built_with not in (embedder_spec, embedder_id(embedder_spec)):
+            raise ValueError(
+                f"Index {directory} was built with embedder {built_with!r}, not {embedder_id(embedder_spec)!r}; "
+                f"set LOCAL_INDEX_EMBEDDER accordingly or rebuild the index"
+            )
+
+        self.chunks = []
+        if os.path.exists(self._path("chunks.jsonl")):
+            with open(self._path("chunks.jsonl"), encoding="utf-8") as f:
+                self.chunks = [json.loads(line) for line in f][:self.meta["count"]]
+
+        self.deleted = set()
+        if os.path.exists(self._path("deleted.json")):
+            with open(self._path("deleted.json"), encoding="utf-8") as f:
+                self.deleted = set(json.load(f))
+
+        self._matrix = None
+        self._ivf = None
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        count, dim = self.meta["count"], self.meta["dim"]
+        if count:
+            self._matrix = np.memmap(self._path("embeddings.f32"), dtype=np.float32, mode="r", shape=(count, dim))
+        if os.path.exists(self._path("ivf.npz")):
+            with np.load(self._path("ivf.npz")) as ivf:
+                self._ivf = {name: ivf[name] for name in ivf.files}
+
+    def _save_meta(self):
+        tmp = self._path("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._path("meta.json"))
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def delete_rows(self, rows):
+        """Tombstone rows, e.g. the chunks of a file that changed or disappeared."""
+        with self._lock:
+            self.deleted.update(int(r) for r in rows)
+            tmp = self._path("deleted.json.tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(sorted(self.deleted), f)
+            os.replace(tmp, self._path("deleted.json"))
+
+    def add(self, chunks, vectors=None):
+        """
+        Append chunks to the index.
+
+        Args:
+            chunks (list[dict]): {"source": filename, "text": passage} items;
+                extra keys are stored as is.
+            vectors (np.ndarray, optional): Precomputed embeddings, otherwise
+                the chunk texts are embedded with the index embedder.
+        """
+        if not chunks:
+            return
+        if vectors is None:
+            vectors = self.embedder([c["text"] for c in chunks])
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self.meta["dim"] is None:
+                self.meta["dim"] = int(vectors.shape[1])
+            elif vectors.shape[1] != self.meta["dim"]:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} != index dimension {self.meta['dim']}")
+
+            with open(self._path("embeddings.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._path("chunks.jsonl"), "a", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+            self.chunks.extend(chunks)
+            self.meta["count"] += len(chunks)
+            self._save_meta()
+            self._load()
+
+    def build_ivf(self, n_lists=None, iterations=10, seed=0):
+        """
+        Cluster the rows with spherical k-means into an inverted-file index.
+
+        Searches then only score the rows in the `nprobe` closest lists.
+        Rows added after the IVF was built are always scanned as well.
+        """
+        matrix = np.asarray(self._matrix)
+        n = len(matrix)
+        n_lists = min(n_lists or max(1, int(np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(n, size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(matrix @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = matrix[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        assign = np.argmax(matrix @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.searchsorted(assign[order], np.arange(n_lists + 1)).astype(np.int32)
+        np.savez(self._path("ivf.npz"), centroids=centroids, order=order, offsets=offsets, rows=np.int64(n))
+        self._load()
+
+    def _candidates(self, query_vectors, nprobe):
+        """Rows to score for each query: the probed IVF lists plus unindexed rows."""
+        ivf = self._ivf
+        centroids, order, offsets = ivf["centroids"], ivf["order"], ivf["offsets"]
+        tail = np.arange(int(ivf["rows"]), len(self), dtype=np.int32)
+        probes = top_k_rows(query_vectors @ centroids.T, nprobe)
+        out = []
+        for lists in probes:
+            parts = [order[offsets[c]:offsets[c + 1]] for c in lists]
+            out.append(np.concatenate(parts + [tail]))
+        return out
+
+    def search_batch(self, queries, k=LOCAL_INDEX_TOP_K, nprobe=LOCAL_INDEX_NPROBE):
+        """
+        Top-k passages for several queries at once.
+
+        Returns:
+            list[list[dict]]: Per query, the best chunks with their 'row'
+            number and cosine 'score'.
+        """
+        if not len(self) or not queries:
+            return [[] for _ in queries]
+        query_vectors = self.embedder(list(queries))
+        if query_vectors.shape[1] != self.meta["dim"]:
+            raise ValueError(f"Query embedding dimension {query_vectors.shape[1]} != index dimension {self.meta['dim']}")
+        matrix = self._matrix
+
+        deleted = np.fromiter(self.deleted, dtype=np.int64) if self.deleted else None
+
+        if self._ivf is None:
+            scores = query_vectors @ matrix.T
+            if deleted is not None:
+                scores[:, deleted] = -np.inf
+            rows = top_k_rows(scores, k)
+            hits = [[(int(r), float(scores[q, r])) for r in rows[q] if scores[q, r] > -np.inf]
+                    for q in range(len(queries))]
+        else:
+            hits = []
+            for q, candidates in enumerate(self._candidates(query_vectors, nprobe)):
+                if deleted is not None:
+                    candidates = candidates[~np.isin(candidates, deleted)]
+                scores = matrix[candidates] @ query_vectors[q]
+                best = top_k_rows(scores[None, :], k)[0]
+                hits.append([(int(candidates[i]), float(scores[i])) for i in best])
+
+        return [[{**self.chunks[row], "row": row, "score": score} for row, score in per_query] for per_query in hits]
+
+    def search(self, query, k=LOCAL_INDEX_TOP_K):
+        return self.search_batch([query], k)[0]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Open the index in `LOCAL_INDEX_DIR` once per process."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LocalIndex(LOCAL_INDEX_DIR, make_embedder(LOCAL_INDEX_EMBEDDER), LOCAL_INDEX_EMBEDDER)
+    return _index
+
+
+def format_context(results):
+    """
+    Format retrieved passages as instructions for the model, like
+    `vector_store_search` in bron_test.ipynb.
+
+    Returns:
+        tuple: (context text, list of unique source filenames)
+    """
+    if not results:
+        return '\nzeg dat je het niet weet omdat je hier geen informatie over hebt en dat ik iets anders kan vragen', []
+
+    context = "Dit zijn de bronnen waarop je het antwoord moet baseren: \n "
+    file_names = []
+    for result in results:
+        context += f"Start Bron '{result['source']}': \n\n{result['text']} \n\n Einde Bron '{result['source']}' \n\n"
+        if result['source'] not in file_names:
+            file_names.append(result['source'])
+    return context, file_names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query or maintain the local kennisbank index.")
+    parser.add_argument("query", nargs="*", help="question(s) to search for")
+    parser.add_argument("--dir", default=LOCAL_INDEX_DIR)
+    parser.add_argument("--embedder", default=LOCAL_INDEX_EMBEDDER)
+    parser.add_argument("-k", type=int, default=LOCAL_INDEX_TOP_K)
+    parser.add_argument("--build-ivf", type=int, metavar="N_LISTS", nargs="?", const=0,
+                        help="(re)build the IVF index, N_LISTS defaults to sqrt(rows)")
+    args = parser.parse_args()
+
+    index = LocalIndex(args.dir, make_embedder(args.embedder), args.embedder)
+    if args.build_ivf is not None:
+        index.build_ivf(args.build_ivf or None)
+        print(f"IVF built over {len(index)} chunks")
+    for query, results in zip(args.query, index.search_batch(args.query, args.k)):
+        print(f"\n# {query}")
+        for r in results:
+            print(f"{r['score']:.3f}  {r['source']}  {r['text'][:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+In-process latency metrics for the chat streaming path.
+
+Fixed-bucket histograms and counters, cheap enough to update on every
+request, rendered in the Prometheus text format by the /metrics endpoint.
+Each chat request carries a `RequestTrace` that records when its phases
+ended; on `finish` the durations go into the histograms and, with
+METRICS_TRACE_LOG set, into a JSON-lines file (one object per request).
+
+Configuration (environment variables):
+    METRICS_TRACE_LOG  path of the JSON-lines trace log (default: no log)
+"""
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+METRICS_TRACE_LOG = os.getenv("METRICS_TRACE_LOG", "")
+
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 60, 120)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BYTES_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{str(v)}"' for k, v in sorted(labels.items()))
+    return "{" + inner + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram (Prometheus semantics)."""
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def quantile(self, q):
+        """Estimate the q-quantile by linear interpolation inside its bucket (None when empty)."""
+        with self._lock:
+            counts = list(self._counts)
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def render(self):
+        with self._lock:
+            counts, total_sum = list(self._counts), self._sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total_sum)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, optionally split by one label."""
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value=None, n=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + n
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_value, value in sorted(values.items(), key=lambda item: str(item[0])):
+            labels = {self.label: label_value} if self.label and label_value is not None else None
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Metric whose samples are read at scrape time, e.g. from the stats of an existing component.
+
+    Args:
+        fn (callable): Returns {labels dict or None: value}, or a single value.
+    """
+
+    def __init__(self, name, help, type, fn):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+
+    def render(self):
+        samples = self.fn()
+        if samples is None:
+            return []
+        if not isinstance(samples, dict):
+            samples = {None: samples}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in samples.items():
+            lines.append(f"{self.name}{_format_labels(dict(labels) if labels else None)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def counter(self, name, help, label=None):
+        return self.register(Counter(name, help, label))
+
+    def callback(self, name, help, type, fn):
+        return self.register(CallbackMetric(name, help, type, fn))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.counter("rag_requests_total", "Chat requests by outcome.", label="outcome")
+retrieval_seconds = registry.histogram(
+    "rag_retrieval_seconds", "Retrieval, payload preparation and cache lookup before the upstream call.")
+queue_seconds = registry.histogram("rag_queue_wait_seconds", "Time waiting for an admission slot.")
+connect_seconds = registry.histogram(
+    "rag_upstream_connect_seconds", "From sending the upstream request until its response headers arrived.")
+file_search_seconds = registry.histogram(
+    "rag_file_search_seconds", "From the start of the request until the hosted file_search call was done.")
+ttft_seconds = registry.histogram(
+    "rag_time_to_first_token_seconds", "From the start of the request until the first text delta was sent.")
+duration_seconds = registry.histogram("rag_stream_duration_seconds", "Total duration of the chat request.")
+deltas_count = registry.histogram("rag_response_deltas", "Text frames (merged deltas) sent per answer.", COUNT_BUCKETS)
+bytes_count = registry.histogram("rag_response_bytes", "Bytes of SSE frames sent per answer.", BYTES_BUCKETS)
+sources_count = registry.histogram("rag_response_sources", "Source files cited per answer.", (0, 1, 2, 3, 5, 10, 20))
+intent_total = registry.counter(
+    "rag_intent_decisions_total", "Retrieval decisions of the intent classifier (retrieve or skip).", label="decision")
+intent_seconds = registry.histogram(
+    "rag_intent_seconds", "Time to classify a message.", (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.01))
+
+_trace_lock = threading.Lock()
+
+
+class RequestTrace:
+    """
+    Timestamps and sizes of one chat request.
+
+    `mark` records the time since the start of the request, `phase` the
+    duration since `start_phase`; both only once per name. `frame` counts
+    what is sent to the browser. The code handling the request sets
+    `outcome` and `sources`; `finish` records them.
+    """
+
+    def __init__(self, mode=""):
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.mode = mode
+        self.outcome = "ok"
+        self.marks = {}
+        self.deltas = 0
+        self.bytes = 0
+        self.sources = 0
+        self.finished = False
+        self._phase_started = self.started
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def start_phase(self):
+        """Begin a phase measured on its own (queue wait, upstream connect)."""
+        self._phase_started = time.perf_counter()
+
+    def phase(self, name):
+        """Record the duration since `start_phase` under `name`."""
+        if name not in self.marks:
+            self.marks[name] = time.perf_counter() - self._phase_started
+
+    def mark(self, name, at=None):
+        """Record the time since the start of the request under `name` (once)."""
+        if name not in self.marks:
+            self.marks[name] = (at if at is not None else time.perf_counter()) - self.started
+
+    def frame(self, frame, delta=False):
+        """Count a frame sent to the browser; the first text delta marks the first token."""
+        self.bytes += len(frame.encode("utf-8"))
+        if delta:
+            self.deltas += 1
+            if "first_token" not in self.marks:
+                self.mark("first_token")
+
+    def finish(self, outcome=None):
+        """Observe the request in the histograms and the trace log (only the first call counts)."""
+        if self.finished:
+            return
+        self.finished = True
+        outcome = outcome or self.outcome
+        sources = self.sources
+        total = self.elapsed()
+        requests_total.inc(outcome)
+        for name, histogram in (("retrieval", retrieval_seconds), ("queue", queue_seconds),
+                                ("connect", connect_seconds), ("file_search", file_search_seconds),
+                                ("first_token", ttft_seconds)):
+            if name in self.marks:
+                histogram.observe(self.marks[name])
+        duration_seconds.observe(total)
+        if outcome in ("ok", "cache_hit", "coalesced"):
+            deltas_count.observe(self.deltas)
+            bytes_count.observe(self.bytes)
+            sources_count.observe(sources)
+
+        if METRICS_TRACE_LOG:
+            record = {
+                "ts": round(self.wall_started, 3),
+                "outcome": outcome,
+                "mode": self.mode,
+                **{f"{name}_s": round(value, 4) for name, value in self.marks.items()},
+                "total_s": round(total, 4),
+                "deltas": self.deltas,
+                "bytes": self.bytes,
+                "sources": sources,
+            }
+            line = json.dumps(record) + "\n"
+            with _trace_lock:
+                with open(METRICS_TRACE_LOG, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+
+def traced(frames, trace):
+    """Pass the SSE `frames` of a request through, counting them in `trace` and finishing it at the end."""
+    try:
+        for frame in frames:
+            trace.frame(frame, delta=frame.startswith("data: "))
+            yield frame
+    except GeneratorExit:
+        # Close the inner stream now (it may still have work to do), not at garbage collection
+        frames.close()
+        trace.finish("aborted")
+        raise
+    except BaseException:
+        trace.finish("error")
+        raise
+    trace.finish()
+
+
+def summary():
+    """p50/p95 of the main latencies, for /api/stats."""
+    out = {}
+    for name, histogram in (("ttft", ttft_seconds), ("file_search", file_search_seconds),
+                            ("connect", connect_seconds), ("duration", duration_seconds)):
+        p50, p95 = histogram.quantile(0.5), histogram.quantile(0.95)
+        out[name] = {"p50_s": round(p50, 3) if p50 is not None else None,
+                     "p95_s": round(p95, 3) if p95 is not None else None}
+    return out
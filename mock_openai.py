@@ -0,0 +1,373 @@
+"""
+Local stand-in for the OpenAI Responses and Embeddings endpoints.
+
+Streams the same frames the chat path reads from the Responses API
+(`response.output_item.done` with a `file_search_call` and its results,
+`response.output_text.delta`, `response.completed`, `[DONE]`) at a
+configurable pace, so the app can be load-tested without an API key or
+API costs. Point the app at it with OPENAI_BASE_URL.
+
+Non-streaming requests get a complete response object, /embeddings
+returns deterministic vectors from `embeddings.HashingEmbedder`, /files
+plus /batches imitate the Batch API (a batch completes at once), and
+/files plus /vector_stores/{id}/files accept the uploads of
+`ingest.py --target hosted`.
+
+Usage:
+    python mock_openai.py [--port 9900] [--tokens 200] [--token-rate 50]
+                          [--first-token-delay 0.8] [--error-rate 0]
+    OPENAI_BASE_URL=http://127.0.0.1:9900 python app.py
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "de het een en van in op te dat voor met is zijn bij als ook studenten docent les "
+    "leeruitkomst zorg client verpleegkundige opdracht werkvorm reflectie praktijk "
+    "module niveau mbo technologie toepassing domotica begeleiding bron kennis"
+).split()
+
+FILENAMES = (
+    "Handreiking_zorgtechnologie.pdf",
+    "Factsheet_domotica.pdf",
+    "Kennisbank_valpreventie.pdf",
+    "Leermiddel_medicatieveiligheid.docx",
+    "Praktijkvoorbeeld_beeldzorg.pdf",
+    "Richtlijn_decubitus.pdf",
+)
+
+
+class MockOptions:
+    """
+    How the stand-in answers.
+
+    Args:
+        tokens (int): Text deltas per answer.
+        token_rate (float): Deltas per second (0 = as fast as possible).
+        first_token_delay (float): Seconds before the file_search results
+            and the first delta, the time the hosted search takes.
+        jitter (float): Relative random variation of both delays (0.2 = ±20%).
+        files (int): Results in the file_search call.
+        error_rate (float): Fraction of requests answered with HTTP 500.
+    """
+
+    def __init__(self, tokens=200, token_rate=50.0, first_token_delay=0.8, jitter=0.2, files=3, error_rate=0.0):
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.first_token_delay = first_token_delay
+        self.jitter = jitter
+        self.files = files
+        self.error_rate = error_rate
+
+    def vary(self, seconds):
+        if not self.jitter:
+            return seconds
+        return max(0.0, seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = MockOptions()
+    _ids = itertools.count(1)
+    _ids_lock = threading.Lock()
+    files = {}          # file id -> bytes (uploads and Batch API output files)
+    batches = {}        # batch id -> batch object
+    vector_stores = {}  # vector store id -> set of attached file ids
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, text):
+        data = text.encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _event(self, obj):
+        self._chunk(f"event: {obj['type']}\ndata: {json.dumps(obj)}\n\n")
+
+    def _next_id(self, prefix):
+        with self._ids_lock:
+            return f"{prefix}_mock_{next(self._ids)}"
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        parts = path.split("/")
+        if len(parts) >= 3 and parts[-3] == "vector_stores" and parts[-1] == "files":
+            data = [{"id": file_id, "object": "vector_store.file", "status": "completed"}
+                    for file_id in sorted(self.vector_stores.get(parts[-2], ()))]
+            self._json(200, {"object": "list", "data": data, "has_more": False})
+        elif len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.batches:
+            self._json(200, self.batches[parts[-1]])
+        elif path.endswith("/content") and parts[-2] in self.files:
+            data = self.files[parts[-2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._json(404, {"error": {"message": f"unknown endpoint {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        path = self.path.rstrip("/")
+        if path.endswith("/files") and "/vector_stores/" not in path:
+            self.upload_file(raw)
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self._json(400, {"error": {"message": "invalid JSON body"}})
+            return
+
+        if path.endswith("/batches"):
+            self.create_batch(body)
+        elif "/vector_stores/" in path and path.endswith("/files"):
+            self.attach_file(path.split("/")[-2], body)
+        elif path.endswith("/embeddings"):
+            self.embeddings(body)
+        elif path.endswith("/responses"):
+            if random.random() < self.options.error_rate:
+                self._json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+            elif body.get("stream"):
+                try:
+                    self.stream_response(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client went away
+            else:
+                self.complete_response(body)
+        else:
+            self._json(404, {"error": {"message": f"unknown endpoint {self.path}"}})
+
+    def do_DELETE(self):
+        parts = self.path.rstrip("/").split("/")
+        if len(parts) >= 4 and parts[-4] == "vector_stores" and parts[-2] == "files":
+            attached = self.vector_stores.get(parts[-3], set())
+            found = parts[-1] in attached
+            attached.discard(parts[-1])
+        elif len(parts) >= 2 and parts[-2] == "files":
+            found = self.files.pop(parts[-1], None) is not None
+        else:
+            self._json(404, {"error": {"message": f"unknown endpoint {self.path}"}})
+            return
+        if found:
+            self._json(200, {"id": parts[-1], "deleted": True})
+        else:
+            self._json(404, {"error": {"message": f"no such file {parts[-1]}"}})
+
+    # --------- endpoints ---------
+
+    def embeddings(self, body):
+        from embeddings import HashingEmbedder
+
+        texts = body.get("input") or []
+        if isinstance(texts, str):
+            texts = [texts]
+        vectors = HashingEmbedder()(texts)
+        self._json(200, {
+            "object": "list",
+            "model": body.get("model"),
+            "data": [{"object": "embedding", "index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)],
+            "usage": {"prompt_tokens": sum(len(t.split()) for t in texts), "total_tokens": 0},
+        })
+
+    def upload_file(self, raw):
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + raw)
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                file_id = self._next_id("file")
+                self.files[file_id] = part.get_payload(decode=True)
+                self._json(200, {"id": file_id, "object": "file", "filename": part.get_filename(),
+                                 "bytes": len(self.files[file_id])})
+                return
+        self._json(400, {"error": {"message": "no file in the upload"}})
+
+    def attach_file(self, vector_store_id, body):
+        file_id = body.get("file_id")
+        if file_id not in self.files:
+            self._json(404, {"error": {"message": f"no such file {file_id}"}})
+            return
+        self.vector_stores.setdefault(vector_store_id, set()).add(file_id)
+        self._json(200, {"id": file_id, "object": "vector_store.file", "vector_store_id": vector_store_id,
+                         "status": "completed"})
+
+    def create_batch(self, body):
+        """Answer every request of the input file right away (without the pacing delays)."""
+        data = self.files.get(body.get("input_file_id"))
+        if data is None:
+            self._json(404, {"error": {"message": "unknown input_file_id"}})
+            return
+        output = []
+        for line in data.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            response_id, deltas, files = self._answer()
+            output.append(json.dumps({
+                "id": self._next_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": self._response_object(request["body"], response_id,
+                                                                                 deltas, files)},
+                "error": None,
+            }))
+        output_file_id = self._next_id("file")
+        self.files[output_file_id] = "\n".join(output).encode("utf-8")
+        batch_id = self._next_id("batch")
+        self.batches[batch_id] = {
+            "id": batch_id, "object": "batch", "endpoint": body.get("endpoint"), "status": "completed",
+            "input_file_id": body["input_file_id"], "output_file_id": output_file_id, "error_file_id": None,
+            "request_counts": {"total": len(output), "completed": len(output), "failed": 0},
+            "metadata": body.get("metadata"),
+        }
+        self._json(200, {**self.batches[batch_id], "status": "validating"})
+
+    def _answer(self):
+        response_id = self._next_id("resp")
+        words = [random.choice(WORDS) for _ in range(self.options.tokens)]
+        deltas = [(" " if i else "") + w for i, w in enumerate(words)]
+        files = random.sample(FILENAMES, min(self.options.files, len(FILENAMES)))
+        return response_id, deltas, files
+
+    @staticmethod
+    def _usage(body, deltas):
+        input_tokens = len(json.dumps(body.get("input") or "")) // 4
+        return {"input_tokens": input_tokens, "output_tokens": len(deltas),
+                "total_tokens": input_tokens + len(deltas)}
+
+    def _response_object(self, body, response_id, deltas, files):
+        text = "".join(deltas)
+        output = []
+        if body.get("tools"):
+            output.append({"id": f"fs_{response_id}", "type": "file_search_call", "status": "completed",
+                           "results": [{"filename": name, "score": 0.8} for name in files]})
+        output.append({"type": "message", "role": "assistant",
+                       "content": [{"type": "output_text", "text": text, "annotations": []}]})
+        return {
+            "id": response_id,
+            "object": "response",
+            "status": "completed",
+            "model": body.get("model"),
+            "output": output,
+            "output_text": text,
+            "usage": self._usage(body, deltas),
+        }
+
+    def complete_response(self, body):
+        response_id, deltas, files = self._answer()
+        time.sleep(self.options.vary(self.options.first_token_delay))
+        if self.options.token_rate:
+            time.sleep(len(deltas) / self.options.token_rate)
+        self._json(200, self._response_object(body, response_id, deltas, files))
+
+    def stream_response(self, body):
+        response_id, deltas, files = self._answer()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        response = {"id": response_id, "object": "response", "status": "in_progress", "model": body.get("model")}
+        self._event({"type": "response.created", "response": response})
+        if body.get("tools"):
+            call = {"id": f"fs_{response_id}", "type": "file_search_call", "status": "in_progress"}
+            self._event({"type": "response.output_item.added", "output_index": 0, "item": call})
+            time.sleep(self.options.vary(self.options.first_token_delay))
+            results = [{"file_id": f"file-{i}", "filename": name, "score": round(0.9 - i / 20, 3), "text": "..."}
+                       for i, name in enumerate(files)]
+            self._event({"type": "response.output_item.done", "output_index": 0,
+                         "item": {**call, "status": "completed", "results": results}})
+        else:
+            time.sleep(self.options.vary(self.options.first_token_delay))
+
+        interval = 1.0 / self.options.token_rate if self.options.token_rate else 0.0
+        for delta in deltas:
+            self._event({"type": "response.output_text.delta", "output_index": 1, "content_index": 0, "delta": delta})
+            if interval:
+                time.sleep(self.options.vary(interval))
+        self._event({"type": "response.output_text.done", "output_index": 1, "content_index": 0,
+                     "text": "".join(deltas)})
+        self._event({"type": "response.completed",
+                     "response": {**response, "status": "completed", "usage": self._usage(body, deltas)}})
+        self._chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def make_server(host="127.0.0.1", port=0, options=None):
+    """
+    Create a stand-in server; port 0 picks a free port.
+
+    Returns:
+        MockServer: Call `serve_forever()`; its base URL is `base_url(server)`.
+    """
+    handler = type("Handler", (MockHandler,), {"options": options or MockOptions()})
+    return MockServer((host, port), handler)
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+def start_in_thread(host="127.0.0.1", port=0, options=None):
+    """Run a stand-in server on a daemon thread; returns (server, base URL)."""
+    server = make_server(host, port, options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url(server)
+
+
+def add_mock_arguments(parser):
+    """The pacing options of the stand-in, shared with loadtest.py."""
+    parser.add_argument("--tokens", type=int, default=200, help="text deltas per answer (default 200)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="deltas per second, 0 = no delay (default 50)")
+    parser.add_argument("--first-token-delay", type=float, default=0.8,
+                        help="seconds of simulated file_search before the first delta (default 0.8)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative variation of the delays (default 0.2)")
+    parser.add_argument("--files", type=int, default=3, help="file_search results per answer (default 3)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of HTTP 500 answers (default 0)")
+
+
+def options_from_args(args):
+    return MockOptions(args.tokens, args.token_rate, args.first_token_delay, args.jitter, args.files,
+                       args.error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for the OpenAI Responses API, for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9900)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, options_from_args(args))
+    print(f"Mock OpenAI API on {base_url(server)} (set OPENAI_BASE_URL to this)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
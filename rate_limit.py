@@ -0,0 +1,118 @@
+"""
+Thread-safe token-bucket rate limiting.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    Allow `rate` operations per second on average, with bursts up to `capacity`.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float, optional): Bucket size, defaults to `rate` (one
+            second worth of burst, at least 1).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, n=1):
+        """Take `n` tokens if available; never blocks."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= n:
+                self._tokens -= n
+                return True
+            return False
+
+    def is_full(self, now=None):
+        """Whether the bucket has refilled to capacity (then it equals a new one)."""
+        with self._lock:
+            self._refill(time.monotonic() if now is None else now)
+            return self._tokens >= self.capacity
+
+    def wait_time(self, n=1):
+        """Seconds until `n` tokens will be available (0 if they are now)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (n - self._tokens) / self.rate)
+
+    def acquire(self, n=1, timeout=None):
+        """
+        Block until `n` tokens are taken.
+
+        Returns:
+            bool: False if `timeout` seconds passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return True
+                wait = (n - self._tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
+
+
+class KeyedTokenBuckets:
+    """
+    One lazily created `TokenBucket` per key (host, user, ...).
+
+    Buckets that have refilled to capacity are dropped when they are next
+    swept (a new bucket is identical), and at most `max_keys` are kept, the
+    least recently used going first, so unbounded key streams cannot grow
+    the table without limit.
+
+    Args:
+        rate, capacity: See `TokenBucket`.
+        max_keys (int): Most buckets kept at once.
+    """
+
+    def __init__(self, rate, capacity=None, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+
+    def _sweep(self, now):
+        """Drop full buckets, at most once per refill time of a bucket. Caller holds the lock."""
+        if now < self._next_sweep:
+            return
+        for key in [k for k, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[key]
+        capacity = self.capacity if self.capacity is not None else max(1.0, self.rate)
+        self._next_sweep = now + capacity / self.rate
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._sweep(time.monotonic())
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
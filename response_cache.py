@@ -0,0 +1,197 @@
+"""
+Exact-match cache for streamed RAG answers.
+
+An answer is stored as the list of text deltas plus the file_search sources
+it produced, keyed on a hash of the normalized conversation, the model, the
+instructions and the vector store. On a hit the app replays the stored
+frames instead of calling the Responses API.
+
+Configuration (environment variables):
+    RESPONSE_CACHE       memory | disk | off (default memory)
+    RESPONSE_CACHE_SIZE  max number of cached answers (default 512)
+    RESPONSE_CACHE_TTL   seconds an answer stays valid (default 86400)
+    RESPONSE_CACHE_PATH  SQLite file for the disk backend (default response_cache.sqlite3)
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory").lower()
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "response_cache.sqlite3")
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_input(value):
+    """Casefold and collapse whitespace in every string of a conversation payload."""
+    if isinstance(value, str):
+        return _WS_RE.sub(" ", value).strip().casefold()
+    if isinstance(value, list):
+        return [normalize_input(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_input(v) for k, v in value.items()}
+    return value
+
+
+def cache_key(payload, vector_store_id):
+    """
+    Hash everything that determines the answer to a Responses API payload.
+
+    Args:
+        payload (dict): Payload as built by `app.build_payload`.
+        vector_store_id (str): Vector store searched by the file_search tool.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    material = {
+        "input": normalize_input(payload.get("input")),
+        "model": payload.get("model"),
+        "instructions": payload.get("instructions"),
+        "tools": payload.get("tools"),
+        "vector_store_id": vector_store_id,
+    }
+    if payload.get("previous_response_id"):
+        # Follow-up of a stored response: same text, different conversation
+        material["previous_response_id"] = payload["previous_response_id"]
+    blob = json.dumps(material, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """Thread-safe hit/miss/eviction counters."""
+
+    FIELDS = ("hits", "misses", "evictions")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field, n=1):
+        if n:
+            with self._lock:
+                self._counts[field] += n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class MemoryBackend:
+    """In-process LRU. `get` and `set` return the number of evicted entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None, 0
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                return None, 1
+            self._data.move_to_end(key)
+            return value, 0
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            evicted = 0
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                evicted += 1
+            return evicted
+
+
+class DiskBackend:
+    """SQLite store that survives restarts, evicting least recently used rows."""
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+
+    def get(self, key, now):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, 0
+            value, expires_at = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None, 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return json.loads(value), 0
+
+    def set(self, key, value, expires_at):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            evicted = self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,)).rowcount
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > self.max_entries:
+                evicted += self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+            return evicted
+
+
+class ResponseCache:
+    """
+    TTL cache in front of a backend.
+
+    Cached values are dicts `{"deltas": [str, ...], "sources": [str, ...]}`.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    def get(self, key):
+        value, evicted = self.backend.get(key, time.time())
+        self.stats.incr("evictions", evicted)
+        self.stats.incr("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key, deltas, sources):
+        value = {"deltas": list(deltas), "sources": sorted(sources)}
+        evicted = self.backend.set(key, value, time.time() + self.ttl)
+        self.stats.incr("evictions", evicted)
+
+
+def make_cache():
+    """Build the cache selected by `RESPONSE_CACHE`, or None when caching is off."""
+    if RESPONSE_CACHE == "disk":
+        return ResponseCache(DiskBackend(RESPONSE_CACHE_PATH, RESPONSE_CACHE_SIZE), RESPONSE_CACHE_TTL)
+    if RESPONSE_CACHE == "memory":
+        return ResponseCache(MemoryBackend(RESPONSE_CACHE_SIZE), RESPONSE_CACHE_TTL)
+    return None
+
+
+cache = make_cache()
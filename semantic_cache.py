@@ -0,0 +1,181 @@
+"""
+Embedding-similarity answer cache for near-duplicate questions.
+
+The latest user turn is embedded and compared against the embeddings of
+earlier questions, kept in a memory-mapped float32 matrix. When the best
+cosine similarity reaches the threshold the stored answer and sources are
+served without calling the Responses API.
+
+Only opening questions (a conversation with a single user turn) are looked
+up and stored: a follow-up such as "leg dat verder uit" depends on the turns
+before it and cannot be answered from another conversation.
+
+Configuration (environment variables):
+    SEMANTIC_CACHE            on | off (default off)
+    SEMANTIC_CACHE_THRESHOLD  minimum cosine similarity for a hit (default 0.92)
+    SEMANTIC_CACHE_SIZE       number of slots; the oldest entry is overwritten (default 4096)
+    SEMANTIC_CACHE_DIR        directory of the matrix and answers (default semantic_cache)
+    SEMANTIC_CACHE_EMBEDDER   embedder spec, see `embeddings.make_embedder` (default openai)
+"""
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from embeddings import embedder_id, make_embedder
+
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "off").lower() == "on"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "4096"))
+SEMANTIC_CACHE_DIR = os.getenv("SEMANTIC_CACHE_DIR", "semantic_cache")
+SEMANTIC_CACHE_EMBEDDER = os.getenv("SEMANTIC_CACHE_EMBEDDER", "openai")
+
+
+def latest_user_turn(user_input):
+    """
+    Return the text of the question to look up, or None for follow-up turns.
+
+    Args:
+        user_input: A plain string or the list of {role, content} messages
+            that `static.js` sends.
+    """
+    if isinstance(user_input, str):
+        return user_input.strip() or None
+    if isinstance(user_input, list) and len(user_input) == 1:
+        message = user_input[0]
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = message.get("content")
+            if isinstance(content, str) and content.strip():
+                return content.strip()
+    return None
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour answer cache.
+
+    Args:
+        directory (str): Holds `embeddings.f32` (the memory-mapped matrix)
+            and `answers.sqlite3` (question, answer and sources per slot).
+        embedder (callable): texts -> normalized float32 rows.
+        threshold (float): Minimum cosine similarity for a hit.
+        capacity (int): Number of slots in the matrix.
+        namespace (str): Identifies model, instructions, vector store and
+            embedder; a cache written under another namespace is discarded.
+    """
+
+    def __init__(self, directory, embedder, threshold, capacity, namespace=""):
+        self.directory = directory
+        self.embedder = embedder
+        self.threshold = threshold
+        self.capacity = capacity
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(
+            os.path.join(directory, "answers.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " slot INTEGER PRIMARY KEY, question TEXT, deltas TEXT, sources TEXT)"
+        )
+        meta = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        if meta.get("namespace", namespace) != namespace or int(meta.get("capacity", capacity)) != capacity:
+            self._reset()
+            meta = {}
+        self.count = int(meta.get("count", 0))
+        self.next_slot = int(meta.get("next_slot", 0))
+        if "dim" in meta:
+            self._open_matrix(int(meta["dim"]), "r+")
+
+    @property
+    def _matrix_path(self):
+        return os.path.join(self.directory, "embeddings.f32")
+
+    def _reset(self):
+        self._db.execute("DELETE FROM meta")
+        self._db.execute("DELETE FROM answers")
+        if os.path.exists(self._matrix_path):
+            os.remove(self._matrix_path)
+
+    def _open_matrix(self, dim, mode):
+        self._matrix = np.memmap(self._matrix_path, dtype=np.float32, mode=mode, shape=(self.capacity, dim))
+
+    def _save_meta(self):
+        rows = {
+            "namespace": self.namespace,
+            "capacity": self.capacity,
+            "dim": self._matrix.shape[1],
+            "count": self.count,
+            "next_slot": self.next_slot,
+        }
+        self._db.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [(k, str(v)) for k, v in rows.items()],
+        )
+
+    def embed(self, text):
+        return self.embedder([text])[0]
+
+    def lookup(self, vector):
+        """Return the cached answer closest to `vector` if it clears the threshold."""
+        best = None
+        with self._lock:
+            # A vector of another size comes from another embedder: nothing stored can match it
+            if self._matrix is not None and self.count and self._matrix.shape[1] == len(vector):
+                scores = self._matrix[:self.count] @ vector
+                slot = int(np.argmax(scores))
+                if scores[slot] >= self.threshold:
+                    row = self._db.execute(
+                        "SELECT deltas, sources FROM answers WHERE slot = ?", (slot,)
+                    ).fetchone()
+                    if row is not None:
+                        best = {"deltas": json.loads(row[0]), "sources": json.loads(row[1])}
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def add(self, question, vector, deltas, sources):
+        with self._lock:
+            if self._matrix is not None and self._matrix.shape[1] != len(vector):
+                self._matrix = None
+                self._reset()
+                self.count = self.next_slot = 0
+            if self._matrix is None:
+                self._open_matrix(len(vector), "w+")
+            slot = self.next_slot
+            self._matrix[slot] = vector
+            self._matrix.flush()
+            self._db.execute(
+                "INSERT OR REPLACE INTO answers (slot, question, deltas, sources) VALUES (?, ?, ?, ?)",
+                (slot, question, json.dumps(list(deltas), ensure_ascii=False), json.dumps(sorted(sources))),
+            )
+            self.next_slot = (slot + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            self._save_meta()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": self.count}
+
+
+def make_cache(namespace):
+    """Build the cache when `SEMANTIC_CACHE` is on, else return None."""
+    if not SEMANTIC_CACHE:
+        return None
+    return SemanticCache(
+        SEMANTIC_CACHE_DIR,
+        make_embedder(SEMANTIC_CACHE_EMBEDDER),
+        SEMANTIC_CACHE_THRESHOLD,
+        SEMANTIC_CACHE_SIZE,
+        namespace=f"{namespace}:{embedder_id(SEMANTIC_CACHE_EMBEDDER)}",
+    )
@@ -0,0 +1,162 @@
+"""
+Coalescing of identical in-flight chat requests ("single flight").
+
+When the same payload is already streaming from the Responses API, a new
+request does not open a second upstream stream: it replays the deltas the
+first one (the leader) received so far and then follows it live, up to the
+final sources. Followers can be threads (Flask) or coroutines (ASGI).
+
+Configuration (environment variables):
+    SINGLE_FLIGHT  on | off (default on)
+"""
+import asyncio
+import os
+import threading
+
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "on").lower()
+
+
+class FlightError(Exception):
+    """The leader's upstream stream failed or was abandoned before it completed."""
+
+
+class Flight:
+    """
+    The answer of one upstream stream as it arrives.
+
+    The leader calls `publish` per delta and ends with `finish` or `fail`;
+    followers iterate over `follow()` (threads) or `afollow()` (asyncio).
+    """
+
+    def __init__(self):
+        self.deltas = []
+        self.sources = set()
+        self.response_id = None
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def _notify(self):
+        """Wake all followers. Caller holds the condition."""
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def publish(self, delta):
+        with self._cond:
+            self.deltas.append(delta)
+            self._notify()
+
+    def finish(self, sources, response_id=None):
+        with self._cond:
+            self.sources = set(sources)
+            self.response_id = response_id
+            self.done = True
+            self._notify()
+
+    def fail(self, error):
+        with self._cond:
+            if not self.done:
+                self.error = error
+                self.done = True
+                self._notify()
+
+    def follow(self, timeout=None):
+        """
+        Yield every delta, first the ones already received, then live ones.
+
+        Args:
+            timeout (callable, optional): Seconds to wait for the next delta
+                (None = indefinitely); None is yielded when they pass.
+
+        Raises:
+            FlightError: The leader failed; the deltas so far were yielded.
+        """
+        i = 0
+        while True:
+            with self._cond:
+                while len(self.deltas) <= i and not self.done:
+                    if not self._cond.wait(timeout() if timeout else None):
+                        break
+                batch, done = self.deltas[i:], self.done
+            i += len(batch)
+            if not batch and not done:
+                yield None
+                continue
+            yield from batch
+            if done:
+                break
+        if self.error is not None:
+            raise FlightError(str(self.error))
+
+    async def afollow(self):
+        """Async counterpart of `follow`, for followers on an event loop."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            i = 0
+            while True:
+                waiter[1].clear()
+                with self._cond:
+                    batch, done = self.deltas[i:], self.done
+                i += len(batch)
+                for delta in batch:
+                    yield delta
+                if done:
+                    break
+                if not batch:
+                    await waiter[1].wait()
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        if self.error is not None:
+            raise FlightError(str(self.error))
+
+
+class SingleFlight:
+    """
+    Table of in-flight requests by key (the payload hash of `response_cache.cache_key`).
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def join(self, key):
+        """
+        Lead or follow the flight for `key`.
+
+        Returns:
+            tuple: (Flight, True when the caller leads and must stream it
+            and call `land` afterwards)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self._stats["followers"] += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self._stats["leaders"] += 1
+            return flight, True
+
+    def land(self, key, flight):
+        """Remove a finished or failed flight, so new requests start their own."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._flights)}
+
+
+def make_single_flight():
+    """Create the table selected by `SINGLE_FLIGHT`, or None when it is off."""
+    if SINGLE_FLIGHT in ("off", "0", "false", "none"):
+        return None
+    return SingleFlight()
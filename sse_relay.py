@@ -0,0 +1,396 @@
+"""
+Low-overhead relay of the upstream Responses stream to the browser.
+
+Per upstream line the chat path used to decode the whole JSON event and
+per token it encoded and wrote one tiny SSE frame. This module keeps the
+frames the browser sees the same, but makes the per-token work cheaper:
+
+- `parse_data_line` looks for the event types the relay uses before
+  decoding; every other event (response.created, output_text.done with the
+  full text, ...) is skipped without a JSON decode.
+- JSON goes through orjson when it is installed.
+- `DeltaBatcher` merges the deltas that arrive within a short window into
+  one `data:` frame (the browser appends `content`, so merged text renders
+  the same). The first delta is always sent right away, and pending text is
+  sent when its window ends even if the upstream pauses: `with_ticks` /
+  `awith_ticks` wake the relay at the batcher's deadline.
+- `SSECompressor` gzip/deflate-compresses the SSE body for clients that
+  accept it, flushing after every write so frames are not held back.
+
+Run `python sse_relay.py` for a micro-benchmark of the relay CPU per token.
+
+Configuration (environment variables):
+    SSE_JSON            auto | orjson | json (default auto: orjson when installed)
+    SSE_COALESCE_MS     window in which deltas are merged into one frame, 0 = off (default 30)
+    SSE_FLASK_COALESCE_MS
+                        the same window for upstream streams relayed by the Flask app
+                        (default 0 = off). Sending merged text on time during an
+                        upstream pause takes a reader thread per stream there
+                        (`with_ticks`), doubling the threads per chat on the sync
+                        server; the ASGI app, followers and cached replays need no
+                        extra thread and use SSE_COALESCE_MS
+    SSE_COALESCE_BYTES  frame size that is sent without waiting for the window (default 1024)
+    SSE_COMPRESSION     off | gzip | deflate | auto (default off; auto prefers gzip)
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+SSE_JSON = os.getenv("SSE_JSON", "auto").lower()
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "30"))
+SSE_FLASK_COALESCE_MS = float(os.getenv("SSE_FLASK_COALESCE_MS", "0"))
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "1024"))
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "off").lower()
+
+if SSE_JSON == "json":
+    orjson = None
+else:
+    try:
+        import orjson
+    except ImportError:
+        if SSE_JSON == "orjson":
+            raise
+        orjson = None
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    loads = json.loads
+    dumps = json.dumps
+
+# Returned by `parse_data_line` for the upstream's [DONE] marker
+DONE = object()
+
+# Event types the relay acts on; any other event is skipped undecoded
+RELAYED_TYPES = ("response.output_text.delta", "response.output_item.done", "response.completed")
+_RELAYED_BYTES = tuple(t.encode() for t in RELAYED_TYPES)
+
+
+def parse_data_line(raw):
+    """
+    Decode one upstream SSE line if it carries an event the relay uses.
+
+    Args:
+        raw (bytes | str): The line, without its line ending.
+
+    Returns:
+        The decoded event (dict), `DONE` for the [DONE] marker, or None for
+        other lines (comments, `event:` lines, events of other types).
+    """
+    if isinstance(raw, bytes):
+        if not raw.startswith(b"data: "):
+            return None
+        data = raw[6:]
+        if data.startswith(b"[DONE]"):
+            return DONE
+        markers = _RELAYED_BYTES
+    else:
+        if not raw or not raw.startswith("data: "):
+            return None
+        data = raw[6:]
+        if data.startswith("[DONE]"):
+            return DONE
+        markers = RELAYED_TYPES
+    # A substring test is far cheaper than a decode; the type is checked again after decoding
+    delta, item_done, completed = markers
+    if delta not in data and item_done not in data and completed not in data:
+        return None
+    if orjson is None and isinstance(data, bytes):
+        data = data.decode()  # json.loads would detect the encoding first
+    event = loads(data)
+    return event if event.get("type") in RELAYED_TYPES else None
+
+
+def delta_frame(text):
+    return f"data: {dumps({'content': text})}\n\n"
+
+
+class DeltaBatcher:
+    """
+    Merge text deltas into fewer SSE frames.
+
+    A frame is emitted when a delta arrives after the window has passed
+    since the oldest pending one, or when the pending text reaches
+    `max_bytes`. The first delta of a stream is never held back, so the
+    time to first token does not change.
+
+    Args:
+        window_ms (float): Coalescing window; 0 sends every delta as its own frame.
+        max_bytes (int): Pending text size that is sent right away.
+    """
+
+    def __init__(self, window_ms=SSE_COALESCE_MS, max_bytes=SSE_COALESCE_BYTES):
+        self.window = window_ms / 1000.0
+        self.max_bytes = max_bytes
+        self._pending = []
+        self._size = 0
+        self._since = None
+        self._sent_first = False
+
+    def add(self, delta, now=None):
+        """Queue a delta; returns a frame to send now, or None."""
+        if not self.window:
+            return delta_frame(delta)
+        now = time.monotonic() if now is None else now
+        if not self._sent_first:
+            self._sent_first = True
+            return delta_frame(delta)
+        if not self._pending:
+            self._since = now
+        self._pending.append(delta)
+        self._size += len(delta)
+        if self._size >= self.max_bytes or now - self._since >= self.window:
+            return self.flush()
+        return None
+
+    def timeout(self, now=None):
+        """Seconds until the pending text is due, or None when nothing is pending."""
+        if not self._pending:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self._since + self.window - now)
+
+    def flush(self):
+        """The pending deltas as one frame, or None when nothing is pending."""
+        if not self._pending:
+            return None
+        frame = delta_frame("".join(self._pending))
+        self._pending = []
+        self._size = 0
+        return frame
+
+
+def with_ticks(items, timeout):
+    """
+    Iterate `items` (a blocking iterator) on a helper thread, yielding None
+    whenever `timeout()` seconds pass without an item.
+
+    Args:
+        items: Iterator of non-None items, e.g. the upstream lines.
+        timeout (callable): Seconds to wait for the next item, or None to
+            wait indefinitely; typically `DeltaBatcher.timeout`.
+    """
+    received = queue.SimpleQueue()
+    end = object()
+
+    def read():
+        try:
+            for item in items:
+                received.put(item)
+        except BaseException as e:  # handed to the consumer
+            received.put(_Failure(e))
+        received.put(end)
+
+    threading.Thread(target=read, daemon=True).start()
+    while True:
+        try:
+            item = received.get(timeout=timeout())
+        except queue.Empty:
+            yield None
+            continue
+        if item is end:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+async def awith_ticks(items, timeout):
+    """Async counterpart of `with_ticks` for an async iterator, without a thread."""
+    iterator = items.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                # Not cancelled on a tick: cancelling a read can break the stream
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait((pending,), timeout=timeout())
+            if not done:
+                yield None
+                continue
+            task, pending = pending, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def negotiate_encoding(accept_encoding, setting=SSE_COMPRESSION):
+    """The content coding to use for an SSE body ('gzip', 'deflate' or None)."""
+    if setting in ("off", "0", "false", "none", ""):
+        return None
+    accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+    candidates = ("gzip", "deflate") if setting == "auto" else (setting,)
+    for coding in candidates:
+        if coding in accepted:
+            return coding
+    return None
+
+
+class SSECompressor:
+    """
+    Streaming gzip/deflate encoder that flushes after every write.
+
+    Args:
+        coding (str): 'gzip' or 'deflate' (zlib format, as browsers expect).
+    """
+
+    def __init__(self, coding, level=6):
+        wbits = 31 if coding == "gzip" else 15
+        self.coding = coding
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, text):
+        data = text.encode() if isinstance(text, str) else text
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compress_frames(frames, coding):
+    """Compress a stream of SSE frames (Flask response body); closes `frames` when closed itself."""
+    compressor = SSECompressor(coding)
+    try:
+        for frame in frames:
+            yield compressor.compress(frame)
+    except GeneratorExit:
+        frames.close()
+        raise
+    yield compressor.finish()
+
+
+def compressing_send(send, coding):
+    """Wrap an ASGI `send` callable so the response body is compressed with `coding`."""
+    compressor = SSECompressor(coding)
+
+    async def wrapped(message):
+        if message["type"] == "http.response.start":
+            headers = [(k, v) for k, v in message.get("headers", []) if k.lower() != b"content-length"]
+            headers += [(b"content-encoding", coding.encode()), (b"vary", b"accept-encoding")]
+            message = {**message, "headers": headers}
+        elif message["type"] == "http.response.body":
+            body = compressor.compress(message.get("body", b""))
+            if not message.get("more_body", False):
+                body += compressor.finish()
+            message = {**message, "body": body}
+        await send(message)
+
+    return wrapped
+
+
+# --------- micro-benchmark ---------
+
+def _sample_stream(tokens=400):
+    """Upstream lines of one answer, as the Responses API sends them."""
+    events = [{"type": "response.created", "response": {"id": "resp_bench", "status": "in_progress"}}]
+    events.append({"type": "response.output_item.done", "output_index": 0,
+                   "item": {"type": "file_search_call", "status": "completed",
+                            "results": [{"filename": f"Bron_{i}.pdf", "score": 0.8, "text": "x" * 400}
+                                        for i in range(5)]}})
+    words = [" zorg", " technologie", " studenten", " leeruitkomst", " client", " ë", " de"]
+    text = []
+    for i in range(tokens):
+        delta = words[i % len(words)]
+        text.append(delta)
+        events.append({"type": "response.output_text.delta", "item_id": "msg_bench", "output_index": 1,
+                       "content_index": 0, "delta": delta, "sequence_number": i})
+    events.append({"type": "response.output_text.done", "output_index": 1, "text": "".join(text)})
+    events.append({"type": "response.completed", "response": {"id": "resp_bench", "status": "completed"}})
+    lines = []
+    for event in events:
+        lines.append(f"event: {event['type']}".encode())
+        lines.append(f"data: {json.dumps(event)}".encode())
+        lines.append(b"")
+    lines.append(b"data: [DONE]")
+    return lines, tokens
+
+
+def _relay_baseline(lines):
+    """The relay as it was: decode every line, decode every event, one frame per delta."""
+    out = []
+    for raw in lines:
+        line = raw.decode("utf-8")
+        if not line.startswith("data: "):
+            continue
+        data = line[6:].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if chunk.get("type") == "response.output_text.delta":
+            out.append(f"data: {json.dumps({'content': chunk['delta']})}\n\n")
+    return out
+
+
+def _relay_optimized(lines, window_ms, token_interval=0.02):
+    out = []
+    batcher = DeltaBatcher(window_ms)
+    now = 0.0
+    for raw in lines:
+        event = parse_data_line(raw)
+        if event is None:
+            continue
+        if event is DONE:
+            break
+        if event["type"] == "response.output_text.delta":
+            now += token_interval
+            frame = batcher.add(event["delta"], now)
+            if frame:
+                out.append(frame)
+    frame = batcher.flush()
+    if frame:
+        out.append(frame)
+    return out
+
+
+def benchmark(tokens=400, repeat=200):
+    """
+    Time the relay CPU per token: baseline vs. pre-check/orjson vs. with coalescing.
+
+    Returns:
+        dict: Per variant the microseconds per token, frames and bytes per answer.
+    """
+    lines, n = _sample_stream(tokens)
+    variants = {
+        "baseline": lambda: _relay_baseline(lines),
+        "precheck": lambda: _relay_optimized(lines, 0),
+        f"precheck+coalesce_{SSE_COALESCE_MS or 30:g}ms": lambda: _relay_optimized(lines, SSE_COALESCE_MS or 30),
+    }
+    results = {}
+    for name, run in variants.items():
+        run()  # warm-up
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            frames = run()
+        elapsed = time.perf_counter() - t0
+        body = "".join(frames)
+        results[name] = {
+            "us_per_token": round(elapsed / repeat / n * 1e6, 2),
+            "frames": len(frames),
+            "bytes": len(body.encode()),
+            "gzip_bytes": len(b"".join(SSECompressor("gzip").compress(f) for f in frames)),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    print(f"JSON backend: {'orjson' if orjson is not None else 'json'}")
+    for name, result in benchmark().items():
+        print(f"{name:28} {result['us_per_token']:7.2f} us/token  {result['frames']:4} frames  "
+              f"{result['bytes']:6} bytes  {result['gzip_bytes']:6} bytes gzipped (flushed per frame)")
@@ -1,10 +1,11 @@
 // ====== Configuration ======
 const MAX_CONTEXT_MESSAGES = 5;
-const CITATIONS_DOWNLOAD_BASE = 'http://localhost:7000/';
+const CITATIONS_DOWNLOAD_BASE = '/docs/';
 
 // ====== State ======
 const context = [];               // rolling context buffer
 let abortController = null;       // in-flight request cancellation
+let sessionId = newSessionId();   // server-side conversation history key
 
 // ====== DOM refs ======
 const messagesDiv     = document.getElementById('messages');
@@ -27,6 +28,20 @@ const ICON_CHECK = `
 
 // ====== Utilities ======
 
+/** The server is at capacity; retryAfter is in seconds (may be null). */
+class BusyError extends Error {
+  constructor(retryAfter) {
+    super('busy');
+    this.retryAfter = retryAfter;
+  }
+}
+
+/** Random id for the server-side conversation (randomUUID needs a secure context). */
+function newSessionId() {
+  if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 /** Scroll the container so that the given message is at the top, with bottom padding. */
 function scrollToBottomWithPadding(msgEl) {
   if (!msgEl) return;
@@ -189,10 +204,13 @@ async function sendMessage() {
     const response = await fetch('/api/openai/response', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ text: payload }),
+      body: JSON.stringify({ text: payload, session_id: sessionId }),
       signal: abortController.signal,
     });
 
+    if (response.status === 429 || response.status === 503) {
+      throw new BusyError(response.headers.get('Retry-After'));
+    }
     if (!response.ok || !response.body) {
       throw new Error(await response.text());
     }
@@ -220,6 +238,24 @@ async function sendMessage() {
           } catch (e) {
             console.warn('Bad data frame:', chunk, e);
           }
+        } else if (chunk.startsWith('event: queue')) {
+          // Waiting for a free slot: { position: number }
+          try {
+            const { position } = JSON.parse(chunk.split('\ndata: ')[1]);
+            bubble.textContent = `Even geduld, je staat in de wachtrij (plek ${position})...`;
+          } catch (e) {
+            console.warn('Bad queue frame:', chunk, e);
+          }
+        } else if (chunk.startsWith('event: error')) {
+          // Server could not answer: { error: 'busy' | 'upstream', retry_after }
+          let info = {};
+          try {
+            info = JSON.parse(chunk.split('\ndata: ')[1]);
+          } catch (e) {
+            console.warn('Bad error frame:', chunk, e);
+          }
+          if (info.error === 'busy') throw new BusyError(info.retry_after);
+          throw new Error(info.error || 'stream error');
         } else if (chunk.startsWith('sources: ')) {
           // Final citations frame: ["file1.pdf", ...]
           try {
@@ -259,6 +295,9 @@ async function sendMessage() {
       // Silently finalize the bubble after a manual stop
       bubble.classList.remove('loading');
       context.push({ role: 'assistant', content: bubble.textContent });
+    } else if (err instanceof BusyError) {
+      bubble.classList.remove('loading');
+      bubble.textContent = '⚠️ Het is op dit moment erg druk. Probeer het over een minuutje opnieuw.';
     } else {
       console.error(err);
       bubble.classList.remove('loading');
@@ -318,8 +357,14 @@ resetBtn.addEventListener('click', () => {
   // 2) Clear chat messages
   messagesDiv.innerHTML = '';
 
-  // 3) Clear context buffer
+  // 3) Clear context buffer and start a new server-side conversation
   context.length = 0;
+  fetch('/api/conversation/reset', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ session_id: sessionId }),
+  }).catch(() => {});
+  sessionId = newSessionId();
 
   // 4) Clear input & show prompts
   userInput.value = '';
@@ -0,0 +1,230 @@
+"""
+Process-wide HTTP clients for calls to the OpenAI API.
+
+Both clients keep a bounded pool of keep-alive connections, so a chat turn
+reuses an open TCP/TLS connection instead of paying a new handshake before
+the first token. Requests that fail with 429/5xx (or cannot connect) are
+retried with exponential backoff before any byte is handed to the caller.
+
+Configuration (environment variables):
+    UPSTREAM_POOL_SIZE        max pooled connections per host (default 32)
+    UPSTREAM_CONNECT_TIMEOUT  connect timeout in seconds (default 10)
+    UPSTREAM_READ_TIMEOUT     read timeout in seconds (default 120)
+    UPSTREAM_RETRIES          retries on connect errors and 429/5xx (default 3)
+    UPSTREAM_BACKOFF          backoff factor in seconds (default 0.5)
+"""
+import asyncio
+import contextlib
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "10"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "120"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "3"))
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", "0.5"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class PoolStats:
+    """
+    Thread-safe counters for the upstream connection pools.
+
+    hits:       request served on an already open keep-alive connection
+    misses:     request that had to open a new connection
+    reconnects: pooled connection found dropped and opened again
+    retries:    request retried after a connect error or 429/5xx
+    """
+
+    FIELDS = ("hits", "misses", "reconnects", "retries")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def incr(self, field, n=1):
+        with self._lock:
+            self._counts[field] += n
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+stats = PoolStats()
+
+
+class _CountingPoolMixin:
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn._upstream_new = True
+        return conn
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=timeout)
+        if getattr(conn, "_upstream_new", False):
+            conn._upstream_new = False
+            stats.incr("misses")
+        elif getattr(conn, "sock", None) is None:
+            # urllib3 closes a dropped keep-alive connection and reopens it on use
+            stats.incr("reconnects")
+        else:
+            stats.incr("hits")
+        return conn
+
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class CountingRetry(Retry):
+    def increment(self, *args, **kwargs):
+        new_retry = super().increment(*args, **kwargs)
+        stats.incr("retries")
+        return new_retry
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report to `stats`."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the shared keep-alive `requests.Session`, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = CountingRetry(
+                    total=UPSTREAM_RETRIES,
+                    connect=UPSTREAM_RETRIES,
+                    read=0,  # never replay a request whose response already started
+                    status=UPSTREAM_RETRIES,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=None,  # the Responses API is called with POST
+                    backoff_factor=UPSTREAM_BACKOFF,
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = PooledAdapter(
+                    pool_connections=4,
+                    pool_maxsize=UPSTREAM_POOL_SIZE,
+                    pool_block=False,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def post(url, **kwargs):
+    """`requests.post` on the shared session with the configured timeouts."""
+    kwargs.setdefault("timeout", (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT))
+    return get_session().post(url, **kwargs)
+
+
+# --------- asyncio client (used by asgi_app) ---------
+
+_async_client = None
+
+
+def get_async_client():
+    """Return the shared `httpx.AsyncClient`, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        import httpx
+
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_POOL_SIZE,
+                max_keepalive_connections=UPSTREAM_POOL_SIZE,
+            ),
+        )
+    return _async_client
+
+
+async def aclose_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return UPSTREAM_BACKOFF * (2 ** attempt)
+
+
+@contextlib.asynccontextmanager
+async def async_stream_post(url, **kwargs):
+    """
+    Async streamed POST with the same retry policy as the shared session.
+
+    Yields the `httpx.Response` once a non-retryable status arrived; the body
+    has not been read yet at that point.
+    """
+    import httpx
+
+    client = get_async_client()
+    connected = False
+
+    async def trace(event_name, info):
+        nonlocal connected
+        if event_name == "connection.connect_tcp.complete":
+            connected = True
+
+    extensions = {"trace": trace}
+    attempt = 0
+    while True:
+        connected = False
+        request = client.build_request("POST", url, extensions=extensions, **kwargs)
+        try:
+            response = await client.send(request, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt >= UPSTREAM_RETRIES:
+                raise
+            stats.incr("retries")
+            await asyncio.sleep(_retry_delay(attempt))
+            attempt += 1
+            continue
+
+        stats.incr("misses" if connected else "hits")
+        if response.status_code in RETRY_STATUSES and attempt < UPSTREAM_RETRIES:
+            await response.aread()  # drain the error body so the connection is reused
+            await response.aclose()
+            stats.incr("retries")
+            await asyncio.sleep(_retry_delay(attempt, response))
+            attempt += 1
+            continue
+        break
+
+    try:
+        yield response
+    finally:
+        await response.aclose()
@@ -1,16 +1,29 @@
+import argparse
+import base64
+import hashlib
+import json
 import os
 import re
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import urlparse, urljoin, urlencode
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 
+from crawl_state import CrawlState, link_or_copy
+from rate_limit import KeyedTokenBuckets
+
 INDEX = "https://www.vilans.nl/kennisbank-digitale-zorg/technologieen"
-OUT_DIR = r"C:\Users\20203666\Documents\RIF\vilans webscrapped downloads"
+OUT_DIR = os.getenv("VILANS_OUT_DIR", r"C:\Users\20203666\Documents\RIF\vilans webscrapped downloads")
 HEADERS = {"User-Agent": "Mozilla/5.0 (VilansScraper/1.1)"}
+# Read size of file downloads and attempts per file (interrupted attempts resume)
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+DOWNLOAD_ATTEMPTS = int(os.getenv("DOWNLOAD_ATTEMPTS", "4"))
 
 EXT_RE = re.compile(r"\.(pdf|docx?|xlsx?|pptx?)(?:$|[?#])", re.I)
-os.makedirs(OUT_DIR, exist_ok=True)
 tech_urls = [
     "https://www.vilans.nl/kennisbank-digitale-zorg/technologieen/asset-tracking-hulpmiddelen",
     "https://www.vilans.nl/kennisbank-digitale-zorg/technologieen/automatisch-douchesysteem",
@@ -48,15 +61,166 @@ def fetch(url, session, **kwargs):
     r.raise_for_status()
     return r
 
-def download(url, dest, referer, session):
-    if os.path.exists(dest):
-        return
-    with session.get(url, headers={**HEADERS, "Referer": referer}, stream=True, timeout=90) as r:
-        r.raise_for_status()
-        with open(dest, "wb") as f:
-            for chunk in r.iter_content(1024 * 32):
-                if chunk:
-                    f.write(chunk)
+class IncompleteDownload(Exception):
+    """A transfer ended short of the announced length or did not match its digest."""
+
+
+def _total_size(r):
+    """Full size of the resource from Content-Range (206) or Content-Length (200), None if unknown."""
+    if r.status_code == 206:
+        total = r.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else None
+
+
+def _announced_sha256(r):
+    """SHA-256 the server announced in Repr-Digest or Digest, as hex, or None."""
+    for name in ("Repr-Digest", "Digest"):
+        for part in r.headers.get(name, "").split(","):
+            algo, _, value = part.strip().partition("=")
+            if algo.lower() == "sha-256" and value:
+                try:
+                    return base64.b64decode(value.strip(":")).hex()
+                except ValueError:
+                    return None
+    return None
+
+
+def _read_part_meta(part):
+    try:
+        with open(part + ".json", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _discard_part(part):
+    for path in (part, part + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def fetch_file(url, dest, headers, session):
+    """
+    Stream `url` into `dest + ".part"` and rename it to `dest` once it is complete.
+
+    An interrupted transfer keeps the part file (plus the validator it was
+    started with in `.part.json`). The next attempt, in this call or in a later
+    crawl, continues it with a Range request guarded by If-Range, so a file
+    that changed on the server meanwhile is fetched again from the start.
+    The result must match the announced length, and the announced SHA-256
+    when the server sends one.
+
+    Returns:
+        tuple: (response, bytes transferred, sha256 hex digest); the response
+        is None when the server answered 304 Not Modified.
+    """
+    part = dest + ".part"
+    written = 0
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        offset, meta = 0, _read_part_meta(part)
+        req_headers = {**headers, "Accept-Encoding": "identity"}
+        if meta and meta.get("url") == url and meta.get("validator") and os.path.exists(part):
+            offset = os.path.getsize(part)
+        if offset:
+            req_headers.pop("If-None-Match", None)
+            req_headers.pop("If-Modified-Since", None)
+            req_headers["Range"] = f"bytes={offset}-"
+            req_headers["If-Range"] = meta["validator"]
+        try:
+            with session.get(url, headers=req_headers, stream=True, timeout=90) as r:
+                if r.status_code == 304:
+                    return None, written, None
+                if r.status_code == 416 and offset:
+                    # Part file is not a prefix of the current resource
+                    _discard_part(part)
+                    continue
+                r.raise_for_status()
+
+                sha = hashlib.sha256()
+                if r.status_code == 206 and offset:
+                    print(f"resuming {os.path.basename(dest)} at {offset} bytes")
+                    with open(part, "rb") as f:
+                        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+                            sha.update(block)
+                    mode = "ab"
+                else:
+                    offset, mode = 0, "wb"
+                    etag = r.headers.get("ETag", "")
+                    validator = etag if etag and not etag.startswith("W/") else r.headers.get("Last-Modified")
+                    with open(part + ".json", "w", encoding="utf-8") as f:
+                        json.dump({"url": url, "validator": validator}, f)
+
+                size = offset
+                with open(part, mode) as f:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        sha.update(chunk)
+                        size += len(chunk)
+                        written += len(chunk)
+
+                expected = _total_size(r)
+                if expected is not None and size != expected:
+                    if size > expected:
+                        _discard_part(part)
+                    raise IncompleteDownload(f"got {size} of {expected} bytes")
+                digest = sha.hexdigest()
+                announced = _announced_sha256(r)
+                if announced and announced != digest:
+                    _discard_part(part)
+                    raise IncompleteDownload("SHA-256 does not match the announced digest")
+            os.replace(part, dest)
+            _discard_part(part)
+            return r, written, digest
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                IncompleteDownload) as e:
+            if attempt == DOWNLOAD_ATTEMPTS:
+                raise
+            print(f"retry {attempt}/{DOWNLOAD_ATTEMPTS - 1} for {os.path.basename(dest)}: {e}")
+            time.sleep(min(2 ** attempt, 30))
+    raise IncompleteDownload(f"could not download {url}")
+
+
+def download(url, dest, referer, session, state=None):
+    """
+    Download `url` to `dest`; returns the number of bytes transferred.
+
+    `dest` only appears once the file is complete (see `fetch_file`), so
+    an existing `dest` is never a truncated download. Without `state` an
+    existing `dest` is not fetched again. With a `CrawlState` the request is
+    conditional (If-None-Match/If-Modified-Since), a 304 costs no body, and
+    content already on disk under another name is hardlinked instead of
+    stored twice.
+    """
+    headers = {**HEADERS, "Referer": referer}
+    if state is None:
+        if os.path.exists(dest):
+            return 0
+        return fetch_file(url, dest, headers, session)[1]
+
+    entry = state.get(url)
+    if entry and entry["checked_at"] >= state.started and entry["path"] and os.path.exists(entry["path"]):
+        # Already checked in this run (linked from another technology page)
+        link_or_copy(entry["path"], dest)
+        state.count("deduplicated")
+        return 0
+
+    r, written, digest = fetch_file(url, dest, {**headers, **state.conditional_headers(entry)}, session)
+    if r is None:
+        link_or_copy(entry["path"], dest)
+        state.touch(url)
+        state.count("not_modified")
+        return 0
+
+    existing = state.path_for_hash(digest, exclude=dest)
+    if existing:
+        link_or_copy(existing, dest)
+        state.count("deduplicated")
+    else:
+        state.count("fetched")
+    state.record(url, r.headers.get("ETag"), r.headers.get("Last-Modified"), os.path.getsize(dest), digest, dest)
+    return written
 
 
 
@@ -100,9 +264,13 @@ def get_cloudinary_form_downloads_from_html(html, base_url):
 
 # --------- scraping ---------
 
-def scrape_detail(url, session):
-    r = fetch(url, session)
-    html = r.text
+def collect_downloads(url, html, out_dir=OUT_DIR):
+    """
+    Find the downloadable files on a technology page.
+
+    Returns:
+        tuple: (page title, list of (file url, destination path))
+    """
     soup = BeautifulSoup(html, "lxml")
 
     # Title
@@ -135,17 +303,26 @@ def scrape_detail(url, session):
             seen.add(fu)
             items.append((fu, name))
 
-    # Download
-    count = 0
+    downloads = []
     for fu, name in items:
         base, ext = os.path.splitext(name)
         if not ext:
             path_ext = os.path.splitext(urlparse(fu).path)[1]
             ext = path_ext or ".bin"
         fname = f"{tslug}--{slug(base, 100)}{ext.lower()}"
-        dest = os.path.join(OUT_DIR, fname)
+        downloads.append((fu, os.path.join(out_dir, fname)))
+    return title, downloads
+
+
+def scrape_detail(url, session, out_dir=OUT_DIR, state=None):
+    r = fetch(url, session)
+    title, downloads = collect_downloads(url, r.text, out_dir)
+
+    # Download
+    count = 0
+    for fu, dest in downloads:
         try:
-            download(fu, dest, referer=url, session=session)
+            download(fu, dest, referer=url, session=session, state=state)
             count += 1
         except requests.HTTPError as e:
             print(f"HTTP error {e.response.status_code} for {fu}")
@@ -154,23 +331,163 @@ def scrape_detail(url, session):
 
     print(f"✔ {title} — saved text + {count} file(s)")
 
-def main():
+def crawl_serial(links=tech_urls, out_dir=OUT_DIR, state=None):
+    os.makedirs(out_dir, exist_ok=True)
     with requests.Session() as session:
         # 1) collect all detail links
         idx = fetch(INDEX, session)
-        links = tech_urls
         print(f"Found {len(links)} tech pages")
         for i, u in enumerate(sorted(set(links)), 1):
             print(f"[{i}/{len(links)}] {u}")
             try:
-                scrape_detail(u, session)
+                scrape_detail(u, session, out_dir, state)
                 # be polite; optional light delay
                 time.sleep(0.5)
             except Exception as e:
                 print("Error on", u, ":", e)
                 continue
 
-    print("Done. Files in:", OUT_DIR)
+    print("Done. Files in:", out_dir)
+
+
+# --------- concurrent crawl ---------
+
+class CrawlStats:
+    """Thread-safe totals of a concurrent crawl: counters and seconds spent per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def add(self, stage, seconds, **counts):
+        with self._lock:
+            self.seconds[stage] += seconds
+            for name, n in counts.items():
+                self.counts[name] += n
+
+    def summary(self, wall, state=None):
+        c, s = self.counts, self.seconds
+        lines = [
+            f"{c['pages']} page(s), {c['files']} file(s) handled, {c['existing']} already present, "
+            f"{c['errors']} error(s)",
+            f"{c['bytes'] / 1e6:.1f} MB in {wall:.1f}s = {c['bytes'] / 1e6 / wall if wall else 0:.2f} MB/s",
+        ]
+        if state is not None:
+            st = state.stats
+            lines.append(
+                f"{st['fetched']} new/changed, {st['not_modified']} not modified (304), "
+                f"{st['deduplicated']} deduplicated"
+            )
+        for stage in ("rate_wait", "fetch_page", "parse", "download"):
+            lines.append(f"  {stage:<10} {s[stage]:8.2f}s total (summed over workers)")
+        return "\n".join(lines)
+
+
+def crawl_concurrent(urls, out_dir=OUT_DIR, workers=8, rate_per_host=4.0, burst=None, state=None):
+    """
+    Crawl technology pages and their downloads with a pool of threads.
+
+    Page fetches and file downloads share one worker pool, so downloads of
+    one page overlap with fetching the next. Politeness is per host: every
+    request first takes a token from that host's bucket (`rate_per_host`
+    requests/s) instead of sleeping a fixed time. With a `CrawlState`
+    downloads are conditional and deduplicated, see `download`.
+
+    Returns:
+        CrawlStats: Totals of the run.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    buckets = KeyedTokenBuckets(rate_per_host, burst)
+    stats = CrawlStats()
+    local = threading.local()
+    futures = []
+    futures_lock = threading.Lock()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+            local.session.mount("https://", HTTPAdapter(pool_maxsize=workers))
+            local.session.mount("http://", HTTPAdapter(pool_maxsize=workers))
+        return local.session
+
+    def polite(url):
+        t0 = time.perf_counter()
+        buckets[urlparse(url).netloc].acquire()
+        stats.add("rate_wait", time.perf_counter() - t0)
+
+    def download_job(fu, dest, referer):
+        if state is None and os.path.exists(dest):
+            stats.add("download", 0.0, existing=1)
+            return
+        polite(fu)
+        t0 = time.perf_counter()
+        try:
+            n = download(fu, dest, referer=referer, session=session(), state=state)
+            stats.add("download", time.perf_counter() - t0, files=1, bytes=n)
+        except requests.HTTPError as e:
+            stats.add("download", time.perf_counter() - t0, errors=1)
+            print(f"HTTP error {e.response.status_code} for {fu}")
+        except Exception as e:
+            stats.add("download", time.perf_counter() - t0, errors=1)
+            print(f"failed: {fu} -> {e}")
+
+    def page_job(url):
+        polite(url)
+        t0 = time.perf_counter()
+        try:
+            r = fetch(url, session())
+        except Exception as e:
+            stats.add("fetch_page", time.perf_counter() - t0, errors=1)
+            print("Error on", url, ":", e)
+            return
+        t1 = time.perf_counter()
+        title, downloads = collect_downloads(url, r.text, out_dir)
+        stats.add("fetch_page", t1 - t0, pages=1, bytes=len(r.content))
+        stats.add("parse", time.perf_counter() - t1)
+        print(f"✔ {title} — {len(downloads)} file(s) queued")
+        with futures_lock:
+            futures.extend(pool.submit(download_job, fu, dest, url) for fu, dest in downloads)
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with futures_lock:
+            futures.extend(pool.submit(page_job, u) for u in sorted(set(urls)))
+        # Page jobs add download jobs while running; wait until no new ones appear
+        done = 0
+        while True:
+            with futures_lock:
+                pending = futures[done:]
+                done = len(futures)
+            if not pending:
+                break
+            wait(pending)
+    print(stats.summary(time.perf_counter() - t_start, state))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the attachments of the Vilans technology pages.")
+    parser.add_argument("urls", nargs="*", default=tech_urls, help="technology pages (default: tech_urls)")
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--workers", type=int, default=8, help="concurrent requests; 1 = original serial crawl")
+    parser.add_argument("--rate", type=float, default=4.0, help="max requests per second per host")
+    parser.add_argument("--state", default=None,
+                        help="crawl state database (default: .crawl_state.sqlite3 in the output folder)")
+    parser.add_argument("--no-state", action="store_true", help="skip existing files instead of re-validating them")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    state = None
+    if not args.no_state:
+        state = CrawlState(args.state or os.path.join(args.out_dir, ".crawl_state.sqlite3"))
+
+    if args.workers > 1:
+        crawl_concurrent(args.urls, args.out_dir, args.workers, args.rate, state=state)
+        print("Done. Files in:", args.out_dir)
+        return
+    crawl_serial(args.urls, args.out_dir, state)
+
 
 if __name__ == "__main__":
     main()
@@ -2,15 +2,21 @@
 import os
 import time
 import base64
+import json
+import argparse
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, List, Optional, Union
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.common.keys import Keys
 from webdriver_manager.chrome import ChromeDriverManager
 
@@ -39,6 +45,10 @@ tech_urls = [
     "https://www.vilans.nl/kennisbank-digitale-zorg/technologieen/wondzorg-op-afstand"
 ]
 
+OUT_DIR = os.getenv("VILANS_PAGES_OUT_DIR", r"C:\Users\20203666\Documents\RIF\vilans webscrapped pages")
+
+RENDER_PHASES = ("load", "consent", "expand", "print")
+
 HEADER_LABELS = [
     "Wat is het?",
     "Zorgproces",
@@ -50,6 +60,12 @@ HEADER_LABELS = [
 ]
 
 
+@functools.lru_cache(maxsize=None)
+def chromedriver_path() -> str:
+    # Eén keer per proces de driver opzoeken/downloaden, niet per browser
+    return ChromeDriverManager().install()
+
+
 def build_driver(headless: bool = True) -> webdriver.Chrome:
     options = webdriver.ChromeOptions()
     if headless:
@@ -63,7 +79,7 @@ def build_driver(headless: bool = True) -> webdriver.Chrome:
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
 
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+    driver = webdriver.Chrome(service=Service(chromedriver_path()), options=options)
     driver.execute_cdp_cmd("Page.enable", {})  # nodig voor printToPDF
     return driver
 
@@ -74,7 +90,8 @@ def wait_ready(driver: webdriver.Chrome, timeout: int = 20):
     )
 
 
-def try_accept_cookies(driver: webdriver.Chrome, timeout: int = 5):
+def try_accept_cookies(driver: webdriver.Chrome, timeout: int = 5) -> bool:
+    """Click the CookieScript accept button; True when the banner is gone afterwards."""
     try:
         # Wacht tot de knop in de DOM staat
         btn = WebDriverWait(driver, timeout).until(
@@ -99,42 +116,82 @@ def try_accept_cookies(driver: webdriver.Chrome, timeout: int = 5):
         WebDriverWait(driver, 5).until_not(
             EC.presence_of_element_located((By.ID, "cookiescript_injected"))
         )
+        return True
     except TimeoutException:
         print("CookieScript accept-knop niet gevonden of niet weggegaan.")
-
-
-def find_header_elements(driver: webdriver.Chrome, labels: List[str]):
-    found = []
-    for label in labels:
-        # 1) Exacte match op gangbare header/knop elementen
-        xpath_exact = (
-            "//*[self::h1 or self::h2 or self::h3 or self::h4 or self::button or self::a or self::summary or @role='button']"
-            f"[normalize-space(.)='{label}']"
-        )
-        elems = driver.find_elements(By.XPATH, xpath_exact)
-
-        # 2) Zo niet gevonden: 'contains' (case-insensitive)
-        if not elems:
-            xpath_contains = (
-                "//*[self::h1 or self::h2 or self::h3 or self::h4 or self::button or self::a or self::summary or @role='button']"
-                f"[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{label.lower()}')]"
-            )
-            elems = driver.find_elements(By.XPATH, xpath_contains)
-
-        if elems:
-            found.append((label, elems[0]))
-    return found
-
-
-def click_or_scroll_to(driver: webdriver.Chrome, element):
-    driver.execute_script("arguments[0].scrollIntoView({behavior:'instant', block:'center'});", element)
-    try:
-        WebDriverWait(driver, 5).until(EC.element_to_be_clickable(element))
-        element.click()
-    except (TimeoutException, ElementClickInterceptedException):
-        # Als klikken niet kan (alleen header), dan is scrollen voldoende
-        pass
-    time.sleep(0.3)  # kleine pauze voor eventuele accordion-animaties
+        return False
+
+
+# Zoekt alle sectie-headers in één keer (zelfde volgorde als de oude XPath-aanpak: eerst exacte
+# tekst, dan 'bevat', hoofdletterongevoelig), klikt ze open en wacht tot de DOM stil is: geen
+# mutaties en geen lopende transitions/animaties gedurende quietMs, met timeoutMs als bovengrens.
+EXPAND_SECTIONS_JS = """
+(labels, quietMs, timeoutMs) => new Promise(resolve => {
+    const norm = s => (s || "").replace(/\\s+/g, " ").trim();
+    const nodes = Array.from(document.querySelectorAll("h1, h2, h3, h4, button, a, summary, [role=button]"));
+    const texts = nodes.map(n => norm(n.textContent));
+    const found = [];
+    for (const label of labels) {
+        let i = texts.indexOf(label);
+        if (i < 0) i = texts.findIndex(t => t.toLowerCase().includes(label.toLowerCase()));
+        if (i >= 0 && !found.includes(nodes[i])) found.push(nodes[i]);
+    }
+
+    let last = performance.now();
+    let running = 0;
+    const bump = () => { last = performance.now(); };
+    const start = () => { running++; bump(); };
+    const end = () => { running = Math.max(0, running - 1); bump(); };
+    const listeners = [["transitionrun", start], ["animationstart", start], ["transitionend", end],
+                       ["transitioncancel", end], ["animationend", end], ["animationcancel", end]];
+    listeners.forEach(([type, fn]) => document.addEventListener(type, fn, true));
+    const observer = new MutationObserver(bump);
+    observer.observe(document.documentElement, {subtree: true, childList: true, attributes: true, characterData: true});
+
+    let clicked = 0;
+    for (const el of found) {
+        try {
+            el.scrollIntoView({block: "center"});
+            el.click();
+            clicked++;
+        } catch (e) {}
+    }
+
+    const t0 = performance.now();
+    (function check() {
+        const now = performance.now();
+        const timedOut = now - t0 >= timeoutMs;
+        if (timedOut || (running === 0 && now - last >= quietMs)) {
+            observer.disconnect();
+            listeners.forEach(([type, fn]) => document.removeEventListener(type, fn, true));
+            resolve({found: found.length, clicked: clicked, waited_ms: Math.round(now - t0), timed_out: timedOut});
+        } else {
+            setTimeout(check, 20);
+        }
+    })();
+})
+"""
+
+
+def expand_sections(driver: webdriver.Chrome, labels: List[str], quiet_ms: int = 150, timeout: float = 5) -> dict:
+    """
+    Open all sections in `labels` with a single CDP call and wait until the page settles.
+
+    Returns:
+        dict: found/clicked header counts, waited_ms and whether the wait timed out.
+    """
+    result = driver.execute_cdp_cmd(
+        "Runtime.evaluate",
+        {
+            "expression": f"({EXPAND_SECTIONS_JS})({json.dumps(labels)}, {int(quiet_ms)}, {int(timeout * 1000)})",
+            "awaitPromise": True,
+            "returnByValue": True,
+        },
+    )
+    if "exceptionDetails" in result:
+        print(f"Secties openen mislukt: {result['exceptionDetails'].get('text')}")
+        return {"found": 0, "clicked": 0, "waited_ms": 0, "timed_out": False}
+    return result["result"]["value"]
 
 
 def save_pdf_via_cdp(driver: webdriver.Chrome, out_path: Path, landscape: bool = False):
@@ -168,6 +225,52 @@ def sanitize_filename(name: str) -> str:
     return cleaned or "pagina"
 
 
+def render_page(
+        driver: webdriver.Chrome,
+        url: str,
+        output_folder: str,
+        filename: Optional[str] = None,
+        accept_cookies: Union[bool, Callable[[webdriver.Chrome], bool]] = True,
+        timings: Optional[dict] = None,
+) -> Path:
+    """
+    Open `url` in `driver`, expand the sections and print the page to PDF.
+
+    `accept_cookies` may be a callable that handles the cookie banner
+    itself; it is called with the driver once the page has loaded.
+
+    Seconds spent per phase (RENDER_PHASES) and the number of opened
+    sections are stored in `timings` when a dict is passed.
+    """
+    timings = {} if timings is None else timings
+    t = time.perf_counter()
+    driver.get(url)
+    wait_ready(driver, 25)
+    timings["load"], t = time.perf_counter() - t, time.perf_counter()
+    if callable(accept_cookies):
+        accept_cookies(driver)
+    elif accept_cookies:
+        try_accept_cookies(driver)
+    timings["consent"], t = time.perf_counter() - t, time.perf_counter()
+
+    # alle headers in één keer openen en wachten tot de pagina stil is
+    expanded = expand_sections(driver, HEADER_LABELS)
+    timings["expand"], t = time.perf_counter() - t, time.perf_counter()
+    timings["sections"] = expanded["clicked"]
+
+    # bestandsnaam bepalen
+    title = driver.title or "pagina"
+    base = filename or sanitize_filename(title)
+    out_path = Path(output_folder) / f"{base}.pdf"
+
+    # PDF genereren en opslaan
+    save_pdf_via_cdp(driver, out_path)
+    timings["print"] = time.perf_counter() - t
+    phases = ", ".join(f"{phase} {timings[phase]:.2f}s" for phase in RENDER_PHASES)
+    print(f"PDF opgeslagen: {out_path} ({phases}, {expanded['clicked']} secties)")
+    return out_path
+
+
 def scrape_and_save(
         url: str,
         output_folder: str,
@@ -176,31 +279,200 @@ def scrape_and_save(
 ):
     driver = build_driver(headless=headless)
     try:
-        driver.get(url)
-        wait_ready(driver, 25)
-        try_accept_cookies(driver)
+        render_page(driver, url, output_folder, filename)
+    finally:
+        driver.quit()
 
-        # headers zoeken en openen/erheen scrollen
-        headers = find_header_elements(driver, HEADER_LABELS)
-        for label, el in headers:
-            click_or_scroll_to(driver, el)
 
-        # bestandsnaam bepalen
-        title = driver.title or "pagina"
-        base = filename or sanitize_filename(title)
-        out_path = Path(output_folder) / f"{base}.pdf"
+# --------- browser pool ---------
 
-        # PDF genereren en opslaan
-        save_pdf_via_cdp(driver, out_path)
-        print(f"PDF opgeslagen: {out_path}")
+class PooledDriver:
+    """A long-lived Chrome with the number of pages it rendered and its cookie state."""
+
+    def __init__(self, headless: bool):
+        self.driver = build_driver(headless=headless)
+        self.pages = 0
+        self.cookies_accepted = False
+
+    def handle_cookies(self, driver: webdriver.Chrome) -> bool:
+        """Accept the cookie banner of the page that was just loaded, if needed (render_page callback)."""
+        # Na de eerste geslaagde klik staat de consent-cookie in het profiel; alleen klikken als de
+        # banner op deze pagina toch terugkomt
+        if self.cookies_accepted and not driver.find_elements(By.ID, "cookiescript_injected"):
+            return True
+        self.cookies_accepted = try_accept_cookies(driver)
+        return self.cookies_accepted
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            pass
+
+
+class DriverPool:
+    """
+    Up to `size` headless Chrome instances shared by worker threads.
+
+    Drivers are started lazily, accept the cookie banner once, and are
+    replaced after `max_pages` pages or when a page crashed them.
+
+    Args:
+        size (int): Number of browsers.
+        max_pages (int): Pages per browser before it is restarted (limits
+            memory growth of long-running Chrome processes).
+        headless (bool): Run Chrome without a window.
+    """
+
+    def __init__(self, size: int = 4, max_pages: int = 25, headless: bool = True):
+        self.max_pages = max_pages
+        self.headless = headless
+        self._idle = queue.Queue()
+        for _ in range(size):
+            self._idle.put(None)  # plek voor een driver die nog gestart moet worden
+        self._lock = threading.Lock()
+        self._all = set()
+        self.started = 0
+        self.recycled = 0
+        self.crashed = 0
+
+    def _acquire(self) -> PooledDriver:
+        pooled = self._idle.get()
+        if pooled is None:
+            try:
+                pooled = PooledDriver(self.headless)
+            except Exception:
+                self._idle.put(None)
+                raise
+            with self._lock:
+                self._all.add(pooled)
+                self.started += 1
+        return pooled
+
+    def _discard(self, pooled: PooledDriver):
+        pooled.quit()
+        with self._lock:
+            self._all.discard(pooled)
+        self._idle.put(None)
+
+    def render(self, url: str, output_folder: str, filename: Optional[str] = None,
+               timings: Optional[dict] = None) -> Path:
+        """Render one page on a free driver (blocks until one is available)."""
+        pooled = self._acquire()
+        try:
+            out_path = render_page(pooled.driver, url, output_folder, filename,
+                                   accept_cookies=pooled.handle_cookies, timings=timings)
+        except TimeoutException:
+            # Pagina te traag, de browser zelf is nog bruikbaar
+            self._idle.put(pooled)
+            raise
+        except WebDriverException:
+            # Browser of tab gecrasht: weggooien, de volgende aanvraag start een nieuwe
+            with self._lock:
+                self.crashed += 1
+            self._discard(pooled)
+            raise
+        except Exception:
+            self._idle.put(pooled)
+            raise
+        pooled.pages += 1
+        if pooled.pages >= self.max_pages:
+            with self._lock:
+                self.recycled += 1
+            self._discard(pooled)
+        else:
+            self._idle.put(pooled)
+        return out_path
+
+    def close(self):
+        with self._lock:
+            drivers, self._all = list(self._all), set()
+        for pooled in drivers:
+            pooled.quit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def scrape_many(
+        urls: List[str],
+        output_folder: str,
+        workers: int = 4,
+        max_pages_per_driver: int = 25,
+        headless: bool = True,
+        attempts: int = 2,
+        timings_path: Optional[str] = None,
+):
+    """
+    Render `urls` to PDF in parallel on a pool of `workers` browsers.
+
+    Files are named like `main` does: 'Vilans kennisbank <last url part>'.
+    A page whose browser crashed is retried on a fresh one, up to `attempts` times.
+    Per-page phase timings are summarized at the end and, with `timings_path`,
+    appended to that file as JSON lines.
+    """
+    t_start = time.perf_counter()
+    ok, failed, pages = 0, [], []
+
+    def job(url):
+        name = url.rstrip("/").split("/")[-1]
+        for attempt in range(1, attempts + 1):
+            timings = {}
+            try:
+                pool.render(url, output_folder, f"Vilans kennisbank {name}", timings)
+                return {"url": url, **timings}
+            except WebDriverException as e:
+                if attempt == attempts:
+                    raise
+                print(f"Browser fout op {url}, opnieuw ({attempt}/{attempts - 1}): {e.__class__.__name__}")
+
+    with DriverPool(workers, max_pages_per_driver, headless) as pool, ThreadPoolExecutor(workers) as ex:
+        futures = {ex.submit(job, url): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                pages.append(future.result())
+                ok += 1
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"Mislukt: {futures[future]} -> {e}")
+
+    wall = time.perf_counter() - t_start
+    print(
+        f"{ok} pagina('s) in {wall:.1f}s ({ok / wall if wall else 0:.2f} pagina's/s) met {workers} browser(s); "
+        f"{pool.started} gestart, {pool.recycled} vervangen na --max-pages, {pool.crashed} gecrasht, "
+        f"{len(failed)} mislukt"
+    )
+    for phase in RENDER_PHASES:
+        values = sorted(page[phase] for page in pages)
+        if values:
+            print(f"  {phase:<8} gem. {sum(values) / len(values):.2f}s  max {values[-1]:.2f}s")
+    if timings_path:
+        with open(timings_path, "a", encoding="utf-8") as f:
+            for page in pages:
+                f.write(json.dumps({k: round(v, 3) if isinstance(v, float) else v for k, v in page.items()}) + "\n")
+    return failed
 
-    finally:
-        driver.quit()
 
 def main():
-    for url in tech_urls:
+    parser = argparse.ArgumentParser(description="Sla de Vilans technologiepagina's op als PDF.")
+    parser.add_argument("urls", nargs="*", default=tech_urls, help="pagina's (standaard: tech_urls)")
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--workers", type=int, default=4, help="aantal browsers; 1 = één browser per pagina zoals vroeger")
+    parser.add_argument("--max-pages", type=int, default=25, help="pagina's per browser voordat die opnieuw start")
+    parser.add_argument("--show", action="store_true", help="browser zichtbaar (niet headless)")
+    parser.add_argument("--timings", default=None, help="JSON-lines bestand voor de tijden per pagina en fase")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        scrape_many(args.urls, args.out_dir, args.workers, args.max_pages, headless=not args.show,
+                    timings_path=args.timings)
+        return
+    for url in args.urls:
         name = url.split("/")[-1]
-        scrape_and_save(url, r"C:\Users\20203666\Documents\RIF\vilans webscrapped pages", f'Vilans kennisbank {name}')
+        scrape_and_save(url, args.out_dir, f'Vilans kennisbank {name}', headless=not args.show)
 
 if __name__ == "__main__":
     main()